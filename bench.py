@@ -0,0 +1,311 @@
+# Micro-benchmarks for the pure hot functions in server.py.
+#
+#   python bench.py                              # default sizes, JSON lines on stdout
+#   python bench.py --territories 100,400,1600 --clients 50,300 --out runs.jsonl
+#   python bench.py grid --rows 40 --cols 40 > big.geojson
+#
+# Every measurement is one JSON object per line (bench name, parameters,
+# timings in ms, git revision), so runs can be appended to one file and
+# compared over time. The server module is imported from a temporary working
+# directory, so benchmarks never touch the real data/ directory.
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_grid_geojson(rows: int, cols: int, points_per_edge: int = 3, cell_deg: float = 0.002, jitter: float = 0.25, seed: int = 1) -> dict:
+    # Square-ish cells around the default map center. Corner nodes and edge
+    # points are derived from the grid position only, so both cells sharing an
+    # edge get exactly the same vertices (as a real hand-drawn map would).
+    rng = random.Random(seed)
+    lat0, lng0 = 50.05, 16.27
+    lng_cell = cell_deg / math.cos(math.radians(lat0))
+    nodes = {}
+    for r in range(rows + 1):
+        for c in range(cols + 1):
+            edge = r in (0, rows) or c in (0, cols)
+            dj = 0.0 if edge else jitter
+            nodes[(r, c)] = (
+                lng0 + (c + rng.uniform(-dj, dj)) * lng_cell,
+                lat0 + (r + rng.uniform(-dj, dj)) * cell_deg,
+            )
+
+    edge_points: dict[tuple, list[tuple[float, float]]] = {}
+
+    def edge(a: tuple[int, int], b: tuple[int, int]) -> list[tuple[float, float]]:
+        key = (a, b) if a <= b else (b, a)
+        pts = edge_points.get(key)
+        if pts is None:
+            (x1, y1), (x2, y2) = nodes[key[0]], nodes[key[1]]
+            erng = random.Random(hash(key) ^ seed)
+            pts = []
+            for k in range(1, points_per_edge + 1):
+                t = k / (points_per_edge + 1)
+                wobble = erng.uniform(-0.04, 0.04) * cell_deg
+                pts.append((x1 + (x2 - x1) * t + wobble, y1 + (y2 - y1) * t + wobble))
+            edge_points[key] = pts
+        return pts if a <= b else list(reversed(pts))
+
+    features = []
+    k = 0
+    for r in range(rows):
+        for c in range(cols):
+            k += 1
+            corners = [(r, c), (r, c + 1), (r + 1, c + 1), (r + 1, c)]
+            ring: list[list[float]] = []
+            for i in range(4):
+                a = corners[i]
+                b = corners[(i + 1) % 4]
+                ring.append(list(nodes[a]))
+                ring.extend(list(p) for p in edge(a, b))
+            ring.append(ring[0])
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": {"Text": str(k)},
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                }
+            )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def make_state(server, territories: int, teams: int, requests: int, events: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    rows = max(1, int(math.sqrt(territories)))
+    cols = max(1, (territories + rows - 1) // rows)
+    grid_name = f"grid_{rows}x{cols}.geojson"
+    path = os.path.join(server.DATA_DIR, grid_name)
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(make_grid_geojson(rows, cols, seed=seed), f)
+    team_ids = [f"t{i + 1}" for i in range(teams)]
+    n = rows * cols
+    state = {
+        "version": 1,
+        "config": {
+            "mapMode": "geo",
+            "territoriesGeojson": grid_name,
+            "territoriesGeojsonIdPrefix": "z",
+            "adminPin": "admin",
+            "gameStartMs": server.now_ms() - 3600 * 1000,
+            "gameLocked": False,
+        },
+        "teams": [{"id": t, "name": f"Tým {t}", "color": "#%06x" % rng.randrange(1 << 24), "pin": t} for t in team_ids],
+        "territories": [
+            {
+                "id": f"z{k + 1}",
+                "name": f"Území {k + 1}",
+                "ownerTeamId": rng.choice(team_ids) if rng.random() < 0.4 else None,
+                "tasks": {"claim": "Kolik je 1+1?"},
+                "capturedAtMs": server.now_ms() - rng.randrange(3600 * 1000),
+            }
+            for k in range(n)
+        ],
+        "claimRequests": [],
+        "claimVerifyRequests": [],
+        "territoryLocks": {},
+        "attackLocks": {},
+        "teamCooldowns": {},
+        "eventLog": [],
+        "teamStats": {t: {"captures": rng.randrange(20), "totalTimeMs": rng.randrange(10**7)} for t in team_ids},
+    }
+    for z in state["territories"]:
+        if z["ownerTeamId"] is None:
+            z["capturedAtMs"] = None
+    statuses = ["pending", "approved", "rejected", "rejected"]
+    for i in range(requests):
+        tid = f"z{rng.randrange(n) + 1}"
+        team = rng.choice(team_ids)
+        state["claimRequests"].append(
+            {
+                "id": f"cr_{i:08x}",
+                "territoryId": tid,
+                "teamId": team,
+                "question": "Kolik je 1+1?",
+                "answer": "2",
+                "status": rng.choice(statuses),
+                "rejectReason": None,
+                "cooldownUntilMs": None,
+                "createdAtMs": server.now_ms() - rng.randrange(3600 * 1000),
+                "resolvedAtMs": None,
+            }
+        )
+        state["claimVerifyRequests"].append(
+            {
+                "id": f"cv_{i:08x}",
+                "territoryId": tid,
+                "teamId": team,
+                "status": rng.choice(statuses),
+                "createdAtMs": server.now_ms() - rng.randrange(3600 * 1000),
+                "resolvedAtMs": None,
+                "expiresAtMs": None,
+                "lat": 50.08,
+                "lng": 16.3,
+            }
+        )
+    for i in range(events):
+        state["eventLog"].append(
+            {
+                "id": f"ev_{i:08x}",
+                "tsMs": server.now_ms() - (events - i) * 1000,
+                "kind": "claim",
+                "territoryId": f"z{rng.randrange(n) + 1}",
+                "teamIds": [rng.choice(team_ids)],
+                "result": "approved",
+            }
+        )
+    return state
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "minMs": round(samples[0], 4),
+        "medianMs": round(statistics.median(samples), 4),
+        "meanMs": round(statistics.fmean(samples), 4),
+        "p95Ms": round(samples[min(len(samples) - 1, int(0.95 * (len(samples) - 1) + 0.5))], 4),
+        "maxMs": round(samples[-1], 4),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmarks(args, emit) -> None:
+    import server
+
+    base = {"rev": git_revision(), "python": sys.version.split()[0], "ts": int(time.time())}
+
+    def record(name: str, params: dict, result: dict) -> None:
+        emit({"bench": name, **base, "params": params, **result})
+
+    for n in args.territories:
+        state = make_state(server, n, args.teams, args.requests, args.events, seed=args.seed)
+        params = {"territories": len(state["territories"]), "teams": args.teams, "requests": args.requests, "events": args.events}
+
+        config = state["config"]
+        geom_path = server.persisted_geometry_path(config, server.geojson_source_path(config))
+
+        def build() -> None:
+            # Without the persisted .geom file, or this would time a load.
+            server._geometry_cache.clear()
+            if geom_path and os.path.exists(geom_path):
+                os.remove(geom_path)
+            server.apply_geojson_territories(state)
+
+        def load() -> None:
+            server._geometry_cache.clear()
+            server.apply_geojson_territories(state)
+
+        record("apply_geojson_territories.build", params, measure(build, max(1, args.repeat // 10), warmup=0))
+        record("apply_geojson_territories.load", params, measure(load, max(1, args.repeat // 10)))
+        record("apply_geojson_territories.cached", params, measure(lambda: server.apply_geojson_territories(state), args.repeat))
+
+        admin = {"role": "admin"}
+        team = {"role": "team", "teamId": "t1"}
+        for role_name, session in (("admin", admin), ("team", team)):
+            for compact in (False, True):
+                record(
+                    f"sanitize_state_for_client.{role_name}.{'compact' if compact else 'full'}",
+                    params,
+                    measure(lambda: server.sanitize_state_for_client(state, session, compact=compact), args.repeat),
+                )
+        record(
+            "sanitize_state_for_client.team.polyline",
+            params,
+            measure(lambda: server.sanitize_state_for_client(state, team, geometry_encoding="polyline"), args.repeat),
+        )
+
+        rng = random.Random(args.seed)
+        ids = [z["id"] for z in state["territories"]]
+        record(
+            "is_adjacent_to_owned",
+            params,
+            measure(lambda: server.is_adjacent_to_owned(state, "t1", rng.choice(ids)), args.repeat),
+        )
+        record("write_state", params, measure(lambda: server.write_state(state), max(1, args.repeat // 2)))
+
+        for clients in args.clients:
+            b = server.Broadcaster()
+            for i in range(clients):
+                b.add_client(admin if i % 10 == 0 else {"role": "team", "teamId": f"t{i % args.teams + 1}"})
+            record(
+                "Broadcaster.broadcast_state",
+                {**params, "clients": clients},
+                measure(lambda: b.broadcast_state(state), max(1, args.repeat // 5)),
+            )
+
+
+def parse_sizes(text: str) -> list[int]:
+    return [int(x) for x in str(text).split(",") if x.strip()]
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "grid":
+        ap = argparse.ArgumentParser(prog="bench.py grid", description="Write a synthetic GeoJSON grid map to stdout.")
+        ap.add_argument("--rows", type=int, default=20)
+        ap.add_argument("--cols", type=int, default=20)
+        ap.add_argument("--points-per-edge", type=int, default=3)
+        ap.add_argument("--seed", type=int, default=1)
+        args = ap.parse_args(sys.argv[2:])
+        json.dump(make_grid_geojson(args.rows, args.cols, args.points_per_edge, seed=args.seed), sys.stdout)
+        return
+
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for server.py hot functions.")
+    ap.add_argument("--territories", type=parse_sizes, default=[30, 400, 1600], help="comma-separated sizes")
+    ap.add_argument("--clients", type=parse_sizes, default=[10, 100], help="comma-separated SSE client counts")
+    ap.add_argument("--teams", type=int, default=7)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--events", type=int, default=250)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None, help="append JSON lines here instead of stdout")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbor-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    sys.path.insert(0, HERE)
+    cwd = os.getcwd()
+    # Opened before the chdir: a relative --out is relative to the caller.
+    out = open(args.out, "a", encoding="utf-8") if args.out else sys.stdout
+    os.chdir(workdir)
+
+    def emit(rec: dict) -> None:
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+
+    try:
+        run_benchmarks(args, emit)
+    finally:
+        os.chdir(cwd)
+        if args.out:
+            out.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
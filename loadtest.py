@@ -0,0 +1,415 @@
+# Load generator that plays a whole game against a running server.py.
+#
+#   python loadtest.py --spawn --clients 60 --admins 2 --duration 60
+#   python loadtest.py --port 5173 --server-pid 1234 --json results.json
+#
+# With --spawn the server is started from a temporary copy of this tree, so the
+# run never touches the real data/ directory (logins with the debug PIN and
+# claims would otherwise rewrite state.json). Without --spawn point it at a
+# scratch instance only.
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency_ms: dict[str, list[float]] = {}
+        self.status: dict[str, dict[int, int]] = {}
+        self.errors: dict[str, int] = {}
+        self.fanout_ms: list[float] = []
+        self.events = 0
+        self.event_bytes = 0
+        self.rss_kb: list[int] = []
+
+    def record(self, endpoint: str, ms: float, status: int) -> None:
+        with self._lock:
+            self.latency_ms.setdefault(endpoint, []).append(ms)
+            codes = self.status.setdefault(endpoint, {})
+            codes[status] = codes.get(status, 0) + 1
+
+    def error(self, endpoint: str) -> None:
+        with self._lock:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def event(self, size: int) -> None:
+        with self._lock:
+            self.events += 1
+            self.event_bytes += size
+
+    def fanout(self, ms: float) -> None:
+        with self._lock:
+            self.fanout_ms.append(ms)
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, int(round(p / 100.0 * (len(s) - 1)))))
+    return s[k]
+
+
+class Api:
+    # One keep-alive capable connection per worker thread.
+    def __init__(self, host: str, port: int, stats: Stats) -> None:
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+
+    def call(self, method: str, path: str, body: dict | None = None, endpoint: str | None = None) -> tuple[int, dict]:
+        endpoint = endpoint or path.split("?", 1)[0]
+        raw = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if raw is not None else {}
+        t0 = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=raw, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.stats.error(endpoint)
+            return 0, {}
+        self.stats.record(endpoint, (time.perf_counter() - t0) * 1000.0, resp.status)
+        if resp.will_close:
+            self.conn.close()
+        try:
+            return resp.status, json.loads(data.decode("utf-8") or "{}")
+        except ValueError:
+            return resp.status, {}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class FanoutWatch:
+    # Ids of freshly created requests; stream listeners report when they first
+    # see one so we can measure mutation -> SSE delivery delay.
+    def __init__(self, stats: Stats) -> None:
+        self._lock = threading.Lock()
+        self._watch: dict[str, float] = {}
+        self.stats = stats
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._watch[key] = time.perf_counter()
+
+    def scan(self, data: str, seen: set[str]) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            items = list(self._watch.items())
+            for key, t0 in items:
+                if now - t0 > 30:
+                    self._watch.pop(key, None)
+        for key, t0 in items:
+            if key not in seen and key in data:
+                seen.add(key)
+                self.stats.fanout((now - t0) * 1000.0)
+
+
+def stream_listener(host: str, port: int, token: str, stats: Stats, watch: FanoutWatch, stop: threading.Event, socks: list) -> None:
+    seen: set[str] = set()
+    while not stop.is_set():
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        try:
+            conn.request("GET", f"/api/stream?token={token}")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                stats.record("/api/stream", 0.0, resp.status)
+                resp.read()
+                time.sleep(1.0)
+                continue
+            socks.append(conn)
+            event = None
+            while not stop.is_set():
+                line = resp.fp.readline()
+                if not line:
+                    break
+                text = line.decode("utf-8", "replace").rstrip("\n")
+                if text.startswith("event: "):
+                    event = text[7:]
+                elif text.startswith("data: "):
+                    stats.event(len(line))
+                    if event == "state":
+                        watch.scan(text, seen)
+        except (OSError, http.client.HTTPException, ValueError):
+            if not stop.is_set():
+                stats.error("/api/stream")
+                time.sleep(0.5)
+        finally:
+            conn.close()
+
+
+def team_player(api: Api, token: str, territory_ids: list[str], think_s: float, watch: FanoutWatch, stop: threading.Event, rng: random.Random) -> None:
+    while not stop.is_set():
+        time.sleep(rng.expovariate(1.0 / think_s) if think_s > 0 else 0)
+        if stop.is_set():
+            break
+        roll = rng.random()
+        if roll < 0.15:
+            api.call("GET", f"/api/state?token={token}")
+            continue
+        tid = rng.choice(territory_ids)
+        status, info = api.call("POST", "/api/territory/info", {"token": token, "territoryId": tid})
+        if status != 200:
+            continue
+        if info.get("claimVerificationTaskAssigned") and info.get("claimTask"):
+            status, res = api.call(
+                "POST", "/api/territory/claimRequest", {"token": token, "territoryId": tid, "answer": "load test"}
+            )
+            if status == 200 and res.get("claimRequestId"):
+                watch.add(str(res["claimRequestId"]))
+        elif info.get("canRequestClaimVerification"):
+            status, res = api.call(
+                "POST",
+                "/api/territory/claimVerifyRequest",
+                {"token": token, "territoryId": tid, "lat": 50.08 + rng.random() * 0.01, "lng": 16.3 + rng.random() * 0.01},
+            )
+            if status == 200 and res.get("claimVerifyRequestId"):
+                watch.add(str(res["claimVerifyRequestId"]))
+
+
+def admin_player(api: Api, token: str, interval_s: float, approve_ratio: float, stop: threading.Event, rng: random.Random) -> None:
+    # Works the server's review queue like the admin UI: lease the most
+    # urgent free item, resolve it, repeat until the queue is empty.
+    while not stop.is_set():
+        api.call("GET", f"/api/state?token={token}", endpoint="/api/state (admin)")
+        while not stop.is_set():
+            status, data = api.call("POST", "/api/admin/queue/lease", {"token": token})
+            item = data.get("item") if status == 200 else None
+            if not item:
+                break
+            if item.get("kind") == "claim":
+                api.call(
+                    "POST",
+                    "/api/admin/claimRequest/resolve",
+                    {"token": token, "claimRequestId": item.get("id"), "correct": rng.random() < approve_ratio},
+                )
+                continue
+            if item.get("kind") == "verify":
+                api.call(
+                    "POST",
+                    "/api/admin/claimVerifyRequest/resolve",
+                    {"token": token, "claimVerifyRequestId": item.get("id"), "ok": True},
+                )
+            api.call(
+                "POST",
+                "/api/admin/claimVerifyRequest/assignTask",
+                {"token": token, "claimVerifyRequestId": item.get("id"), "task": "Load test task"},
+            )
+        stop.wait(interval_s)
+
+
+def rss_sampler(pid: int, stats: Stats, stop: threading.Event) -> None:
+    path = f"/proc/{pid}/status"
+    while not stop.is_set():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        stats.rss_kb.append(int(line.split()[1]))
+                        break
+        except OSError:
+            return
+        stop.wait(0.5)
+
+
+def spawn_server(port: int) -> tuple[subprocess.Popen, str]:
+    workdir = tempfile.mkdtemp(prefix="tbor-load-")
+    shutil.copy2(os.path.join(HERE, "server.py"), workdir)
+    shutil.copytree(os.path.join(HERE, "public"), os.path.join(workdir, "public"))
+    shutil.copytree(os.path.join(HERE, "data"), os.path.join(workdir, "data"))
+    env = dict(os.environ, PORT=str(port))
+    proc = subprocess.Popen(
+        [sys.executable, "server.py"], cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/state")
+            conn.getresponse().read()
+            conn.close()
+            return proc, workdir
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("server did not start")
+
+
+def report(stats: Stats, duration_s: float) -> dict:
+    endpoints = {}
+    total = 0
+    for ep, values in sorted(stats.latency_ms.items()):
+        total += len(values)
+        endpoints[ep] = {
+            "count": len(values),
+            "rps": round(len(values) / duration_s, 2),
+            "p50Ms": percentile(values, 50),
+            "p95Ms": percentile(values, 95),
+            "p99Ms": percentile(values, 99),
+            "maxMs": max(values) if values else None,
+            "status": {str(k): v for k, v in sorted(stats.status.get(ep, {}).items())},
+            "errors": stats.errors.get(ep, 0),
+        }
+    return {
+        "durationS": round(duration_s, 2),
+        "requests": total,
+        "rps": round(total / duration_s, 2),
+        "endpoints": endpoints,
+        "fanout": {
+            "samples": len(stats.fanout_ms),
+            "p50Ms": percentile(stats.fanout_ms, 50),
+            "p95Ms": percentile(stats.fanout_ms, 95),
+            "p99Ms": percentile(stats.fanout_ms, 99),
+        },
+        "sse": {"events": stats.events, "bytes": stats.event_bytes},
+        "rssKb": {
+            "samples": len(stats.rss_kb),
+            "max": max(stats.rss_kb) if stats.rss_kb else None,
+            "last": stats.rss_kb[-1] if stats.rss_kb else None,
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    def fmt(v):
+        return "-" if v is None else f"{v:.1f}"
+
+    print(f"duration {result['durationS']}s  requests {result['requests']}  throughput {result['rps']} req/s")
+    print(f"{'endpoint':44} {'count':>7} {'rps':>7} {'p50':>7} {'p95':>7} {'p99':>7}  status")
+    for ep, e in result["endpoints"].items():
+        codes = " ".join(f"{k}:{v}" for k, v in e["status"].items())
+        if e["errors"]:
+            codes += f" err:{e['errors']}"
+        print(f"{ep:44} {e['count']:>7} {e['rps']:>7} {fmt(e['p50Ms']):>7} {fmt(e['p95Ms']):>7} {fmt(e['p99Ms']):>7}  {codes}")
+    f = result["fanout"]
+    print(f"SSE fan-out delay ms: p50 {fmt(f['p50Ms'])}  p95 {fmt(f['p95Ms'])}  p99 {fmt(f['p99Ms'])}  ({f['samples']} samples)")
+    print(f"SSE events received: {result['sse']['events']} ({result['sse']['bytes'] // 1024} KiB)")
+    r = result["rssKb"]
+    if r["samples"]:
+        print(f"server RSS: max {r['max'] // 1024} MiB, last {r['last'] // 1024} MiB")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Simulate a full game against server.py.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5173")))
+    ap.add_argument("--spawn", action="store_true", help="start server.py from a temporary copy of this tree")
+    ap.add_argument("--state", default=None, help="state.json to read team/admin PINs from")
+    ap.add_argument("--clients", type=int, default=30, help="virtual players, spread over the teams")
+    ap.add_argument("--admins", type=int, default=1)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--think", type=float, default=2.0, help="mean seconds between player actions")
+    ap.add_argument("--admin-interval", type=float, default=1.0, help="seconds between admin review passes")
+    ap.add_argument("--approve-ratio", type=float, default=0.7)
+    ap.add_argument("--no-streams", action="store_true", help="do not open /api/stream connections")
+    ap.add_argument("--server-pid", type=int, default=None, help="pid to sample RSS from")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", default=None, help="write machine-readable results here")
+    args = ap.parse_args()
+
+    proc = None
+    workdir = None
+    if args.spawn:
+        proc, workdir = spawn_server(args.port)
+        args.server_pid = proc.pid
+    state_path = args.state or os.path.join(workdir or HERE, "data", "state.json")
+    with open(state_path, "r", encoding="utf-8") as f:
+        game = json.load(f)
+    teams = [t for t in game.get("teams", []) if t.get("id")]
+    territory_ids = [str(z["id"]) for z in game.get("territories", []) if z.get("id")]
+    admin_pin = str((game.get("config", {}) or {}).get("adminPin") or "")
+
+    stats = Stats()
+    watch = FanoutWatch(stats)
+    stop = threading.Event()
+    threads: list[threading.Thread] = []
+    socks: list = []
+    rng = random.Random(args.seed)
+
+    try:
+        login = Api(args.host, args.port, stats)
+        tokens: list[str] = []
+        for i in range(args.clients):
+            team = teams[i % len(teams)]
+            status, res = login.call("POST", "/api/login", {"teamId": team["id"], "pin": str(team.get("pin") or "")})
+            if status == 200 and res.get("token"):
+                tokens.append(res["token"])
+        admin_tokens: list[str] = []
+        for _ in range(args.admins):
+            status, res = login.call("POST", "/api/admin/login", {"pin": admin_pin})
+            if status == 200 and res.get("token"):
+                admin_tokens.append(res["token"])
+        login.close()
+        print(f"logged in {len(tokens)} players, {len(admin_tokens)} admins", file=sys.stderr)
+
+        def spawn(target, *a) -> None:
+            th = threading.Thread(target=target, args=a, daemon=True)
+            th.start()
+            threads.append(th)
+
+        if not args.no_streams:
+            for token in tokens + admin_tokens:
+                spawn(stream_listener, args.host, args.port, token, stats, watch, stop, socks)
+        if args.server_pid:
+            spawn(rss_sampler, args.server_pid, stats, stop)
+        started = time.perf_counter()
+        for token in tokens:
+            spawn(team_player, Api(args.host, args.port, stats), token, territory_ids, args.think, watch, stop, random.Random(rng.random()))
+        for token in admin_tokens:
+            spawn(admin_player, Api(args.host, args.port, stats), token, args.admin_interval, args.approve_ratio, stop, random.Random(rng.random()))
+
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        elapsed = time.perf_counter() - started
+        for conn in list(socks):
+            try:
+                conn.sock.shutdown(2)
+            except Exception:
+                pass
+        for th in threads:
+            th.join(timeout=5)
+    finally:
+        stop.set()
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = report(stats, elapsed)
+    result["config"] = {
+        "clients": args.clients,
+        "admins": args.admins,
+        "duration": args.duration,
+        "think": args.think,
+        "streams": not args.no_streams,
+    }
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
+// Games hosted under /g/<gameId>/ talk to their own API and keep their own login.
+const API_BASE = (window.location.pathname.match(/^\/g\/[A-Za-z0-9_-]+/) || [""])[0];
+
 const storage = (() => {
   try {
-    return window.localStorage;
+    const ls = window.localStorage;
+    if (!API_BASE) return ls;
+    const key = (k) => `${API_BASE}:${k}`;
+    return {
+      getItem: (k) => ls.getItem(key(k)),
+      setItem: (k, v) => ls.setItem(key(k), v),
+      removeItem: (k) => ls.removeItem(key(k))
+    };
   } catch {
     return null;
   }
@@ -34,9 +44,30 @@ const state = {
   lastSeenClaimVerifyResolvedAtMs: 0,
   lastCooldownUntilMs: null,
   territorySig: null,
+  geometryLevels: null,
+  geometryLevel: 0,
+  geometryByLevel: new Map(),
   activeTerritoryModalId: null,
   activeTerritoryModalInfo: null,
-  notificationQueue: []
+  notificationQueue: [],
+  positionWatchId: null,
+  positionTimer: null,
+  positionSamples: [],
+  teamPositions: new Map(),
+  positionLayerByTeam: new Map(),
+  leaderboard: null,
+  leaderboardReceivedAtMs: 0,
+  eventLog: emptyEventLog(),
+  leaderboardRendered: null,
+  leaderboardTimeEls: null,
+  socket: null,
+  socketUnsupported: false,
+  socketCalls: new Map(),
+  socketCallSeq: 0,
+  reviewQueue: null,
+  reviewQueueHolder: null,
+  reviewQueueEl: null,
+  reviewQueueTotalEl: null
 };
 
 const soundManager = {
@@ -201,9 +232,14 @@ if (!state.role && state.me) state.role = "team";
 if (state.role === "admin") state.me = null;
 startRealTimeClock();
 
+const INITIAL_GEO_ZOOM = 13;
+
 let map = null;
 let territoryLayerById = new Map();
 let territoryNumberMarkerById = new Map();
+let labelPointById = new Map();
+let territoryStyleKeyById = new Map();
+let territoryMarkerKeyById = new Map();
 
 function setStatus(text) {
   els.statusBox.textContent = text;
@@ -214,18 +250,70 @@ function showLoginStatus(text, kind = "muted") {
   els.loginStatus.textContent = text;
 }
 
+function emptyEventLog() {
+  return { events: [], newest: 0, nextBefore: null, startSeq: 0, loaded: false, loading: false };
+}
+
+function syncEventLog() {
+  // History is paged from /api/events: the newest page first, older ones on
+  // request, and whatever was added once the state cursor moves past it.
+  const cursor = state.data?.eventCursor;
+  if (!state.token || !cursor || state.eventLog.loading) return;
+  if (state.eventLog.loaded && cursor.startSeq !== state.eventLog.startSeq) state.eventLog = emptyEventLog();
+  const log = state.eventLog;
+  if (!log.loaded) loadEventLog({}).catch(() => {});
+  else if (cursor.seq > log.newest) loadEventLog({ after: String(log.newest) }).catch(() => {});
+}
+
+async function loadEventLog(params) {
+  const log = state.eventLog;
+  if (log.loading) return;
+  log.loading = true;
+  try {
+    const qs = new URLSearchParams({ token: state.token ?? "", limit: "100", ...params });
+    const res = await fetch(`${API_BASE}/api/events?${qs.toString()}`);
+    if (!res.ok) return;
+    const page = await res.json();
+    const events = Array.isArray(page.events) ? page.events : [];
+    if (params.after !== undefined) {
+      log.events.push(...events);
+      log.newest = page.nextAfter ?? Math.max(Number(page.cursor ?? 0), Number(state.data?.eventCursor?.seq ?? 0));
+    } else {
+      log.events.unshift(...events.reverse());
+      log.nextBefore = page.nextBefore ?? null;
+      if (!log.loaded) log.newest = Number(page.cursor ?? 0);
+    }
+    log.startSeq = Number(page.startSeq ?? 0);
+    log.loaded = true;
+  } finally {
+    log.loading = false;
+  }
+  renderEventLog();
+}
+
 function renderEventLog() {
   if (!els.eventLogRows) return;
-  const events = Array.isArray(state.data?.eventLog) ? state.data.eventLog : [];
+  syncEventLog();
+  const log = state.eventLog;
+  const events = log.events;
   els.eventLogRows.innerHTML = "";
   if (events.length === 0) {
     const empty = document.createElement("div");
     empty.className = "muted";
-    empty.textContent = "Zatím žádný záznam.";
+    empty.textContent = state.token && !log.loaded ? "Načítám..." : "Zatím žádný záznam.";
     els.eventLogRows.appendChild(empty);
     return;
   }
 
+  if (log.nextBefore !== null) {
+    const older = document.createElement("button");
+    older.className = "btn";
+    older.textContent = "Načíst starší";
+    older.disabled = log.loading;
+    older.addEventListener("click", () => loadEventLog({ before: String(log.nextBefore) }).catch(() => {}));
+    els.eventLogRows.appendChild(older);
+  }
+
   const fmt = new Intl.DateTimeFormat("cs-CZ", {
     hour: "2-digit",
     minute: "2-digit",
@@ -318,55 +406,47 @@ function territoryById(id) {
   return state.data?.territories?.find((t) => t.id === id) ?? null;
 }
 
-function renderLeaderboard() {
-  if (!state.data || !els.leaderboard) return;
-  const teams = state.data.teams || [];
-  const territories = state.data.territories || [];
-  const stats = state.data.teamStats || {};
-  const tnow = Date.now();
-
-  const teamData = teams.map((t) => {
-    const s = stats[t.id] || {};
-    let totalTime = Number(s.totalTimeMs || 0);
-
-    // Add time for currently held territories
-    territories.forEach((z) => {
-      if (z.ownerTeamId === t.id) {
-        const cap = Number(z.capturedAtMs);
-        if (Number.isFinite(cap) && cap > 0) {
-          const duration = Math.max(0, tnow - cap);
-          totalTime += duration;
-        }
-      }
-    });
+function formatHoldingTime(ms) {
+  const seconds = Math.floor(ms / 1000);
+  const h = Math.floor(seconds / 3600);
+  const m = Math.floor((seconds % 3600) / 60);
+  const s = seconds % 60;
+  return `${h}h${m.toString().padStart(2, "0")}m${s.toString().padStart(2, "0")}s`;
+}
 
-    return {
-      id: t.id,
-      name: t.name,
-      color: t.color,
-      captures: Number(s.captures || 0),
-      totalTimeMs: totalTime
-    };
-  });
+function leaderboardTimeMs(d) {
+  // The server sends holding time as of receipt; it grows by the number of
+  // held territories per elapsed millisecond until the next update.
+  return Number(d.timeMs || 0) + Number(d.owned || 0) * Math.max(0, Date.now() - state.leaderboardReceivedAtMs);
+}
 
-  // 1. Rank by Captures
-  teamData.sort((a, b) => b.captures - a.captures);
-  teamData.forEach((d, i) => (d.rankCaptures = i + 1));
-  const listCaptures = [...teamData];
+function setLeaderboard(leaderboard) {
+  if (!leaderboard || !Array.isArray(leaderboard.teams)) return;
+  state.leaderboard = leaderboard;
+  state.leaderboardReceivedAtMs = Date.now();
+  state.leaderboardRendered = null;
+  renderLeaderboard();
+}
 
-  // 2. Rank by Time
-  teamData.sort((a, b) => b.totalTimeMs - a.totalTimeMs);
-  teamData.forEach((d, i) => (d.rankTime = i + 1));
-  const listTime = [...teamData];
+function renderLeaderboard() {
+  if (!state.data || !els.leaderboard) return;
+  const teams = state.leaderboard?.teams;
+  if (!Array.isArray(teams)) return;
+  // Ranks come from the server; a clock tick only refreshes the time cells.
+  if (state.leaderboardRendered === state.leaderboard && state.leaderboardTimeEls) {
+    for (const [el, d] of state.leaderboardTimeEls) el.textContent = formatHoldingTime(leaderboardTimeMs(d));
+    return;
+  }
+  state.leaderboardRendered = state.leaderboard;
+  state.leaderboardTimeEls = [];
 
-  // 3. Average Rank
-  teamData.forEach((d) => {
-    d.avgRank = (d.rankCaptures + d.rankTime) / 2;
+  const teamData = teams.map((d) => {
+    const t = teamById(d.id);
+    return { ...d, name: t?.name ?? d.id, color: t?.color ?? "rgba(255,255,255,0.25)" };
   });
-
-  // 4. Final Sort by Average Rank
-  teamData.sort((a, b) => a.avgRank - b.avgRank || b.captures - a.captures);
-  const listFinal = [...teamData];
+  const listCaptures = [...teamData].sort((a, b) => a.rankCaptures - b.rankCaptures);
+  const listTime = [...teamData].sort((a, b) => a.rankTime - b.rankTime);
+  const listFinal = teamData;
 
   els.leaderboard.innerHTML = "";
 
@@ -378,7 +458,7 @@ function renderLeaderboard() {
   const createSection = (title, list, type) => {
     const container = document.createElement("div");
     container.style.marginBottom = "20px";
-    
+
     const titleEl = document.createElement("div");
     titleEl.className = "panelTitle";
     titleEl.style.fontSize = "0.95em";
@@ -411,14 +491,9 @@ function renderLeaderboard() {
       if (type === "captures") {
          valHtml = `<div class="scoreCount" style="width:40px;text-align:right">${d.captures}</div>`;
       } else if (type === "time") {
-         const seconds = Math.floor(d.totalTimeMs / 1000);
-         const h = Math.floor(seconds / 3600);
-         const m = Math.floor((seconds % 3600) / 60);
-         const s = seconds % 60;
-         const timeStr = `${h}h${m.toString().padStart(2,"0")}m${s.toString().padStart(2,"0")}s`;
-         valHtml = `<div class="scoreCount" style="width:70px;text-align:right;font-size:0.85em;white-space:nowrap">${timeStr}</div>`;
+         valHtml = `<div class="scoreCount" style="width:70px;text-align:right;font-size:0.85em;white-space:nowrap">${formatHoldingTime(leaderboardTimeMs(d))}</div>`;
       } else {
-         valHtml = `<div class="scoreCount" style="width:40px;text-align:right">${d.avgRank.toFixed(1)}</div>`;
+         valHtml = `<div class="scoreCount" style="width:40px;text-align:right">${Number(d.avgRank).toFixed(1)}</div>`;
       }
 
       row.innerHTML = `
@@ -426,6 +501,7 @@ function renderLeaderboard() {
         <div class="scoreName"><span class="dot" style="background:${d.color}"></span> ${escapeHtml(d.name)}</div>
         ${valHtml}
       `;
+      if (type === "time") state.leaderboardTimeEls.push([row.querySelector(".scoreCount"), d]);
       container.appendChild(row);
     });
 
@@ -454,6 +530,47 @@ function territoryNumberText(z) {
   return String(z?.id ?? "");
 }
 
+function decodePolyline(str, precision) {
+  const factor = Math.pow(10, Number.isFinite(precision) ? precision : 6);
+  const out = [];
+  let index = 0;
+  let a = 0;
+  let b = 0;
+  // Plain arithmetic, not bitwise ops: those are 32-bit and overflow from
+  // precision 7 up.
+  const readDelta = () => {
+    let result = 0;
+    let scale = 1;
+    let byte;
+    do {
+      byte = str.charCodeAt(index++) - 63;
+      result += (byte % 32) * scale;
+      scale *= 32;
+    } while (byte >= 0x20 && index < str.length);
+    return result % 2 ? -Math.floor(result / 2) - 1 : Math.floor(result / 2);
+  };
+  while (index < str.length) {
+    a += readDelta();
+    b += readDelta();
+    out.push([a / factor, b / factor]);
+  }
+  return out;
+}
+
+function expandTerritoryGeometry(data) {
+  if (Array.isArray(data?.geometryLevels)) state.geometryLevels = data.geometryLevels;
+  const enc = data?.geometryEncoding;
+  if (!enc || enc.format !== "polyline") return data;
+  for (const t of data?.territories ?? []) {
+    if (typeof t.polylineEnc === "string") {
+      t.polygon = decodePolyline(t.polylineEnc, Number(enc.precision));
+      delete t.polylineEnc;
+    }
+  }
+  delete data.geometryEncoding;
+  return data;
+}
+
 function pointInPolygon(point, polygon) {
   const x = Number(point[1]);
   const y = Number(point[0]);
@@ -715,13 +832,7 @@ function renderAdminBattles() {
           {
             label: isApproved ? "Zadat úkol" : "Vyřídit",
             kind: "primary",
-            onClick: () => {
-              if (isApproved) {
-                  openAssignTaskModal(String(r.id));
-              } else {
-                  openClaimVerifyRequestAdminModal(String(r.id));
-              }
-            }
+            onClick: () => reviewQueueItem(`cv:${r.id}`)
           }
         ]
       });
@@ -745,9 +856,7 @@ function renderAdminBattles() {
           {
             label: "Vyřídit",
             kind: "primary",
-            onClick: () => {
-              openClaimRequestAdminModal(String(r.id));
-            }
+            onClick: () => reviewQueueItem(`cr:${r.id}`)
           }
         ]
       });
@@ -768,11 +877,17 @@ function renderAdminBattles() {
   if (locked) {
     adminActions.innerHTML = `
       <div class="hint" style="margin-right:auto;align-self:center">Hra ukončena.</div>
+      <a class="btn" href="replay.html" target="_blank">ZÁZNAM</a>
+      <a class="btn" data-action="export">EXPORT</a>
+      <button class="btn" data-action="import">IMPORT</button>
       <button class="btn danger" data-action="start">NOVÁ HRA</button>
     `;
   } else {
     adminActions.innerHTML = `
       <button class="btn" data-action="upload-map" style="margin-right:auto">NAHRÁT MAPU</button>
+      <a class="btn" href="replay.html" target="_blank">ZÁZNAM</a>
+      <a class="btn" data-action="export">EXPORT</a>
+      <button class="btn" data-action="import">IMPORT</button>
       <button class="btn danger" data-action="start">RESTART</button>
       <button class="btn danger" data-action="lock">KONEC</button>
     `;
@@ -817,6 +932,42 @@ function renderAdminBattles() {
     });
   });
 
+  const exportLink = adminActions.querySelector('[data-action="export"]');
+  if (exportLink) exportLink.href = `${API_BASE}/api/admin/export?token=${encodeURIComponent(state.token ?? "")}`;
+
+  adminActions.querySelector('[data-action="import"]')?.addEventListener("click", () => {
+    openModal({
+      title: "Import hry",
+      bodyHtml: `
+        <div class="hint">Vyberte export hry (.ndjson). Nahradí celou současnou hru včetně historie.</div>
+        <input type="file" id="gameImportInput" accept=".ndjson,.jsonl" style="width:100%;margin-top:10px">
+      `,
+      actions: [
+        { label: "Zrušit", onClick: closeModal },
+        {
+          label: "Importovat",
+          kind: "danger",
+          onClick: async () => {
+            const file = document.getElementById("gameImportInput")?.files?.[0];
+            if (!file) return alert("Vyberte soubor.");
+            // Sent as is: the server reads the export line by line.
+            const res = await fetch(`${API_BASE}/api/admin/import?token=${encodeURIComponent(state.token ?? "")}`, {
+              method: "POST",
+              headers: { "Content-Type": "application/x-ndjson" },
+              body: file
+            }).catch((err) => ({ ok: false, json: async () => ({ error: err.message }) }));
+            const json = await res.json().catch(() => ({}));
+            if (!res.ok) return alert("Chyba: " + (json.error ?? res.status));
+            const missing = json.missingUploads?.length ? ` Chybí ${json.missingUploads.length} nahraných fotek.` : "";
+            alert(`Hra naimportována.${missing}`);
+            closeModal();
+            forceRefresh();
+          }
+        }
+      ]
+    });
+  });
+
   adminActions.querySelector('[data-action="start"]')?.addEventListener("click", () => {
     openModal({
       title: locked ? "Nová hra" : "Restart",
@@ -876,95 +1027,201 @@ function renderAdminBattles() {
   const requestsTitle = document.createElement("div");
   requestsTitle.className = "muted";
   requestsTitle.style.marginTop = "12px";
-  requestsTitle.textContent = "Požadavky";
+  requestsTitle.style.display = "flex";
+  requestsTitle.style.alignItems = "center";
+  requestsTitle.innerHTML = `
+    <span style="margin-right:auto">Požadavky <span data-role="queue-total"></span></span>
+    <button class="btn primary" data-action="queue-next">Další požadavek</button>
+  `;
+  requestsTitle.querySelector('[data-action="queue-next"]')?.addEventListener("click", () => reviewQueueItem(null));
   els.adminBattles.appendChild(requestsTitle);
 
-  const items = [];
+  const list = document.createElement("div");
+  els.adminBattles.appendChild(list);
+  state.reviewQueueEl = list;
+  state.reviewQueueTotalEl = requestsTitle.querySelector('[data-role="queue-total"]');
+  renderReviewQueue();
+}
 
-  for (const r of pendingClaimVerify) {
-    items.push({
-      kind: "claimVerify",
-      id: String(r.id ?? ""),
-      timeMs: Number(r.createdAtMs ?? 0),
-      payload: r
-    });
+function setReviewQueue(page) {
+  if (!page || !Array.isArray(page.items)) return;
+  state.reviewQueue = { seq: page.seq ?? null, total: Number(page.total ?? page.items.length), items: page.items.slice() };
+  if (page.holder) state.reviewQueueHolder = page.holder;
+}
+
+async function loadReviewQueue() {
+  const res = await fetch(`${API_BASE}/api/admin/queue?token=${encodeURIComponent(state.token ?? "")}`);
+  if (!res.ok) return;
+  setReviewQueue(await res.json());
+  // The page may come from another worker: take the next delta as it is.
+  state.reviewQueue.seq = null;
+  renderReviewQueue();
+}
+
+function applyQueueDelta(delta) {
+  const queue = state.reviewQueue;
+  if (!queue || state.role !== "admin" || !delta) return;
+  if (queue.seq !== null && delta.seq <= queue.seq) return;
+  if (queue.seq !== null && delta.seq !== queue.seq + 1) {
+    // A delta was lost (a slow stream drops its oldest events): start over.
+    loadReviewQueue().catch(() => {});
+    return;
   }
-  for (const r of pendingClaims) {
-    items.push({
-      kind: "claim",
-      id: String(r.id ?? ""),
-      timeMs: Number(r.createdAtMs ?? 0),
-      payload: r
-    });
+  queue.seq = delta.seq;
+  queue.total = Number(delta.total ?? queue.total);
+  const upserts = Array.isArray(delta.upserts) ? delta.upserts : [];
+  const gone = new Set([...(delta.removed ?? []), ...upserts.map((it) => it.key)]);
+  queue.items = queue.items.filter((it) => !gone.has(it.key));
+  // Items arrive in server order (priority, then key); keep the list that way.
+  for (const it of upserts) {
+    let lo = 0;
+    let hi = queue.items.length;
+    while (lo < hi) {
+      const mid = (lo + hi) >> 1;
+      const m = queue.items[mid];
+      if (m.priority < it.priority || (m.priority === it.priority && m.key < it.key)) lo = mid + 1;
+      else hi = mid;
+    }
+    queue.items.splice(lo, 0, it);
   }
+  renderReviewQueue();
+}
 
-  items.sort((a, b) => (a.timeMs ?? 0) - (b.timeMs ?? 0));
+function reviewQueueItem(key) {
+  // Lease first so two admins never work on the same request; without a key
+  // the server hands out the most urgent free one.
+  apiPost("/api/admin/queue/lease", { token: state.token, ...(key ? { key } : {}) })
+    .then((res) => {
+      const item = res?.item;
+      if (!item) return;
+      if (item.kind === "claim") openClaimRequestAdminModal(item.id);
+      else if (item.kind === "assign") openAssignTaskModal(item.id);
+      else openClaimVerifyRequestAdminModal(item.id);
+    })
+    .catch((e) => {
+      openModal({
+        title: "Požadavek",
+        bodyHtml: escapeHtml(e?.message ?? "Neznámá chyba."),
+        actions: [{ label: "OK", onClick: closeModal }]
+      });
+    });
+}
+
+function approveVerifyRequests(ids) {
+  // One request, one state write and one broadcast for the whole list.
+  const decisions = ids.map((id) => ({ action: "claimVerifyRequest/resolve", claimVerifyRequestId: id, ok: true }));
+  apiPost("/api/admin/decisions", { token: state.token, decisions })
+    .then((res) => {
+      const failed = (res?.results ?? []).filter((r) => r.status >= 300);
+      if (failed.length === 0) return;
+      openModal({
+        title: "Schválení poloh",
+        bodyHtml: `Schváleno ${escapeHtml(String(res.applied ?? 0))} z ${ids.length}.<br>${failed
+          .map((r) => escapeHtml(r.body?.error ?? `Chyba ${r.status}`))
+          .join("<br>")}`,
+        actions: [{ label: "OK", onClick: closeModal }]
+      });
+    })
+    .catch((e) => {
+      openModal({
+        title: "Chyba",
+        bodyHtml: escapeHtml(e?.message ?? "Neznámá chyba."),
+        actions: [{ label: "OK", onClick: closeModal }]
+      });
+    });
+}
+
+function releaseReviewLease(key) {
+  closeModal();
+  apiPost("/api/admin/queue/release", { token: state.token, key }).catch(() => {});
+}
+
+function renderReviewQueue() {
+  const list = state.reviewQueueEl;
+  if (!list || !list.isConnected) return;
+  const items = state.reviewQueue?.items ?? [];
+  const total = Number(state.reviewQueue?.total ?? items.length);
+  if (state.reviewQueueTotalEl) state.reviewQueueTotalEl.textContent = total ? `(${total})` : "";
+  list.innerHTML = "";
 
   if (items.length === 0) {
     const empty = document.createElement("div");
     empty.className = "muted";
     empty.style.marginTop = "6px";
     empty.textContent = "Žádné čekající požadavky.";
-    els.adminBattles.appendChild(empty);
-  } else {
-    for (const it of items) {
-      if (it.kind === "claimVerify") {
-        const r = it.payload;
-        const team = teamById(r.teamId);
-        const z = territoryById(r.territoryId);
-        const status = r.status ?? "pending";
-        const isApproved = status === "approved";
-        
-        const row = document.createElement("div");
-        row.className = "battleRow";
-        row.innerHTML = `
-          <div class="battleRowTop">
-            <div class="battleRowTitle">
-                ${isApproved ? "Zadání úkolu" : "Ověření polohy"} – území ${escapeHtml(z ? territoryNumberText(z) : String(r.territoryId ?? ""))}
-            </div>
-            <div class="battleRowMeta">${escapeHtml(String(r.id ?? ""))}</div>
-          </div>
-          <div class="muted">
-            <span class="dot" style="background:${escapeHtml(team?.color ?? "rgba(255,255,255,0.25)")}"></span>
-            ${escapeHtml(team?.name ?? r.teamId)}
-            ${isApproved ? " <span class='pill'>Čeká na úkol</span>" : ""}
-          </div>
-          <div style="display:flex;gap:10px;justify-content:flex-end">
-            <button class="btn primary">${isApproved ? "Zadat úkol" : "Vyřídit"}</button>
-          </div>
-        `;
-        row.querySelector("button")?.addEventListener("click", () => {
-            if (isApproved) {
-                openAssignTaskModal(String(r.id ?? ""));
-            } else {
-                openClaimVerifyRequestAdminModal(String(r.id ?? ""));
-            }
-        });
-        els.adminBattles.appendChild(row);
-      } else if (it.kind === "claim") {
-        const r = it.payload;
-        const team = teamById(r.teamId);
-        const z = territoryById(r.territoryId);
-        const answer = String(r.answer ?? "");
-        const row = document.createElement("div");
-        row.className = "battleRow";
-        row.innerHTML = `
-          <div class="battleRowTop">
-            <div class="battleRowTitle">Žádost o obsazení – území ${escapeHtml(z ? territoryNumberText(z) : String(r.territoryId ?? ""))}</div>
-            <div class="battleRowMeta">${escapeHtml(String(r.id ?? ""))}</div>
-          </div>
-          <div class="muted">
-            <span class="dot" style="background:${escapeHtml(team?.color ?? "rgba(255,255,255,0.25)")}"></span>
-            ${escapeHtml(team?.name ?? r.teamId)}${answer ? ` · odpověď: ${escapeHtml(answer)}` : ""}
-          </div>
-          <div style="display:flex;gap:10px;justify-content:flex-end">
-            <button class="btn primary">Vyřídit</button>
-          </div>
-        `;
-        row.querySelector("button")?.addEventListener("click", () => openClaimRequestAdminModal(String(r.id ?? "")));
-        els.adminBattles.appendChild(row);
-      }
+    list.appendChild(empty);
+    return;
+  }
+
+  const gpsOk = items.filter(
+    (r) => r.kind === "verify" && ["inside", "buffer"].includes(r.gpsCheck) && (!r.leasedBy || r.leasedBy === state.reviewQueueHolder)
+  );
+  if (gpsOk.length > 1) {
+    const bulk = document.createElement("div");
+    bulk.style.display = "flex";
+    bulk.style.justifyContent = "flex-end";
+    bulk.style.marginTop = "6px";
+    bulk.innerHTML = `<button class="btn">Schválit polohy v území (${gpsOk.length})</button>`;
+    bulk.querySelector("button")?.addEventListener("click", () => approveVerifyRequests(gpsOk.map((r) => r.id)));
+    list.appendChild(bulk);
+  }
+
+  for (const r of items) {
+    const team = teamById(r.teamId);
+    const z = territoryById(r.territoryId);
+    const tn = z ? territoryNumberText(z) : String(r.territoryId ?? "");
+    const leasedByOther = Boolean(r.leasedBy) && r.leasedBy !== state.reviewQueueHolder;
+    let title = `Žádost o obsazení – území ${escapeHtml(tn)}`;
+    let detail = r.answer ? ` · odpověď: ${escapeHtml(r.answer)}` : "";
+    if (r.kind === "verify" || r.kind === "assign") {
+      title = `${r.kind === "assign" ? "Zadání úkolu" : "Ověření polohy"} – území ${escapeHtml(tn)}`;
+      detail = `${r.kind === "assign" ? " <span class='pill'>Čeká na úkol</span>" : ""}${gpsCheckText(r) ? ` · ${escapeHtml(gpsCheckText(r))}` : ""}`;
+    }
+    const row = document.createElement("div");
+    row.className = "battleRow";
+    row.innerHTML = `
+      <div class="battleRowTop">
+        <div class="battleRowTitle">${title}</div>
+        <div class="battleRowMeta">${escapeHtml(String(r.id ?? ""))}</div>
+      </div>
+      <div class="muted">
+        <span class="dot" style="background:${escapeHtml(team?.color ?? "rgba(255,255,255,0.25)")}"></span>
+        ${escapeHtml(team?.name ?? r.teamId)}${detail}
+        ${Number(r.contested) > 1 ? " <span class='pill'>Sporné území</span>" : ""}
+        ${leasedByOther ? " <span class='pill'>Vyřizuje jiný admin</span>" : ""}
+      </div>
+      <div style="display:flex;gap:10px;justify-content:flex-end">
+        <button class="btn primary"${leasedByOther ? " disabled" : ""}>${r.kind === "assign" ? "Zadat úkol" : "Vyřídit"}</button>
+      </div>
+    `;
+    row.querySelector("button")?.addEventListener("click", () => reviewQueueItem(r.key));
+    list.appendChild(row);
+  }
+  if (total > items.length) {
+    const more = document.createElement("div");
+    more.className = "muted";
+    more.style.marginTop = "6px";
+    more.textContent = `… a dalších ${total - items.length}.`;
+    list.appendChild(more);
+  }
+}
+
+function gpsCheckText(req) {
+  const d = Number(req?.gpsDistanceM);
+  const where = Number.isFinite(d) && d > 0 ? ` (${Math.round(d)} m)` : "";
+  switch (req?.gpsCheck) {
+    case "inside":
+      return "GPS: uvnitř území";
+    case "buffer":
+      return `GPS: u hranice${where}`;
+    case "outside": {
+      const other = territoryById(req.gpsTerritoryId);
+      return `GPS: mimo území${where}${other ? ` – v území ${territoryNumberText(other)}` : ""}`;
     }
+    case "missing":
+      return "GPS: bez polohy";
+    default:
+      return "";
   }
 }
 
@@ -994,6 +1251,7 @@ async function openClaimVerifyRequestAdminModal(claimVerifyRequestId) {
       <span class="pill" style="margin-left:8px">Území ${escapeHtml(tn)}</span>
     </div>
     <div class="hint">Ověř polohu týmu na mapě.</div>
+    ${gpsCheckText(req) ? `<div class="muted" style="margin-top:6px">${escapeHtml(gpsCheckText(req))}</div>` : ""}
     <div id="verifyMap" style="width:100%;height:300px;background:#eee;margin-top:10px;border-radius:4px;"></div>
   `;
 
@@ -1001,7 +1259,7 @@ async function openClaimVerifyRequestAdminModal(claimVerifyRequestId) {
     title: "Admin – Ověření polohy",
     bodyHtml: body,
     actions: [
-      { label: "Zavřít", onClick: closeModal },
+      { label: "Zavřít", onClick: () => releaseReviewLease(`cv:${claimVerifyRequestId}`) },
       {
         label: "OK",
         kind: "primary",
@@ -1159,7 +1417,7 @@ async function openClaimRequestAdminModal(claimRequestId) {
     title: "Admin – Obsazení území",
     bodyHtml: body,
     actions: [
-      { label: "Zavřít", onClick: closeModal },
+      { label: "Zavřít", onClick: () => releaseReviewLease(`cr:${claimRequestId}`) },
       {
         label: "Špatně",
         kind: "danger",
@@ -1200,10 +1458,19 @@ async function openClaimRequestAdminModal(claimRequestId) {
   });
 }
 
+function territoryStyleKey(z) {
+  const owner = z.ownerTeamId ? teamById(z.ownerTeamId) : null;
+  return owner ? `${owner.id}:${owner.color}` : "";
+}
+
 function applyTerritoryStyles() {
+  // Only polygons whose owner (or owner colour) changed get a setStyle call.
   for (const z of state.data?.territories ?? []) {
     const layer = territoryLayerById.get(z.id);
     if (!layer) continue;
+    const key = territoryStyleKey(z);
+    if (territoryStyleKeyById.get(z.id) === key) continue;
+    territoryStyleKeyById.set(z.id, key);
     const owner = z.ownerTeamId ? teamById(z.ownerTeamId) : null;
     const fillColor = owner?.color ?? "#808080"; // Gray fill if no owner
     
@@ -1217,51 +1484,67 @@ function applyTerritoryStyles() {
   }
 }
 
-function updateMapMarkers() {
-  if (!map) return;
-  // Remove old markers
-  for (const m of territoryNumberMarkerById.values()) {
-    m.remove();
+function territoryLabelPoint(z) {
+  // The server ships a precomputed anchor; only inline-polygon maps fall back
+  // to the local search, once per territory.
+  if (Array.isArray(z?.labelPoint)) return z.labelPoint;
+  if (!labelPointById.has(z.id)) labelPointById.set(z.id, labelPointInside(z.polygon, z.id));
+  return labelPointById.get(z.id);
+}
+
+function isTerritoryLockedForViewer(z) {
+  const globalLock = state.data?.territoryLocks?.[z.id];
+  const isGlobalLocked = globalLock && Number(globalLock) > Date.now();
+  // For TEAM role, attackLocks is just { territoryId: timestamp } directly
+  // (the server only sends the viewer's own locks).
+  let isTeamLockedForMe = false;
+  if (state.role === "team") {
+    const lockVal = state.data?.attackLocks?.[z.id];
+    isTeamLockedForMe = lockVal && Number(lockVal) > Date.now();
   }
-  territoryNumberMarkerById.clear();
+  return Boolean(isGlobalLocked || isTeamLockedForMe);
+}
 
-  // Add new markers
+function updateMapMarkers() {
+  if (!map) return;
+  // Diff against the markers already on the map: untouched territories keep
+  // their marker, changed ones get a new icon, vanished ones are removed.
+  const seen = new Set();
   for (const z of state.data?.territories ?? []) {
-    const labelPt = labelPointInside(z.polygon, z.id);
-    if (labelPt) {
-      let html = `<div class="territoryNumber">${escapeHtml(territoryNumberText(z))}</div>`;
-      
-      const globalLock = state.data?.territoryLocks?.[z.id];
-      const teamLock = state.data?.attackLocks?.[z.id];
-      
-      const isGlobalLocked = globalLock && Number(globalLock) > Date.now();
-      const isTeamLocked = state.role === "team" && state.me && teamLock && (teamLock[state.me.id] && Number(teamLock[state.me.id]) > Date.now());
-      // Note: attackLocks structure on client:
-      // if admin: { territoryId: { teamId: timestamp } } (maybe?) 
-      // Actually server sends: "attackLocks": state.get("attackLocks", {}) if role == "admin" else (state.get("attackLocks", {}) or {}).get(team_id, {}) if (role == "team" and team_id) else {},
-      // So for TEAM role, attackLocks is just { territoryId: timestamp } directly!
-      
-      let isTeamLockedForMe = false;
-      if (state.role === "team") {
-         const lockVal = state.data?.attackLocks?.[z.id];
-         isTeamLockedForMe = lockVal && Number(lockVal) > Date.now();
-      }
-
-      if (isGlobalLocked || isTeamLockedForMe) {
-        // Lock icon
-        html = `<div class="territoryNumber" style="background:rgba(0,0,0,0.8);border-color:rgba(255,255,255,0.6)">🔒</div>`;
-      }
-      const marker = L.marker(labelPt, {
-        interactive: false,
-        icon: L.divIcon({
-          className: "territoryNumberIcon",
-          html: html,
-          iconSize: [26, 26],
-          iconAnchor: [13, 13]
-        })
-      }).addTo(map);
-      territoryNumberMarkerById.set(z.id, marker);
+    const labelPt = territoryLabelPoint(z);
+    if (!labelPt) continue;
+    seen.add(z.id);
+    const locked = isTerritoryLockedForViewer(z);
+    const text = territoryNumberText(z);
+    const key = `${locked ? 1 : 0}|${text}|${labelPt[0]},${labelPt[1]}`;
+    const existing = territoryNumberMarkerById.get(z.id);
+    if (existing && territoryMarkerKeyById.get(z.id) === key) continue;
+    territoryMarkerKeyById.set(z.id, key);
+
+    let html = `<div class="territoryNumber">${escapeHtml(text)}</div>`;
+    if (locked) {
+      // Lock icon
+      html = `<div class="territoryNumber" style="background:rgba(0,0,0,0.8);border-color:rgba(255,255,255,0.6)">🔒</div>`;
     }
+    const icon = L.divIcon({
+      className: "territoryNumberIcon",
+      html: html,
+      iconSize: [26, 26],
+      iconAnchor: [13, 13]
+    });
+    if (existing) {
+      existing.setLatLng(labelPt);
+      existing.setIcon(icon);
+      continue;
+    }
+    const marker = L.marker(labelPt, { interactive: false, icon }).addTo(map);
+    territoryNumberMarkerById.set(z.id, marker);
+  }
+  for (const [id, marker] of territoryNumberMarkerById) {
+    if (seen.has(id)) continue;
+    marker.remove();
+    territoryNumberMarkerById.delete(id);
+    territoryMarkerKeyById.delete(id);
   }
 }
 
@@ -1280,6 +1563,9 @@ function initMap() {
     territoryLayerById = new Map();
     territoryNumberMarkerById = new Map();
   }
+  labelPointById = new Map();
+  territoryStyleKeyById = new Map();
+  territoryMarkerKeyById = new Map();
 
   if (config.mapMode === "simple") {
     const w = config.simpleMap?.width ?? 1000;
@@ -1302,7 +1588,7 @@ function initMap() {
     }
   } else {
     // Geo Mode (WGS84 / Web Mercator)
-    map = L.map("map").setView([50.08, 16.3], 13);
+    map = L.map("map").setView([50.08, 16.3], INITIAL_GEO_ZOOM);
     
     // 1. OpenStreetMap (Fallback / Base)
     L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
@@ -1348,16 +1634,62 @@ function initMap() {
     territoryLayerById.set(z.id, layer);
   }
 
+  state.geometryLevel = Number(state.data?.geometryLevel ?? 0);
+  state.geometryByLevel = new Map([
+    [state.geometryLevel, new Map((state.data?.territories ?? []).map((z) => [z.id, z.polygon]))]
+  ]);
+  map.on("zoomend", () => {
+    refreshGeometryForZoom().catch(() => {});
+  });
+
   updateMapMarkers();
   applyTerritoryStyles();
+  refreshGeometryForZoom().catch(() => {});
+}
+
+function geometryLevelForZoom(zoom) {
+  // Mirrors TerritoryGeometry.level_for_zoom: coarsest level under half a pixel.
+  const levels = Array.isArray(state.geometryLevels) ? state.geometryLevels : [0];
+  const isGeo = state.data?.config?.mapMode === "geo";
+  const unitsPerPx = isGeo ? 360 / (256 * Math.pow(2, zoom)) : 1 / Math.pow(2, zoom);
+  let best = 0;
+  levels.forEach((tol, i) => {
+    if (Number(tol) <= unitsPerPx * 0.5) best = i;
+  });
+  return best;
+}
+
+async function refreshGeometryForZoom() {
+  if (!map || !Array.isArray(state.geometryLevels)) return;
+  const level = geometryLevelForZoom(map.getZoom());
+  if (level === state.geometryLevel) return;
+  let rings = state.geometryByLevel.get(level);
+  if (!rings) {
+    const res = await fetch(`${API_BASE}/api/geometry?geometry=polyline&level=${level}`);
+    if (!res.ok) return;
+    const payload = expandTerritoryGeometry(await res.json());
+    rings = new Map((payload.territories ?? []).map((t) => [t.id, t.polygon]));
+    state.geometryByLevel.set(level, rings);
+  }
+  if (!map || geometryLevelForZoom(map.getZoom()) !== level) return;
+  for (const [id, ring] of rings) {
+    territoryLayerById.get(id)?.setLatLngs(ring);
+  }
+  state.geometryLevel = level;
+}
+
+function stateQuery() {
+  const params = new URLSearchParams({ geometry: "polyline" });
+  params.set("zoom", String(map ? map.getZoom() : INITIAL_GEO_ZOOM));
+  if (state.token) params.set("token", state.token);
+  return `?${params.toString()}`;
 }
 
 async function loadInitialState() {
-  const qs = state.token ? `?token=${encodeURIComponent(state.token)}` : "";
-  const res = await fetch(`/api/state${qs}`);
-  state.data = await res.json();
+  const res = await fetch(`${API_BASE}/api/state${stateQuery()}`);
+  state.data = expandTerritoryGeometry(await res.json());
   state.territorySig = (state.data?.territories ?? []).map((t) => t.id).join("|");
-  renderLeaderboard();
+  setLeaderboard(state.data?.leaderboard);
   renderAdminBattles();
   renderEventLog();
   initMap();
@@ -1365,8 +1697,7 @@ async function loadInitialState() {
 
 async function forceRefresh() {
   try {
-    const qs = state.token ? `?token=${encodeURIComponent(state.token)}` : "";
-    const res = await fetch(`/api/state${qs}`);
+    const res = await fetch(`${API_BASE}/api/state${stateQuery()}`);
     if (res.ok) {
       const data = await res.json();
       onStateUpdate(data);
@@ -1377,7 +1708,12 @@ async function forceRefresh() {
 }
 
 async function apiPost(path, payload) {
-  const res = await fetch(path, {
+  // Actions of the logged-in session go over the open WebSocket when there
+  // is one; everything else (login, no socket) is a plain POST.
+  if (state.socket?.readyState === WebSocket.OPEN && payload?.token && payload.token === state.token) {
+    return socketCall(path, payload);
+  }
+  const res = await fetch(API_BASE + path, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(payload ?? {})
@@ -1390,28 +1726,119 @@ async function apiPost(path, payload) {
   return data;
 }
 
+function handleStreamEvent(event, data) {
+  if (event === "state") onStateUpdate(data);
+  else if (event === "leaderboard") setLeaderboard(data);
+  else if (event === "positions") applyTeamPositions(data?.teams ?? {});
+  else if (event === "queue") applyQueueDelta(data);
+}
+
 function startStream() {
   stopStream();
   stopPolling();
   if (!state.token) return;
+  // WebSocket first: pushes and actions share one connection. A socket
+  // that never opens (proxy without upgrade support) means SSE from then on.
+  if (window.WebSocket && !state.socketUnsupported) startSocket();
+  else startEventSource();
+}
 
-  const es = new EventSource(`/api/stream?token=${encodeURIComponent(state.token)}`);
-  state.eventSource = es;
+function startSocket() {
+  const proto = window.location.protocol === "https:" ? "wss:" : "ws:";
+  const ws = new WebSocket(`${proto}//${window.location.host}${API_BASE}/api/ws${stateQuery()}`);
+  state.socket = ws;
+  let opened = false;
 
-  es.addEventListener("open", () => {
+  ws.addEventListener("open", () => {
+    opened = true;
     state.streamRetryMs = 750;
     state.streamFailCount = 0;
     setStatus("Online");
   });
 
-  es.addEventListener("state", (evt) => {
+  ws.addEventListener("message", (evt) => {
+    let msg;
     try {
-      const data = JSON.parse(evt.data);
-      onStateUpdate(data);
+      msg = JSON.parse(evt.data);
     } catch {
       setStatus("Chyba streamu");
+      return;
+    }
+    if (msg?.event) {
+      try {
+        handleStreamEvent(msg.event, msg.data);
+      } catch {
+        setStatus("Chyba streamu");
+      }
+      return;
+    }
+    const call = state.socketCalls.get(msg?.id);
+    if (!call) return;
+    state.socketCalls.delete(msg.id);
+    clearTimeout(call.timer);
+    if (msg.status >= 200 && msg.status < 300) call.resolve(msg.body ?? {});
+    else call.reject(new Error(msg.body?.error ?? `Chyba ${msg.status}`));
+  });
+
+  ws.addEventListener("close", () => {
+    if (state.socket !== ws) return;
+    state.socket = null;
+    rejectSocketCalls();
+    if (!opened) {
+      state.socketUnsupported = true;
+      startStream();
+      return;
+    }
+    state.streamFailCount = Number(state.streamFailCount || 0) + 1;
+    if (state.streamFailCount >= 3) {
+      startPolling();
+      return;
     }
+    scheduleStreamReconnect();
+  });
+}
+
+function socketCall(path, payload) {
+  const ws = state.socket;
+  const id = ++state.socketCallSeq;
+  const { token, ...body } = payload ?? {};
+  return new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      state.socketCalls.delete(id);
+      reject(new Error("Server neodpovídá."));
+    }, 20000);
+    state.socketCalls.set(id, { resolve, reject, timer });
+    ws.send(JSON.stringify({ id, path, body }));
   });
+}
+
+function rejectSocketCalls() {
+  for (const call of state.socketCalls.values()) {
+    clearTimeout(call.timer);
+    call.reject(new Error("Spojení se serverem se přerušilo."));
+  }
+  state.socketCalls.clear();
+}
+
+function startEventSource() {
+  const es = new EventSource(`${API_BASE}/api/stream${stateQuery()}`);
+  state.eventSource = es;
+
+  es.addEventListener("open", () => {
+    state.streamRetryMs = 750;
+    state.streamFailCount = 0;
+    setStatus("Online");
+  });
+
+  for (const event of ["state", "leaderboard", "positions", "queue"]) {
+    es.addEventListener(event, (evt) => {
+      try {
+        handleStreamEvent(event, JSON.parse(evt.data));
+      } catch {
+        setStatus("Chyba streamu");
+      }
+    });
+  }
 
   es.addEventListener("error", () => {
     // Only set error status if we are really disconnected for a while
@@ -1426,10 +1853,6 @@ function startStream() {
   });
 }
 
-function scheduleStreamReconnect() {
-    setTimeout(startStream, state.streamRetryMs || 1000);
-}
-
 function startPolling() {
   stopStream();
   if (!state.token) return;
@@ -1452,7 +1875,7 @@ async function pollOnce() {
   if (!state.token) return;
   if (document.visibilityState !== "visible") return;
   try {
-    const res = await fetch(`/api/state?token=${encodeURIComponent(state.token)}`);
+    const res = await fetch(`${API_BASE}/api/state${stateQuery()}`);
     const data = await res.json().catch(() => ({}));
     if (!res.ok) throw new Error(data?.error ?? `Chyba ${res.status}`);
     onStateUpdate(data);
@@ -1485,6 +1908,12 @@ function scheduleStreamReconnect() {
 }
 
 function stopStream() {
+  if (state.socket) {
+    const ws = state.socket;
+    state.socket = null;
+    rejectSocketCalls();
+    ws.close();
+  }
   if (state.eventSource) {
     state.eventSource.close();
     state.eventSource = null;
@@ -1497,6 +1926,7 @@ function stopStream() {
 
 function onStateUpdate(data) {
   const first = !state.data;
+  expandTerritoryGeometry(data);
   
   // Merge territories to preserve polygons/neighbors if compact update (missing static data)
   if (state.data && state.data.territories && data.territories) {
@@ -1510,6 +1940,9 @@ function onStateUpdate(data) {
         if (!t.neighbors || t.neighbors.length === 0) {
            t.neighbors = old.neighbors;
         }
+        if (!t.labelPoint && old.labelPoint) {
+           t.labelPoint = old.labelPoint;
+        }
       }
     }
   }
@@ -1521,22 +1954,25 @@ function onStateUpdate(data) {
 
   if (first || sigChanged) {
     initMap();
+    if (state.role === "admin") loadTeamPositions().catch(() => {});
   } else {
-    // ALWAYS update markers if map exists, to reflect lock changes immediately
-    if (map) {
-       // We can optimize by checking signatures, but user wants robust refresh.
-       // Let's re-run marker logic if ownership/locks changed.
-       const newOwnerSig = (state.data?.territories ?? []).map(t => `${t.id}:${t.ownerTeamId}:${state.data?.territoryLocks?.[t.id] || ''}:${state.data?.attackLocks?.[t.id] || ''}`).join("|");
-       if (state.ownerSig !== newOwnerSig) {
-           state.ownerSig = newOwnerSig;
-           updateMapMarkers();
-       }
-    }
+    // Marker and style updates diff per territory, so this only touches
+    // layers whose owner or lock actually changed (or whose lock expired).
+    updateMapMarkers();
+  }
+  if (data.leaderboard) {
+    setLeaderboard(data.leaderboard);
+  } else {
+    // Team names or colors may have changed; the ranking itself arrives
+    // as its own "leaderboard" event.
+    state.leaderboardRendered = null;
+    renderLeaderboard();
   }
-  renderLeaderboard();
   applyTerritoryStyles();
+  if (data.reviewQueue) setReviewQueue(data.reviewQueue);
   renderAdminBattles();
   renderEventLog();
+  syncPositionTracking();
   const cr = Array.isArray(state.data?.claimRequests) ? state.data.claimRequests : [];
   const pending = cr.filter((r) => r && typeof r === "object" && (r.status ?? "pending") === "pending");
   const vr = Array.isArray(state.data?.claimVerifyRequests) ? state.data.claimVerifyRequests : [];
@@ -1627,8 +2063,9 @@ function logout() {
   }
   stopStream();
   stopPolling();
+  stopPositionTracking();
   setAdminPanelVisible(false);
-  window.location.href = "/";
+  window.location.href = `${API_BASE}/`;
 }
 
 els.logoutBtn.addEventListener("click", logout);
@@ -1649,7 +2086,7 @@ function showTerritoryModal(territoryId, info) {
   const isAdmin = state.role === "admin";
   const canActTeam = state.role === "team" && Boolean(state.me);
   const gpsRequired =
-    canActTeam && Boolean(state.data?.config?.gpsEnabled) && state.data?.config?.mapMode === "osm";
+    canActTeam && Boolean(state.data?.config?.gpsEnabled) && state.data?.config?.mapMode !== "simple";
   const gpsOk = state.gpsOkByTerritoryId.get(territoryId) === true;
   const lockUntilMs = Number(info?.lockUntilMs ?? 0);
   const lockActive = Number.isFinite(lockUntilMs) && nowMs() < lockUntilMs;
@@ -1850,7 +2287,7 @@ function showTerritoryModal(territoryId, info) {
       kind: "primary",
       onClick: () => {
         const gpsRequiredNow =
-          Boolean(state.data?.config?.gpsEnabled) && state.data?.config?.mapMode === "osm";
+          Boolean(state.data?.config?.gpsEnabled) && state.data?.config?.mapMode !== "simple";
         const gpsOkNow = state.gpsOkByTerritoryId.get(territoryId) === true;
         if (gpsRequiredNow && !gpsOkNow) {
           openModal({
@@ -2000,6 +2437,114 @@ function getGpsPosition() {
   });
 }
 
+// Live team tracking: phones batch their fixes and post them every few
+// seconds; the admin map shows the latest fix and a trail per team.
+function syncPositionTracking() {
+  const enabled =
+    state.role === "team" &&
+    Boolean(state.token) &&
+    Boolean(state.data?.config?.positionTracking) &&
+    !state.data?.config?.gameLocked &&
+    Boolean(navigator.geolocation);
+  if (!enabled) {
+    stopPositionTracking();
+    return;
+  }
+  if (state.positionWatchId !== null) return;
+  state.positionWatchId = navigator.geolocation.watchPosition(
+    (pos) => {
+      state.positionSamples.push({
+        tsMs: pos.timestamp,
+        lat: pos.coords.latitude,
+        lng: pos.coords.longitude,
+        accuracyM: pos.coords.accuracy
+      });
+      if (state.positionSamples.length > 200) state.positionSamples.splice(0, state.positionSamples.length - 200);
+    },
+    () => {},
+    { enableHighAccuracy: true, maximumAge: 5000 }
+  );
+  state.positionTimer = setInterval(() => {
+    flushPositions().catch(() => {});
+  }, 5000);
+}
+
+function stopPositionTracking() {
+  if (state.positionWatchId !== null) {
+    navigator.geolocation?.clearWatch(state.positionWatchId);
+    state.positionWatchId = null;
+  }
+  if (state.positionTimer) {
+    clearInterval(state.positionTimer);
+    state.positionTimer = null;
+  }
+  state.positionSamples = [];
+}
+
+async function flushPositions() {
+  const samples = state.positionSamples;
+  if (!samples.length || !state.token) return;
+  state.positionSamples = [];
+  try {
+    await apiPost("/api/positions", { token: state.token, samples });
+  } catch (e) {
+    // Keep them for the next round (bounded), e.g. while the phone is offline.
+    state.positionSamples = samples.concat(state.positionSamples).slice(-200);
+    throw e;
+  }
+}
+
+async function loadTeamPositions() {
+  if (!state.data?.config?.positionTracking) return;
+  const res = await fetch(`${API_BASE}/api/admin/positions?token=${encodeURIComponent(state.token ?? "")}`);
+  if (!res.ok) return;
+  const payload = await res.json();
+  state.teamPositions = new Map(Object.entries(payload?.teams ?? {}));
+  state.positionLayerByTeam = new Map();
+  renderTeamPositions();
+}
+
+function applyTeamPositions(teams) {
+  for (const [teamId, latest] of Object.entries(teams)) {
+    const pos = state.teamPositions.get(teamId) ?? { latest: null, trail: [] };
+    pos.latest = latest;
+    pos.trail.push(latest);
+    if (pos.trail.length > 720) pos.trail.splice(0, pos.trail.length - 720);
+    state.teamPositions.set(teamId, pos);
+  }
+  renderTeamPositions();
+}
+
+function renderTeamPositions() {
+  if (!map || state.role !== "admin" || state.data?.config?.mapMode === "simple") return;
+  for (const [teamId, pos] of state.teamPositions) {
+    if (!Array.isArray(pos?.latest)) continue;
+    const team = teamById(teamId);
+    const color = team?.color ?? "#ff0000";
+    const latLng = [pos.latest[1], pos.latest[2]];
+    const trail = (pos.trail ?? []).map((p) => [p[1], p[2]]);
+    const layers = state.positionLayerByTeam.get(teamId);
+    if (layers && map.hasLayer(layers.marker)) {
+      layers.trail.setLatLngs(trail);
+      layers.marker.setLatLng(latLng);
+      continue;
+    }
+    state.positionLayerByTeam.set(teamId, {
+      trail: L.polyline(trail, { pane: "territories", color, weight: 2, opacity: 0.7 }).addTo(map),
+      marker: L.circleMarker(latLng, {
+        pane: "territories",
+        color: "#fff",
+        weight: 2,
+        fillColor: color,
+        fillOpacity: 1,
+        radius: 6
+      })
+        .addTo(map)
+        .bindTooltip(team?.name ?? teamId)
+    });
+  }
+}
+
 // Sidebar Toggle
 const menuToggleBtn = document.getElementById("menuToggleBtn");
 const sidebar = document.querySelector(".sidebar");
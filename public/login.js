@@ -5,9 +5,19 @@ const els = {
   loginStatus: document.getElementById("loginStatus")
 };
 
+// Games hosted under /g/<gameId>/ talk to their own API and keep their own login.
+const API_BASE = (window.location.pathname.match(/^\/g\/[A-Za-z0-9_-]+/) || [""])[0];
+
 const storage = (() => {
   try {
-    return window.localStorage;
+    const ls = window.localStorage;
+    if (!API_BASE) return ls;
+    const key = (k) => `${API_BASE}:${k}`;
+    return {
+      getItem: (k) => ls.getItem(key(k)),
+      setItem: (k, v) => ls.setItem(key(k), v),
+      removeItem: (k) => ls.removeItem(key(k))
+    };
   } catch {
     return null;
   }
@@ -51,7 +61,7 @@ function setStatus(text) {
 }
 
 async function apiPost(path, payload) {
-  const res = await fetch(path, {
+  const res = await fetch(API_BASE + path, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(payload ?? {})
@@ -103,7 +113,7 @@ function renderMenu() {
 }
 
 async function loadTeams() {
-  const res = await fetch("/api/state");
+  const res = await fetch(`${API_BASE}/api/state`);
   const data = await res.json();
   state.teams = data?.teams ?? [];
   renderMenu();
@@ -125,7 +135,7 @@ async function doLogin() {
         }
       } catch {
       }
-      window.location.href = `/map.html?token=${encodeURIComponent(data.token)}&role=admin`;
+      window.location.href = `${API_BASE}/map.html?token=${encodeURIComponent(data.token)}&role=admin`;
       return;
     }
 
@@ -138,7 +148,7 @@ async function doLogin() {
       }
     } catch {
     }
-    window.location.href = `/map.html?token=${encodeURIComponent(data.token)}&role=team&teamId=${encodeURIComponent(
+    window.location.href = `${API_BASE}/map.html?token=${encodeURIComponent(data.token)}&role=team&teamId=${encodeURIComponent(
       data.team?.id ?? ""
     )}&teamName=${encodeURIComponent(data.team?.name ?? "")}&teamColor=${encodeURIComponent(data.team?.color ?? "")}`;
   } catch (e) {
@@ -0,0 +1,198 @@
+// Admin replay of territory ownership. The owners at the game start arrive as
+// one full frame, then only the territories that changed per time step
+// (see /api/admin/replay). Every KEYFRAME_EVERY frames a full copy is kept,
+// so seeking replays at most that many small frames.
+const els = {
+  map: document.getElementById("replayMap"),
+  playBtn: document.getElementById("replayPlayBtn"),
+  slider: document.getElementById("replaySlider"),
+  time: document.getElementById("replayTime"),
+  speed: document.getElementById("replaySpeed"),
+  snapshotLink: document.getElementById("replaySnapshotLink"),
+  status: document.getElementById("replayStatus")
+};
+
+// Games hosted under /g/<gameId>/ talk to their own API and keep their own login.
+const API_BASE = (window.location.pathname.match(/^\/g\/[A-Za-z0-9_-]+/) || [""])[0];
+
+const storage = (() => {
+  try {
+    const ls = window.localStorage;
+    if (!API_BASE) return ls;
+    const key = (k) => `${API_BASE}:${k}`;
+    return {
+      getItem: (k) => ls.getItem(key(k)),
+      setItem: (k, v) => ls.setItem(key(k), v),
+      removeItem: (k) => ls.removeItem(key(k))
+    };
+  } catch {
+    return null;
+  }
+})();
+
+const KEYFRAME_EVERY = 100;
+const TICK_MS = 100;
+
+const replay = {
+  token: storage?.getItem("token") || null,
+  header: null,
+  frames: [],
+  keyframes: [],
+  shown: null,
+  layers: new Map(),
+  timeMs: 0,
+  timer: null
+};
+
+const fmt = new Intl.DateTimeFormat("cs-CZ", { hour: "2-digit", minute: "2-digit", second: "2-digit" });
+
+function setStatus(text) {
+  els.status.textContent = text ?? "";
+}
+
+async function loadMap() {
+  const res = await fetch(`${API_BASE}/api/state?token=${encodeURIComponent(replay.token ?? "")}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const data = await res.json();
+  const config = data?.config ?? {};
+  let map;
+  if (config.mapMode === "simple") {
+    const w = config.simpleMap?.width ?? 1000;
+    const h = config.simpleMap?.height ?? 1000;
+    map = L.map(els.map, { crs: L.CRS.Simple, minZoom: -2, maxZoom: 2, zoomSnap: 0.25 });
+    if (config.simpleMap?.imageUrl) L.imageOverlay(config.simpleMap.imageUrl, [[0, 0], [h, w]]).addTo(map);
+    map.fitBounds([[0, 0], [h, w]]);
+  } else {
+    map = L.map(els.map).setView([50.08, 16.3], 14);
+    L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+      attribution: "© OpenStreetMap contributors",
+      maxZoom: 19
+    }).addTo(map);
+  }
+  const byId = new Map();
+  const bounds = [];
+  for (const z of data?.territories ?? []) {
+    if (!Array.isArray(z.polygon) || z.polygon.length === 0) continue;
+    const layer = L.polygon(z.polygon, { color: "#000000", weight: 2, fillColor: "#808080", fillOpacity: 0.1 }).addTo(map);
+    layer.bindTooltip(String(z.name ?? z.id));
+    byId.set(String(z.id), layer);
+    bounds.push(...z.polygon);
+  }
+  if (config.mapMode !== "simple" && bounds.length) map.fitBounds(bounds);
+  return byId;
+}
+
+function handleLine(msg, live) {
+  if (msg.type === "header") {
+    replay.header = msg;
+  } else if (msg.type === "frame" && Array.isArray(msg.owners)) {
+    live.owners = Int16Array.from(msg.owners);
+    replay.frames.push({ t: Number(msg.t), set: [] });
+    replay.keyframes.push(live.owners.slice());
+  } else if (msg.type === "frame" && live.owners) {
+    for (const [i, team] of msg.set ?? []) live.owners[i] = team;
+    replay.frames.push({ t: Number(msg.t), set: msg.set ?? [] });
+    if ((replay.frames.length - 1) % KEYFRAME_EVERY === 0) replay.keyframes.push(live.owners.slice());
+  }
+}
+
+async function loadReplay() {
+  // The export is NDJSON written as the server reads its log: parse it line
+  // by line instead of waiting for the whole body.
+  const qs = new URLSearchParams({ token: replay.token ?? "", stepMs: "1000" });
+  const res = await fetch(`${API_BASE}/api/admin/replay?${qs.toString()}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const live = { owners: null };
+  let buf = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let nl;
+    while ((nl = buf.indexOf("\n")) >= 0) {
+      const line = buf.slice(0, nl);
+      buf = buf.slice(nl + 1);
+      if (line) handleLine(JSON.parse(line), live);
+    }
+    setStatus(`Načteno ${replay.frames.length} změn…`);
+  }
+}
+
+function frameAt(timeMs) {
+  let lo = 0;
+  let hi = replay.frames.length - 1;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (replay.frames[mid].t <= timeMs) lo = mid;
+    else hi = mid - 1;
+  }
+  return lo;
+}
+
+function ownersAt(k) {
+  const kf = Math.floor(k / KEYFRAME_EVERY);
+  const owners = replay.keyframes[kf].slice();
+  for (let j = kf * KEYFRAME_EVERY + 1; j <= k; j++) {
+    for (const [i, team] of replay.frames[j].set) owners[i] = team;
+  }
+  return owners;
+}
+
+function showTime(timeMs) {
+  const h = replay.header;
+  replay.timeMs = Math.max(h.fromMs, Math.min(h.toMs, timeMs));
+  const owners = ownersAt(frameAt(replay.timeMs));
+  h.territories.forEach((tid, i) => {
+    if (replay.shown && replay.shown[i] === owners[i]) return;
+    const layer = replay.layers.get(tid);
+    const team = h.teams[owners[i]];
+    if (layer) layer.setStyle({ fillColor: team?.color ?? "#808080", fillOpacity: team ? 0.35 : 0.1 });
+  });
+  replay.shown = owners;
+  els.slider.value = String(Math.round((replay.timeMs - h.fromMs) / 1000));
+  els.time.textContent = fmt.format(new Date(replay.timeMs));
+  const qs = new URLSearchParams({ token: replay.token ?? "", atMs: String(Math.round(replay.timeMs)) });
+  els.snapshotLink.href = `${API_BASE}/api/admin/replay/snapshot?${qs.toString()}`;
+}
+
+function setPlaying(on) {
+  window.clearInterval(replay.timer);
+  replay.timer = null;
+  els.playBtn.textContent = on ? "⏸" : "▶";
+  if (!on) return;
+  if (replay.timeMs >= replay.header.toMs) showTime(replay.header.fromMs);
+  replay.timer = window.setInterval(() => {
+    showTime(replay.timeMs + TICK_MS * Number(els.speed.value));
+    if (replay.timeMs >= replay.header.toMs) setPlaying(false);
+  }, TICK_MS);
+}
+
+async function init() {
+  if (!replay.token || storage?.getItem("role") !== "admin") {
+    setStatus("Záznam hry je jen pro admina.");
+    return;
+  }
+  try {
+    replay.layers = await loadMap();
+    await loadReplay();
+  } catch (e) {
+    setStatus(`Záznam nejde načíst (${e?.message ?? e}).`);
+    return;
+  }
+  const h = replay.header;
+  if (!h || replay.frames.length === 0) {
+    setStatus("Záznam je prázdný.");
+    return;
+  }
+  els.slider.max = String(Math.ceil((h.toMs - h.fromMs) / 1000));
+  els.slider.disabled = false;
+  els.playBtn.disabled = false;
+  els.slider.addEventListener("input", () => showTime(h.fromMs + Number(els.slider.value) * 1000));
+  els.playBtn.addEventListener("click", () => setPlaying(!replay.timer));
+  showTime(h.fromMs);
+  setStatus(`${replay.frames.length - 1} změn od ${fmt.format(new Date(h.fromMs))} do ${fmt.format(new Date(h.toMs))}.`);
+}
+
+init();
@@ -1,20 +1,71 @@
+import heapq
 import json
-import copy
+import math
 import os
+import random
 import secrets
+import sqlite3
+import sys
 import threading
 import time
+import argparse
 import base64
+import cProfile
+import bisect
+import contextlib
+import contextvars
+import re
+import functools
+import hashlib
+import hmac
+import selectors
+import shutil
+import signal
+import socket
+from array import array
+from collections import OrderedDict, deque
 from http import HTTPStatus
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from queue import Queue, Empty, Full
 from urllib.parse import urlparse, parse_qs
 
+try:
+    import fcntl
+except ImportError:  # not on Windows; WORKERS > 1 needs it
+    fcntl = None
+
 
 PORT = int(os.environ.get("PORT", "5173"))
 DATA_DIR = os.path.join(os.getcwd(), "data")
-UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
 STATE_PATH = os.path.join(DATA_DIR, "state.json")
+STATE_LOCK_PATH = os.path.join(DATA_DIR, "state.lock")
+SQLITE_PATH = os.path.join(DATA_DIR, "state.sqlite3")
+GAMES_DIR = os.path.join(DATA_DIR, "games")
+GEOMETRY_CACHE_DIR = os.path.join(DATA_DIR, "geometry-cache")
+GAMES_MAX_LOADED = int(os.environ.get("GAMES_MAX_LOADED", "20") or 20)
+GAMES_MEMORY_MB = float(os.environ.get("GAMES_MEMORY_MB", "256") or 256)
+GAMES_IDLE_S = float(os.environ.get("GAMES_IDLE_S", "900") or 900)
+STORAGE = os.environ.get("STORAGE", "json")
+WORKERS = max(1, int(os.environ.get("WORKERS", "1") or 1))
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+KEEPALIVE_IDLE_S = float(os.environ.get("KEEPALIVE_IDLE_S", "15") or 15)
+KEEPALIVE_MAX = int(os.environ.get("KEEPALIVE_MAX", "64") or 64)
+REQUEST_TIMEOUT_S = float(os.environ.get("REQUEST_TIMEOUT_S", "60") or 60)
+MAX_DRAIN_BYTES = 1024 * 1024
+HTTP_THREADS = max(1, int(os.environ.get("HTTP_THREADS", "32") or 32))
+HTTP_BACKLOG = max(1, int(os.environ.get("HTTP_BACKLOG", "256") or 256))
+STREAMS_MAX = int(os.environ.get("STREAMS_MAX", "500") or 500)
+STREAMS_PER_SESSION = int(os.environ.get("STREAMS_PER_SESSION", "4") or 4)
+RATE_LIMIT = os.environ.get("RATE_LIMIT", "1") != "0"
+TRUST_PROXY = os.environ.get("TRUST_PROXY", "0") == "1"
+WS_PING_S = 15.0
+WS_MAX_MESSAGE = 16 * 1024 * 1024
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+POSITIONS_TRAIL_LEN = int(os.environ.get("POSITIONS_TRAIL_LEN", "720") or 720)
+POSITIONS_MIN_INTERVAL_S = float(os.environ.get("POSITIONS_MIN_INTERVAL_S", "10") or 10)
+POSITIONS_MIN_DISTANCE_M = float(os.environ.get("POSITIONS_MIN_DISTANCE_M", "10") or 10)
+POSITIONS_FLUSH_S = float(os.environ.get("POSITIONS_FLUSH_S", "30") or 30)
+POSITIONS_BROADCAST_S = float(os.environ.get("POSITIONS_BROADCAST_S", "2") or 2)
 PUBLIC_DIR = os.path.join(os.getcwd(), "public")
 
 DUMMY_TASKS = [
@@ -33,9 +84,310 @@ def now_ms() -> int:
     return int(time.time() * 1000)
 
 
+METRIC_BUCKETS_MS = (1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0, 10000.0)
+
+
+class Metrics:
+    # In-process counters and fixed-bucket latency histograms. One lock and a
+    # bisect per observation, cheap enough to stay on in production.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], list] = {}
+        self.routes: set[str] = set()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, ms: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect.bisect_left(METRIC_BUCKETS_MS, ms)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                # [per-bucket counts (+Inf last), count, sum]
+                h = [[0] * (len(METRIC_BUCKETS_MS) + 1), 0, 0.0]
+                self._histograms[key] = h
+            h[0][i] += 1
+            h[1] += 1
+            h[2] += ms
+
+    def timed(self, name: str):
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    ms = (time.perf_counter() - t0) * 1000.0
+                    self.observe(name, ms)
+                    profiler.span(name, ms)
+
+            return wrapper
+
+        return decorate
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "bucketsMs": list(METRIC_BUCKETS_MS),
+                    "counts": list(h[0]),
+                    "count": h[1],
+                    "sumMs": round(h[2], 3),
+                }
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+        return {"uptimeS": self.uptime_s(), "counters": counters, "histograms": histograms}
+
+    def uptime_s(self) -> float:
+        return round(time.time() - self._started, 1)
+
+    def prometheus(self, gauges: dict) -> str:
+        def fmt_labels(labels: dict, extra: tuple = ()) -> str:
+            items = list(labels.items()) + list(extra)
+            if not items:
+                return ""
+
+            def esc(v) -> str:
+                return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+        snap = self.snapshot()
+        lines: list[str] = []
+        typed: set[str] = set()
+        for c in snap["counters"]:
+            name = f"tbor_{c['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{fmt_labels(c['labels'])} {c['value']}")
+        for h in snap["histograms"]:
+            name = f"tbor_{h['name']}_ms"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for le, n in zip(list(h["bucketsMs"]) + ["+Inf"], h["counts"]):
+                cumulative += n
+                lines.append(f"{name}_bucket{fmt_labels(h['labels'], (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{fmt_labels(h['labels'])} {h['sumMs']}")
+            lines.append(f"{name}_count{fmt_labels(h['labels'])} {h['count']}")
+        for gname, series in sorted(gauges.items()):
+            name = f"tbor_{gname}"
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(series, dict):
+                for label_value, v in sorted(series.items()):
+                    lines.append(f'{name}{{key="{label_value}"}} {v}')
+            else:
+                lines.append(f"{name} {series}")
+        lines.append("# TYPE tbor_uptime_seconds gauge")
+        lines.append(f"tbor_uptime_seconds {snap['uptimeS']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+SLOW_LOG_PATH = os.path.join(PROFILE_DIR, "slow.jsonl")
+
+
+class RequestTrace:
+    __slots__ = ("phases", "profile")
+
+    def __init__(self, profile=None) -> None:
+        self.phases: dict[str, list] = {}
+        self.profile = profile
+
+
+class Profiler:
+    # Opt-in: off unless PROFILE_SAMPLE > 0 or an admin turns it on. Sampled
+    # requests collect per-phase timings from the metrics.timed() functions;
+    # in cprofile mode one sampled request at a time also runs under cProfile.
+    # Requests slower than slow_ms are appended to the slow log, with the
+    # cProfile dump (if any) saved next to it.
+    def __init__(self) -> None:
+        self.sample_rate = min(1.0, max(0.0, float(os.environ.get("PROFILE_SAMPLE", "0") or 0)))
+        self.slow_ms = float(os.environ.get("PROFILE_SLOW_MS", "500") or 500)
+        self.mode = "cprofile" if os.environ.get("PROFILE_MODE") == "cprofile" else "spans"
+        self.keep = int(os.environ.get("PROFILE_KEEP", "50") or 50)
+        self.slow_log_bytes = int(os.environ.get("PROFILE_SLOW_LOG_BYTES", "1000000") or 1000000)
+        self._local = threading.local()
+        self._cprofile_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # (pid, fd) of slow.lock: workers share slow.jsonl, and a descriptor
+        # inherited over fork would share its flock too.
+        self._lock_file: tuple[int, int] | None = None
+
+    def settings(self) -> dict:
+        return {"sampleRate": self.sample_rate, "slowMs": self.slow_ms, "mode": self.mode, "keep": self.keep}
+
+    def configure(self, body: dict) -> None:
+        if "sampleRate" in body:
+            self.sample_rate = min(1.0, max(0.0, float(body.get("sampleRate") or 0)))
+        if "slowMs" in body:
+            self.slow_ms = max(0.0, float(body.get("slowMs") or 0))
+        if body.get("mode") in ("spans", "cprofile"):
+            self.mode = body["mode"]
+
+    def begin(self) -> RequestTrace | None:
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return None
+        profile = None
+        # cProfile hooks are per thread, but only one profiler may be active
+        # at a time on newer Pythons; other sampled requests get spans only.
+        if self.mode == "cprofile" and self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+        trace = RequestTrace(profile)
+        self._local.trace = trace
+        return trace
+
+    def span(self, name: str, ms: float) -> None:
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return
+        p = trace.phases.get(name)
+        if p is None:
+            trace.phases[name] = [ms, 1]
+        else:
+            p[0] += ms
+            p[1] += 1
+
+    def run(self, trace: RequestTrace, fn) -> None:
+        if trace.profile is None:
+            fn()
+            return
+        try:
+            trace.profile.runcall(fn)
+        finally:
+            self._cprofile_lock.release()
+
+    def finish(self, trace: RequestTrace, method: str, route: str, status: int, elapsed_ms: float) -> None:
+        self._local.trace = None
+        if elapsed_ms < self.slow_ms:
+            return
+        metrics.inc("slow_requests_total", route=route)
+        ts = now_ms()
+        entry = {
+            "tsMs": ts,
+            "method": method,
+            "route": route,
+            "status": status,
+            "ms": round(elapsed_ms, 3),
+            # Phase times are inclusive: sanitize time inside a broadcast is
+            # counted under both.
+            "phases": {name: {"ms": round(p[0], 3), "calls": p[1]} for name, p in sorted(trace.phases.items())},
+            "profile": None,
+        }
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if trace.profile is not None:
+                name = f"{ts}-{method.lower()}-{route.strip('/').replace('/', '_') or 'root'}-{secrets.token_hex(3)}.prof"
+                trace.profile.dump_stats(os.path.join(PROFILE_DIR, name))
+                entry["profile"] = name
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+            with self.slow_log_lock():
+                with open(SLOW_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    size = f.tell()
+                if size > self.slow_log_bytes:
+                    self.trim_slow_log()
+                self.prune()
+        except OSError as e:
+            print(f"Profiler write failed: {e}")
+
+    @contextlib.contextmanager
+    def slow_log_lock(self):
+        # Appends and trims of slow.jsonl, across threads and worker processes.
+        with self._write_lock:
+            if WORKERS <= 1 or fcntl is None:
+                yield
+                return
+            if self._lock_file is None or self._lock_file[0] != os.getpid():
+                fd = os.open(os.path.join(PROFILE_DIR, "slow.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+                self._lock_file = (os.getpid(), fd)
+            fd = self._lock_file[1]
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def trim_slow_log(self) -> None:
+        # Keep the newest half once the log outgrows slow_log_bytes; called
+        # under slow_log_lock().
+        with open(SLOW_LOG_PATH, "rb") as f:
+            f.seek(-min(self.slow_log_bytes // 2, os.fstat(f.fileno()).st_size), os.SEEK_END)
+            data = f.read()
+        # Without a newline the kept part is one partial line: drop it all.
+        cut = data.find(b"\n")
+        data = data[cut + 1:] if cut >= 0 else b""
+        tmp = f"{SLOW_LOG_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, SLOW_LOG_PATH)
+
+    def prune(self) -> None:
+        files = self.profile_files()
+        for info in files[self.keep:]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, info["name"]))
+            except OSError:
+                pass
+
+    def profile_files(self) -> list[dict]:
+        try:
+            names = [n for n in os.listdir(PROFILE_DIR) if n.endswith(".prof")]
+        except OSError:
+            return []
+        out = []
+        for n in names:
+            try:
+                st = os.stat(os.path.join(PROFILE_DIR, n))
+            except OSError:
+                continue
+            out.append({"name": n, "bytes": st.st_size, "mtimeMs": int(st.st_mtime * 1000)})
+        out.sort(key=lambda x: x["mtimeMs"], reverse=True)
+        return out
+
+    def slow_log_tail(self, limit: int) -> list[dict]:
+        try:
+            with open(SLOW_LOG_PATH, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                # Roughly 1 kB per entry is plenty for the tail.
+                f.seek(max(0, size - limit * 1024))
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        out = []
+        for raw in lines[-limit:]:
+            try:
+                out.append(json.loads(raw.decode("utf-8")))
+            except ValueError:
+                continue
+        return out
+
+
+profiler = Profiler()
+
+
 def ensure_data_dir() -> None:
-    os.makedirs(DATA_DIR, exist_ok=True)
-    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    game = current_game()
+    os.makedirs(game.data_dir, exist_ok=True)
+    os.makedirs(game.uploads_dir, exist_ok=True)
     
     # If state.json is missing in DATA_DIR (e.g. empty volume), try to copy from INITIAL_DATA_DIR
     # if not os.path.exists(STATE_PATH) and os.path.exists(INITIAL_DATA_DIR):
@@ -67,17 +419,743 @@ def save_base64_image(data_uri: str, prefix: str) -> str | None:
         
         data = base64.b64decode(encoded)
         filename = f"{prefix}_{secrets.token_hex(8)}{ext}"
-        path = os.path.join(UPLOADS_DIR, filename)
+        path = os.path.join(current_game().uploads_dir, filename)
         with open(path, "wb") as f:
             f.write(data)
-        return f"/uploads/{filename}"
+        return f"{current_game().url_prefix}/uploads/{filename}"
     except Exception:
         return None
 
 
+def event_history(
+    events: list[tuple[int, dict]],
+    team_id: str | None = None,
+    territory_id: str | None = None,
+    kind: str | None = None,
+    since_ms: int | None = None,
+    until_ms: int | None = None,
+    before: int | None = None,
+    limit: int = 100,
+) -> dict:
+    # events: (seq, event) pairs in ascending seq order; newest first out.
+    out: list[dict] = []
+    last_seq = None
+    for seq, ev in reversed(events):
+        if before is not None and seq >= before:
+            continue
+        if kind and ev.get("kind") != kind:
+            continue
+        if territory_id and ev.get("territoryId") != territory_id:
+            continue
+        if team_id and team_id not in (ev.get("teamIds") or []):
+            continue
+        ts = ev.get("tsMs") or 0
+        if since_ms is not None and ts < since_ms:
+            continue
+        if until_ms is not None and ts >= until_ms:
+            continue
+        out.append(ev)
+        last_seq = seq
+        if len(out) >= limit:
+            break
+    return {"events": out, "nextBefore": last_seq if len(out) >= limit else None}
+
+
+class EventLog:
+    # Append-only history of all events in <game>/events/NNNNNN.jsonl
+    # segments of SEGMENT_EVENTS lines. write_state() gives new events a
+    # dense seq and appends them under the state lock, so there is a single
+    # writer even with several workers. The seqs are given before the state
+    # is saved and the lines written after, by commit(), which also cuts off
+    # anything past the saved eventSeq; the in-state eventLog stays a short
+    # window and clients only get the cursor. Each process indexes the
+    # segments itself (line offsets, a non-decreasing timestamp column for
+    # bisect, seq lists per team / territory / kind) and picks up lines other
+    # workers appended by reading on from the last offset it has seen.
+    SEGMENT_EVENTS = 10000
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._dir: int | None = None
+        self.generation = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._offsets = array("q")
+        self._ts = array("q")
+        self._tail = 0
+        self._by: dict[str, dict[str, array]] = {"team": {}, "territory": {}, "kind": {}}
+
+    def nbytes(self) -> int:
+        lists = sum(a.buffer_info()[1] * a.itemsize for idx in self._by.values() for a in idx.values())
+        return lists + (len(self._offsets) + len(self._ts)) * 8
+
+    def _segment(self, n: int) -> str:
+        return os.path.join(self.path, f"{n:06d}.jsonl")
+
+    def _index(self, ev: dict, offset: int) -> None:
+        seq = len(self._offsets) + 1
+        self._offsets.append(offset)
+        ts = int(ev.get("tsMs") or 0)
+        self._ts.append(max(ts, self._ts[-1]) if self._ts else ts)
+        keys = [("kind", ev.get("kind")), ("territory", ev.get("territoryId"))]
+        keys += [("team", t) for t in dict.fromkeys(ev.get("teamIds") or [])]
+        for name, key in keys:
+            if key:
+                self._by[name].setdefault(str(key), array("l")).append(seq)
+
+    def _refresh(self) -> None:
+        # A directory swapped in by an import starts the index over.
+        try:
+            ident = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            ident = None
+        if ident != self._dir or self._truncated():
+            self._dir = ident
+            self.generation += 1
+            self._reset()
+        while True:
+            n, lines = divmod(len(self._offsets), self.SEGMENT_EVENTS)
+            try:
+                with open(self._segment(n), "rb") as f:
+                    f.seek(self._tail)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            pos = 0
+            while lines < self.SEGMENT_EVENTS:
+                end = data.find(b"\n", pos)
+                if end < 0:
+                    break
+                self._index(json.loads(data[pos:end]), self._tail + pos)
+                pos = end + 1
+                lines += 1
+            self._tail += pos
+            if lines < self.SEGMENT_EVENTS:
+                return
+            self._tail = 0
+
+    def _truncated(self) -> bool:
+        # Another worker cut the current segment short of what was indexed.
+        if not self._tail:
+            return False
+        try:
+            return os.path.getsize(self._segment(len(self._offsets) // self.SEGMENT_EVENTS)) < self._tail
+        except OSError:
+            return True
+
+    def _truncate(self, seq: int) -> None:
+        # Drops everything past seq, in the files and the index.
+        size = len(self._offsets)
+        keep = seq // self.SEGMENT_EVENTS
+        for n in range(keep + 1, (size - 1) // self.SEGMENT_EVENTS + 1):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._segment(n))
+        self._tail = self._offsets[seq]
+        with open(self._segment(keep), "ab") as f:
+            f.truncate(self._tail)
+        del self._offsets[seq:]
+        del self._ts[seq:]
+        for idx in self._by.values():
+            for seqs in idx.values():
+                while seqs and seqs[-1] > seq:
+                    seqs.pop()
+
+    def commit(self, events: list, base: int, seq: int) -> None:
+        # Makes the log hold seqs 1..seq as just saved in the state, base being
+        # the eventSeq saved before: lines past base were never committed and
+        # go, lines missing up to seq (a crash after an earlier save) are
+        # filled in from the state's eventLog.
+        with self._lock:
+            self._refresh()
+            if len(self._offsets) > base:
+                self._truncate(base)
+            size = len(self._offsets)
+        missing = sorted(
+            (ev for ev in events if isinstance(ev, dict) and size < int(ev.get("seq") or 0) <= seq),
+            key=lambda ev: int(ev["seq"]),
+        )
+        if [int(ev["seq"]) for ev in missing] != list(range(size + 1, seq + 1)):
+            print(f"Event log {self.path} is missing events {size + 1}..{seq}.")
+            missing = [ev for i, ev in enumerate(missing) if int(ev["seq"]) == size + 1 + i]
+        self.append(missing)
+
+    def append(self, events: list[dict]) -> int:
+        with self._lock:
+            self._refresh()
+            while events:
+                if self._dir is None:
+                    os.makedirs(self.path, exist_ok=True)
+                    self._dir = os.stat(self.path).st_ino
+                n, lines = divmod(len(self._offsets), self.SEGMENT_EVENTS)
+                chunk, events = events[: self.SEGMENT_EVENTS - lines], events[self.SEGMENT_EVENTS - lines :]
+                with open(self._segment(n), "ab") as f:
+                    # A line left half-written by a crashed writer is dropped.
+                    f.truncate(self._tail)
+                    offset = self._tail
+                    for ev in chunk:
+                        ev["seq"] = len(self._offsets) + 1
+                        line = (json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8")
+                        f.write(line)
+                        self._index(ev, offset)
+                        offset += len(line)
+                self._tail = 0 if lines + len(chunk) >= self.SEGMENT_EVENTS else offset
+            return len(self._offsets)
+
+    def size(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def seq_at(self, ts_ms: int) -> int:
+        # The last seq stamped at or before ts_ms.
+        with self._lock:
+            self._refresh()
+            return bisect.bisect_right(self._ts, ts_ms)
+
+    def last_of(self, kind: str, seq: int) -> int:
+        # The last seq of this kind at or before seq, 0 if there is none.
+        with self._lock:
+            seqs = self._by["kind"].get(kind, array("l"))
+            i = bisect.bisect_right(seqs, seq)
+            return seqs[i - 1] if i else 0
+
+    def scan(self, first: int, last: int):
+        # Records first..last in order, read a segment at a time.
+        first = max(first, 1)
+        with self._lock:
+            self._refresh()
+            last = min(last, len(self._offsets))
+            starts = [
+                (n, seq, self._offsets[seq - 1])
+                for n in range((first - 1) // self.SEGMENT_EVENTS, (last - 1) // self.SEGMENT_EVENTS + 1)
+                for seq in [max(first, n * self.SEGMENT_EVENTS + 1)]
+            ] if last >= first else []
+        for n, seq, offset in starts:
+            count = min(last, (n + 1) * self.SEGMENT_EVENTS) - seq + 1
+            with open(self._segment(n), "rb") as f:
+                f.seek(offset)
+                for _ in range(count):
+                    yield json.loads(f.readline())
+
+    @staticmethod
+    def _contains(seqs: array, seq: int) -> bool:
+        i = bisect.bisect_left(seqs, seq)
+        return i < len(seqs) and seqs[i] == seq
+
+    def _read(self, seqs: list[int]) -> list[dict]:
+        out = []
+        files: dict[int, object] = {}
+        try:
+            for seq in seqs:
+                n = (seq - 1) // self.SEGMENT_EVENTS
+                f = files.get(n)
+                if f is None:
+                    f = files[n] = open(self._segment(n), "rb")
+                f.seek(self._offsets[seq - 1])
+                out.append(json.loads(f.readline()))
+        finally:
+            for f in files.values():
+                f.close()
+        return out
+
+    def query(
+        self,
+        after: int | None = None,
+        before: int | None = None,
+        team_id: str | None = None,
+        territory_id: str | None = None,
+        kind: str | None = None,
+        since_ms: int | None = None,
+        until_ms: int | None = None,
+        limit: int = 100,
+        floor: int = 0,
+    ) -> dict:
+        # With `after`: oldest first from there on. Otherwise newest first,
+        # below `before` if given. Either way at most `limit` events past
+        # `floor` plus the seq to continue from (None once there is no more).
+        with self._lock:
+            self._refresh()
+            last = len(self._offsets)
+            lo = max(after or 0, floor, 0) + 1
+            hi = min(before - 1 if before is not None else last, last)
+            if since_ms is not None:
+                lo = max(lo, bisect.bisect_left(self._ts, since_ms) + 1)
+            if until_ms is not None:
+                hi = min(hi, bisect.bisect_left(self._ts, until_ms))
+            lists = [
+                self._by[name].get(str(key), array("l"))
+                for name, key in (("team", team_id), ("territory", territory_id), ("kind", kind))
+                if key
+            ]
+            lists.sort(key=len)
+            if lists:
+                base = lists[0]
+                start, stop = bisect.bisect_left(base, lo), bisect.bisect_right(base, hi)
+                candidates = (base[i] for i in (range(start, stop) if after is not None else range(stop - 1, start - 1, -1)))
+            else:
+                candidates = iter(range(lo, hi + 1) if after is not None else range(hi, lo - 1, -1))
+            seqs: list[int] = []
+            for seq in candidates:
+                if all(self._contains(other, seq) for other in lists[1:]):
+                    seqs.append(seq)
+                    if len(seqs) > limit:
+                        break
+            more = len(seqs) > limit
+            seqs = seqs[:limit]
+            events = self._read(seqs)
+        if since_ms is not None or until_ms is not None:
+            # The index keeps a running maximum; drop the odd event stamped
+            # before a clock step back.
+            events = [
+                ev for ev in events
+                if (since_ms is None or (ev.get("tsMs") or 0) >= since_ms) and (until_ms is None or (ev.get("tsMs") or 0) < until_ms)
+            ]
+        nxt = seqs[-1] if more else None
+        return {"events": events, "cursor": last, **({"nextAfter": nxt} if after is not None else {"nextBefore": nxt})}
+
+
+class OwnershipHistory:
+    # Territory owners over time, for replays. write_state() appends a record
+    # to <game>/ownership/ (an EventLog) whenever an owner changed: the
+    # changed owners, or every CHECKPOINT_EVERY records the full map instead.
+    # The owners at any moment are a bisect to the last checkpoint before it
+    # plus at most CHECKPOINT_EVERY records of replay.
+    CHECKPOINT_EVERY = 100
+
+    def __init__(self, path: str) -> None:
+        self.log = EventLog(path)
+        self._lock = threading.Lock()
+        self._known: tuple[tuple[int, int], dict] = ((0, 0), {})
+
+    @staticmethod
+    def owners_of(state: dict) -> dict[str, str]:
+        return {
+            str(z["id"]): str(z["ownerTeamId"])
+            for z in state.get("territories", []) or []
+            if isinstance(z, dict) and z.get("id") and z.get("ownerTeamId")
+        }
+
+    @staticmethod
+    def apply(owners: dict, rec: dict) -> dict:
+        if rec.get("kind") == "checkpoint":
+            owners.clear()
+        for territory_id, team_id in (rec.get("owners") or {}).items():
+            if team_id:
+                owners[territory_id] = team_id
+            else:
+                owners.pop(territory_id, None)
+        return owners
+
+    def at_seq(self, seq: int) -> dict:
+        owners: dict = {}
+        for rec in self.log.scan(self.log.last_of("checkpoint", seq) or 1, seq):
+            self.apply(owners, rec)
+        return owners
+
+    def at(self, ts_ms: int) -> tuple[int, dict]:
+        seq = self.log.seq_at(ts_ms)
+        return seq, self.at_seq(seq)
+
+    def record(self, state: dict) -> None:
+        # Runs under the state lock once the state is saved, like the event
+        # log commit, so a failed save never reaches the history.
+        owners = self.owners_of(state)
+        with self._lock:
+            last = self.log.size()
+            mark, known = self._known
+            if mark != (self.log.generation, last):
+                known = self.at_seq(last)
+            changes = {k: v for k, v in owners.items() if known.get(k) != v}
+            changes.update({k: None for k in known if k not in owners})
+            if changes:
+                checkpoint = last - self.log.last_of("checkpoint", last) >= self.CHECKPOINT_EVERY or not last
+                rec = {"tsMs": now_ms(), "kind": "checkpoint" if checkpoint else "change", "owners": owners if checkpoint else changes}
+                last = self.log.append([rec])
+            self._known = ((self.log.generation, last), owners)
+
+
+class JsonFileStore:
+    kind = "json"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self) -> dict:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, state: dict) -> None:
+        # Per-writer temp file: concurrent writers sharing one path interleave
+        # their output and leave a corrupt state.json behind.
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def size_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def close(self) -> None:
+        pass
+
+    def cached_bytes(self) -> int:
+        return 0
+
+    def history(self, **filters) -> dict:
+        events = (self.load().get("eventLog") or []) if self.exists() else []
+        return event_history([(i + 1, ev) for i, ev in enumerate(events) if isinstance(ev, dict)], **filters)
+
+
+class SqliteStore:
+    # One row per team / territory / request / lock / cooldown / stat / event,
+    # with the item itself kept as a JSON doc (so unknown fields survive) and
+    # the fields we filter on copied into indexed columns. save() diffs the
+    # rows against what this connection last read or wrote and only touches
+    # the ones that changed. Events are append-only and ordered by insertion:
+    # items trimmed from the in-state eventLog window lose their live flag
+    # instead of being deleted, so history stays queryable.
+    #
+    kind = "sqlite"
+    # table -> (state key, shape, key columns, extra columns as (column, field))
+    TABLES = {
+        "teams": ("teams", "list", ("id",), ()),
+        "territories": ("territories", "list", ("id",), (("owner_team_id", "ownerTeamId"),)),
+        "claim_requests": (
+            "claimRequests",
+            "list",
+            ("id",),
+            (("team_id", "teamId"), ("territory_id", "territoryId"), ("status", "status"), ("created_at_ms", "createdAtMs")),
+        ),
+        "claim_verify_requests": (
+            "claimVerifyRequests",
+            "list",
+            ("id",),
+            (("team_id", "teamId"), ("territory_id", "territoryId"), ("status", "status"), ("created_at_ms", "createdAtMs")),
+        ),
+        "events": ("eventLog", "log", ("id",), (("ts_ms", "tsMs"), ("kind", "kind"), ("territory_id", "territoryId"))),
+        "territory_locks": ("territoryLocks", "map", ("territory_id",), ()),
+        "attack_locks": ("attackLocks", "map2", ("team_id", "territory_id"), ()),
+        "team_cooldowns": ("teamCooldowns", "map", ("team_id",), (("until_ms", "untilMs"), ("reason", "reason"))),
+        "team_stats": ("teamStats", "map", ("team_id",), (("captures", "captures"), ("total_time_ms", "totalTimeMs"))),
+        "team_ever_owned": ("teamEverOwned", "map", ("team_id",), ()),
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, doc TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS teams (id TEXT PRIMARY KEY, ord INTEGER NOT NULL, doc TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS territories (
+            id TEXT PRIMARY KEY, ord INTEGER NOT NULL, owner_team_id TEXT, doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS territories_owner ON territories (owner_team_id);
+        CREATE TABLE IF NOT EXISTS claim_requests (
+            id TEXT PRIMARY KEY, ord INTEGER NOT NULL, team_id TEXT, territory_id TEXT, status TEXT,
+            created_at_ms INTEGER, doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS claim_requests_status ON claim_requests (status, created_at_ms);
+        CREATE INDEX IF NOT EXISTS claim_requests_team ON claim_requests (team_id, created_at_ms);
+        CREATE INDEX IF NOT EXISTS claim_requests_territory ON claim_requests (territory_id, created_at_ms);
+        CREATE TABLE IF NOT EXISTS claim_verify_requests (
+            id TEXT PRIMARY KEY, ord INTEGER NOT NULL, team_id TEXT, territory_id TEXT, status TEXT,
+            created_at_ms INTEGER, doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS claim_verify_requests_status ON claim_verify_requests (status, created_at_ms);
+        CREATE INDEX IF NOT EXISTS claim_verify_requests_team ON claim_verify_requests (team_id, created_at_ms);
+        CREATE INDEX IF NOT EXISTS claim_verify_requests_territory ON claim_verify_requests (territory_id, created_at_ms);
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, live INTEGER, ts_ms INTEGER,
+            kind TEXT, territory_id TEXT, doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_live ON events (seq) WHERE live IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS events_ts ON events (ts_ms);
+        CREATE INDEX IF NOT EXISTS events_kind ON events (kind, seq);
+        CREATE INDEX IF NOT EXISTS events_territory ON events (territory_id, seq);
+        CREATE TABLE IF NOT EXISTS territory_locks (territory_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS attack_locks (
+            team_id TEXT NOT NULL, territory_id TEXT NOT NULL, doc TEXT NOT NULL, PRIMARY KEY (team_id, territory_id)
+        );
+        CREATE TABLE IF NOT EXISTS team_cooldowns (
+            team_id TEXT PRIMARY KEY, until_ms INTEGER, reason TEXT, doc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS team_stats (
+            team_id TEXT PRIMARY KEY, captures INTEGER, total_time_ms INTEGER, doc TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS team_ever_owned (team_id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._db: sqlite3.Connection | None = None
+        self._data_version = None
+        # table -> {key tuple: (ord?, extra columns..., doc)} as last read or written
+        self._rows: dict[str, dict[tuple, tuple]] = {}
+        self._meta: dict[str, str] = {}
+
+    def conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self.SCHEMA)
+            self._db = db
+        return self._db
+
+    def exists(self) -> bool:
+        with self._lock:
+            return self.conn().execute("SELECT 1 FROM meta WHERE key = '__keys__'").fetchone() is not None
+
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    @classmethod
+    def column_value(cls, v):
+        if v is None or isinstance(v, (int, float, str)):
+            return v
+        return cls.encode(v)
+
+    def state_rows(self, state: dict) -> tuple[dict[str, dict[tuple, tuple]], dict[str, str]]:
+        rows: dict[str, dict[tuple, tuple]] = {}
+        covered = set()
+        for table, (key, shape, _, extras) in self.TABLES.items():
+            value = state.get(key)
+            out: dict[tuple, tuple] = {}
+            rows[table] = out
+            encode = self.encode
+            if shape in ("list", "log"):
+                if not isinstance(value, list):
+                    continue
+                for i, item in enumerate(value):
+                    item_id = item.get("id") if isinstance(item, dict) else None
+                    # Items without a usable id still round-trip, keyed by position.
+                    k = (str(item_id),) if item_id and (str(item_id),) not in out else (f"#{i}",)
+                    fields = item if isinstance(item, dict) else {}
+                    out[k] = (1 if shape == "log" else i, *(self.column_value(fields.get(f)) for _, f in extras), encode(item))
+            elif shape == "map":
+                if not isinstance(value, dict):
+                    continue
+                for k, item in value.items():
+                    fields = item if isinstance(item, dict) else {}
+                    out[(str(k),)] = (*(self.column_value(fields.get(f)) for _, f in extras), encode(item))
+            else:
+                if not isinstance(value, dict) or not all(isinstance(v, dict) and v for v in value.values()):
+                    continue
+                for k1, inner in value.items():
+                    for k2, item in inner.items():
+                        out[(str(k1), str(k2))] = (encode(item),)
+            covered.add(key)
+        meta = {k: self.encode(v) for k, v in state.items() if k not in covered}
+        meta["__keys__"] = self.encode(list(state.keys()))
+        return rows, meta
+
+    @staticmethod
+    def position_columns(shape: str) -> list[str]:
+        return ["ord"] if shape == "list" else ["live"] if shape == "log" else []
+
+    def read_rows(self) -> tuple[dict[str, dict[tuple, tuple]], dict[str, str]]:
+        db = self.conn()
+        rows: dict[str, dict[tuple, tuple]] = {}
+        for table, (_, shape, keys, extras) in self.TABLES.items():
+            cols = list(keys) + self.position_columns(shape) + [c for c, _ in extras] + ["doc"]
+            where = " WHERE live IS NOT NULL" if shape == "log" else ""
+            order = " ORDER BY ord" if shape == "list" else " ORDER BY seq" if shape == "log" else ""
+            n = len(keys)
+            rows[table] = {
+                tuple(r[:n]): tuple(r[n:]) for r in db.execute(f"SELECT {', '.join(cols)} FROM {table}{where}{order}")
+            }
+        meta = dict(db.execute("SELECT key, doc FROM meta"))
+        return rows, meta
+
+    def sync(self) -> None:
+        # Another connection (a migrator, another process) committed since
+        # our last look: the diff base is stale, re-read it.
+        v = self.conn().execute("PRAGMA data_version").fetchone()[0]
+        if v != self._data_version:
+            self._rows, self._meta = self.read_rows()
+            self._data_version = v
+
+    def load(self) -> dict:
+        with self._lock:
+            self.sync()
+            # The stored docs are JSON already: splice them into one document
+            # and parse it in a single call instead of one loads() per row.
+            tables = {key: (table, shape) for table, (key, shape, _, _) in self.TABLES.items()}
+            encode = self.encode
+            parts: list[str] = []
+            for key in json.loads(self._meta.get("__keys__") or "[]"):
+                if key in self._meta:
+                    value = self._meta[key]
+                elif key in tables:
+                    table, shape = tables[key]
+                    rows = self._rows[table]
+                    if shape in ("list", "log"):
+                        value = "[" + ",".join(r[-1] for r in rows.values()) + "]"
+                    elif shape == "map":
+                        value = "{" + ",".join(encode(k[0]) + ":" + r[-1] for k, r in rows.items()) + "}"
+                    else:
+                        nested: dict[str, list[str]] = {}
+                        for (k1, k2), r in rows.items():
+                            nested.setdefault(k1, []).append(encode(k2) + ":" + r[-1])
+                        value = "{" + ",".join(encode(k1) + ":{" + ",".join(v) + "}" for k1, v in nested.items()) + "}"
+                else:
+                    continue
+                parts.append(encode(key) + ":" + value)
+            return json.loads("{" + ",".join(parts) + "}")
+
+    def save(self, state: dict) -> None:
+        rows, meta = self.state_rows(state)
+        with self._lock:
+            db = self.conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self.sync()
+                for table, (_, shape, keys, extras) in self.TABLES.items():
+                    old = self._rows.get(table, {})
+                    new = rows[table]
+                    changed = [k + v for k, v in new.items() if old.get(k) != v]
+                    removed = [k for k in old if k not in new]
+                    if changed:
+                        cols = list(keys) + self.position_columns(shape) + [c for c, _ in extras] + ["doc"]
+                        updates = ", ".join(f"{c} = excluded.{c}" for c in cols[len(keys):])
+                        db.executemany(
+                            f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+                            changed,
+                        )
+                    if removed:
+                        where = " AND ".join(f"{c} = ?" for c in keys)
+                        if shape == "log":
+                            db.executemany(f"UPDATE {table} SET live = NULL WHERE {where}", removed)
+                        else:
+                            db.executemany(f"DELETE FROM {table} WHERE {where}", removed)
+                changed_meta = [(k, v) for k, v in meta.items() if self._meta.get(k) != v]
+                if changed_meta:
+                    db.executemany("INSERT INTO meta (key, doc) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET doc = excluded.doc", changed_meta)
+                stale_meta = [(k,) for k in self._meta if k not in meta]
+                if stale_meta:
+                    db.executemany("DELETE FROM meta WHERE key = ?", stale_meta)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                self._data_version = None
+                raise
+            self._rows, self._meta = rows, meta
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+            self._data_version = None
+            self._rows, self._meta = {}, {}
+
+    def cached_bytes(self) -> int:
+        with self._lock:
+            return sum(len(r[-1]) for rows in self._rows.values() for r in rows.values())
+
+    def size_bytes(self) -> int:
+        total = 0
+        for suffix in ("", "-wal"):
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+    def history(
+        self,
+        team_id: str | None = None,
+        territory_id: str | None = None,
+        kind: str | None = None,
+        since_ms: int | None = None,
+        until_ms: int | None = None,
+        before: int | None = None,
+        limit: int = 100,
+    ) -> dict:
+        sql = "SELECT seq, doc FROM events WHERE 1 = 1"
+        args: list = []
+        if before is not None:
+            sql += " AND seq < ?"
+            args.append(before)
+        if kind:
+            sql += " AND kind = ?"
+            args.append(kind)
+        if territory_id:
+            sql += " AND territory_id = ?"
+            args.append(territory_id)
+        if since_ms is not None:
+            sql += " AND ts_ms >= ?"
+            args.append(since_ms)
+        if until_ms is not None:
+            sql += " AND ts_ms < ?"
+            args.append(until_ms)
+        if team_id:
+            sql += " AND EXISTS (SELECT 1 FROM json_each(events.doc, '$.teamIds') WHERE json_each.value = ?)"
+            args.append(team_id)
+        sql += " ORDER BY seq DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self.conn().execute(sql, args).fetchall()
+        return {
+            "events": [json.loads(doc) for _, doc in rows],
+            "nextBefore": rows[-1][0] if len(rows) >= limit else None,
+        }
+
+
+def make_store(kind: str | None = None, data_dir: str = DATA_DIR):
+    kind = (kind or STORAGE).strip().lower()
+    if kind == "sqlite":
+        return SqliteStore(os.path.join(data_dir, os.path.basename(SQLITE_PATH)))
+    return JsonFileStore(os.path.join(data_dir, os.path.basename(STATE_PATH)))
+
+
+def migrate_state(src, dst) -> dict:
+    state = src.load()
+    dst.save(state)
+    return {
+        "teams": len(state.get("teams") or []),
+        "territories": len(state.get("territories") or []),
+        "claimRequests": len(state.get("claimRequests") or []),
+        "claimVerifyRequests": len(state.get("claimVerifyRequests") or []),
+        "events": len(state.get("eventLog") or []),
+    }
+
+
+def migrate_main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(prog="server.py migrate", description="Copy the game state between storage backends.")
+    ap.add_argument("--to", choices=("sqlite", "json"), default="sqlite")
+    ap.add_argument("--force", action="store_true", help="overwrite a target that already holds a state")
+    ap.add_argument("--game", default="", help="game id under data/games/ (default: the main game in data/)")
+    args = ap.parse_args(argv)
+    data_dir = os.path.join(GAMES_DIR, args.game) if args.game else DATA_DIR
+    src = make_store("json" if args.to == "sqlite" else "sqlite", data_dir)
+    dst = make_store(args.to, data_dir)
+    if not src.exists():
+        print(f"Zdroj {src.path} neobsahuje žádný stav.")
+        return 1
+    if dst.exists() and not args.force:
+        print(f"Cíl {dst.path} už stav obsahuje (přepsat: --force).")
+        return 1
+    counts = migrate_state(src, dst)
+    print(f"Stav převeden z {src.path} do {dst.path}: {counts}")
+    return 0
+
+
+@metrics.timed("read_state")
 def read_state() -> dict:
     ensure_data_dir()
-    if not os.path.exists(STATE_PATH):
+    state_path = current_game().state_path
+    if not store.exists() and store.kind == "sqlite" and os.path.exists(state_path):
+        # First start on SQLite with an existing game: import it once.
+        counts = migrate_state(JsonFileStore(state_path), store)
+        print(f"Stav převeden z {state_path} do {store.path}: {counts}")
+    if not store.exists():
         # Create empty default state if missing
         default_state = {
             "version": 1,
@@ -97,11 +1175,9 @@ def read_state() -> dict:
             "eventLog": [],
             "teamStats": {}
         }
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(default_state, f, ensure_ascii=False, indent=2)
-    
-    with open(STATE_PATH, "r", encoding="utf-8") as f:
-        state = json.load(f)
+        store.save(default_state)
+
+    state = store.load()
         
     # AUTO-FIX: If teams are missing or empty (broken state), restore them
     if not state.get("teams"):
@@ -143,20 +1219,66 @@ def read_state() -> dict:
     return state
 
 
-def write_state(state: dict) -> None:
-    ensure_data_dir()
+@metrics.timed("write_state")
+def persisted_state(state: dict) -> dict:
     persist = state
     config = (state.get("config", {}) or {}) if isinstance(state, dict) else {}
-    if config.get("territoriesGeojson"):
-        persist = copy.deepcopy(state)
-        for z in persist.get("territories", []) or []:
-            if isinstance(z, dict):
-                z.pop("polygon", None)
-                z.pop("neighbors", None)
-    tmp = STATE_PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(persist, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, STATE_PATH)
+    territories = state.get("territories", []) or []
+    if config.get("territoriesGeojson") and any(
+        isinstance(z, dict) and ("polygon" in z or "neighbors" in z) for z in territories
+    ):
+        # Shallow copies are enough: only the geometry keys are dropped.
+        persist = dict(state)
+        persist["territories"] = [
+            {k: v for k, v in z.items() if k not in ("polygon", "neighbors")} if isinstance(z, dict) else z
+            for z in territories
+        ]
+    return persist
+
+
+def write_state(state: dict) -> None:
+    ensure_data_dir()
+    # Seqs are given first so they are saved with the state; the event log
+    # only gets them once the save went through.
+    events = state.get("eventLog") if isinstance(state.get("eventLog"), list) else []
+    new = [ev for ev in events if isinstance(ev, dict) and "seq" not in ev]
+    committed = state.get("eventSeq")
+    base = int(committed) if committed is not None else event_log.size()
+    for i, ev in enumerate(new):
+        ev["seq"] = base + i + 1
+    state["eventSeq"] = base + len(new)
+    try:
+        store.save(persisted_state(state))
+    except BaseException:
+        for ev in new:
+            ev.pop("seq", None)
+        if committed is None:
+            state.pop("eventSeq", None)
+        else:
+            state["eventSeq"] = committed
+        raise
+    event_log.commit(events, base, state["eventSeq"])
+    ownership.record(state)
+    bus.publish("state", game=current_game().id)
+    notify_state_observers(state)
+
+
+# Called with the state after every write in this process and, with several
+# workers, after another worker's write has been read back.
+state_observers: list = []
+
+
+def observe_state(fn):
+    state_observers.append(fn)
+    return fn
+
+
+def notify_state_observers(state: dict) -> None:
+    for fn in state_observers:
+        try:
+            fn(state)
+        except Exception as e:
+            print(f"State observer failed: {e}")
 
 
 def add_event(state: dict, kind: str, territory_id: str | None = None, team_ids: list[str] | None = None, **fields) -> None:
@@ -176,17 +1298,560 @@ def add_event(state: dict, kind: str, territory_id: str | None = None, team_ids:
         state["eventLog"] = state["eventLog"][-250:]
 
 
-def apply_geojson_territories(state: dict) -> None:
-    if not isinstance(state, dict):
-        return
-    config = state.get("config", {}) or {}
-    filename = config.get("territoriesGeojson")
+class TerritoryGeometry:
+    # Static map geometry in flat buffers: ring points of territory i live in
+    # coords[2 * ring_offsets[i]:2 * ring_offsets[i + 1]] as [a, b] pairs in
+    # client order ([lat, lng] in geo mode), neighbor ordinals likewise.
+    # Simplified levels use the same layout; level 0 is the source geometry.
+    __slots__ = (
+        "key",
+        "ids",
+        "ordinal",
+        "coords",
+        "ring_offsets",
+        "neighbor_ordinals",
+        "neighbor_offsets",
+        "encoded",
+        "tolerances",
+        "level_coords",
+        "level_offsets",
+        "label_points",
+        "index",
+    )
+
+    def __init__(
+        self,
+        key: tuple,
+        rings: dict[str, list[tuple[float, float]]],
+        neighbors: dict[str, list[str]],
+        levels: list[tuple[float, dict[str, list[tuple[float, float]]]]] | None = None,
+        label_points: dict[str, tuple[float, float]] | None = None,
+    ) -> None:
+        self.key = key
+        self.ids: list[str] = list(rings.keys())
+        self.ordinal: dict[str, int] = {tid: i for i, tid in enumerate(self.ids)}
+        self.neighbor_ordinals = array("I")
+        self.neighbor_offsets = array("I", [0])
+        self.encoded: dict[tuple[int, int], list[str]] = {}
+        self.tolerances: list[float] = [0.0]
+        self.level_coords: list[array] = []
+        self.level_offsets: list[array] = []
+        self._add_level(rings)
+        self.coords = self.level_coords[0]
+        self.ring_offsets = self.level_offsets[0]
+        for tolerance, level_rings in levels or []:
+            self.tolerances.append(float(tolerance))
+            self._add_level(level_rings)
+        self.label_points = array("d")
+        self.index: tuple | None = None
+        for tid in self.ids:
+            for n in neighbors.get(tid, []):
+                self.neighbor_ordinals.append(self.ordinal[n])
+            self.neighbor_offsets.append(len(self.neighbor_ordinals))
+            a, b = (label_points or {}).get(tid) or pole_of_inaccessibility(rings[tid])
+            self.label_points.append(a)
+            self.label_points.append(b)
+
+    def _add_level(self, rings: dict[str, list[tuple[float, float]]]) -> None:
+        coords = array("d")
+        offsets = array("I", [0])
+        for tid in self.ids:
+            for a, b in rings[tid]:
+                coords.append(a)
+                coords.append(b)
+            offsets.append(len(coords) // 2)
+        self.level_coords.append(coords)
+        self.level_offsets.append(offsets)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def arrays(self) -> list[tuple[str, array]]:
+        return [
+            ("neighbor_ordinals", self.neighbor_ordinals),
+            ("neighbor_offsets", self.neighbor_offsets),
+            ("label_points", self.label_points),
+            *((f"level_coords.{i}", a) for i, a in enumerate(self.level_coords)),
+            *((f"level_offsets.{i}", a) for i, a in enumerate(self.level_offsets)),
+        ]
+
+    def save(self, path: str) -> None:
+        # One JSON header line, then the raw array buffers in header order.
+        header = {
+            "version": GEOMETRY_FILE_VERSION,
+            "byteorder": sys.byteorder,
+            "ids": self.ids,
+            "tolerances": self.tolerances,
+            "arrays": [[name, a.typecode, a.itemsize, len(a)] for name, a in self.arrays()],
+        }
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+            for _, a in self.arrays():
+                f.write(a.tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, key: tuple) -> "TerritoryGeometry | None":
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != GEOMETRY_FILE_VERSION or header.get("byteorder") != sys.byteorder:
+                return None
+            arrays: dict[str, array] = {}
+            for name, typecode, itemsize, n in header["arrays"]:
+                a = array(typecode)
+                if a.itemsize != itemsize:
+                    return None
+                a.frombytes(f.read(itemsize * n))
+                if len(a) != n:
+                    return None
+                arrays[name] = a
+        self = cls.__new__(cls)
+        self.key = key
+        self.ids = list(header["ids"])
+        self.ordinal = {tid: i for i, tid in enumerate(self.ids)}
+        self.tolerances = [float(t) for t in header["tolerances"]]
+        self.neighbor_ordinals = arrays["neighbor_ordinals"]
+        self.neighbor_offsets = arrays["neighbor_offsets"]
+        self.label_points = arrays["label_points"]
+        self.level_coords = [arrays[f"level_coords.{i}"] for i in range(len(self.tolerances))]
+        self.level_offsets = [arrays[f"level_offsets.{i}"] for i in range(len(self.tolerances))]
+        self.coords = self.level_coords[0]
+        self.ring_offsets = self.level_offsets[0]
+        self.encoded = {}
+        self.index = None
+        return self
+
+    def nbytes(self) -> int:
+        arrays = [*self.level_coords, *self.level_offsets, self.neighbor_ordinals, self.neighbor_offsets, self.label_points]
+        return sum(a.itemsize * len(a) for a in arrays) + sum(len(s) for enc in self.encoded.values() for s in enc)
+
+    def clamp_level(self, level: int) -> int:
+        return max(0, min(int(level), len(self.tolerances) - 1))
+
+    def ring(self, i: int, level: int = 0) -> list[tuple[float, float]]:
+        c = self.level_coords[level]
+        o = self.level_offsets[level]
+        return [(c[2 * k], c[2 * k + 1]) for k in range(o[i], o[i + 1])]
+
+    def polygon(self, i: int, level: int = 0) -> list[list[float]]:
+        c = self.level_coords[level]
+        o = self.level_offsets[level]
+        return [[c[2 * k], c[2 * k + 1]] for k in range(o[i], o[i + 1])]
+
+    def neighbors(self, i: int) -> list[str]:
+        return [self.ids[n] for n in self.neighbor_ordinals[self.neighbor_offsets[i]:self.neighbor_offsets[i + 1]]]
+
+    def label_point(self, i: int) -> list[float]:
+        return [self.label_points[2 * i], self.label_points[2 * i + 1]]
+
+    def spatial_index(self) -> tuple[float, array, dict[tuple[int, int], list[int]]]:
+        # Uniform grid of territory bounding boxes (level 0), built on first
+        # lookup. The cell is the mean bbox extent, so a point usually lands
+        # in one cell with a handful of candidate territories.
+        index = self.index
+        if index is not None:
+            return index
+        c = self.coords
+        o = self.ring_offsets
+        bboxes = array("d")
+        extent = 0.0
+        for i in range(len(self.ids)):
+            a = c[2 * o[i]:2 * o[i + 1]:2]
+            b = c[2 * o[i] + 1:2 * o[i + 1]:2]
+            box = (min(a), min(b), max(a), max(b)) if a else (0.0, 0.0, -1.0, -1.0)
+            bboxes.extend(box)
+            extent += max(0.0, box[2] - box[0], box[3] - box[1])
+        cell = extent / len(self.ids) if extent > 0 else 1.0
+        grid: dict[tuple[int, int], list[int]] = {}
+        for i in range(len(self.ids)):
+            a0, b0, a1, b1 = bboxes[4 * i:4 * i + 4]
+            if a1 < a0:
+                continue
+            for ga in range(math.floor(a0 / cell), math.floor(a1 / cell) + 1):
+                for gb in range(math.floor(b0 / cell), math.floor(b1 / cell) + 1):
+                    grid.setdefault((ga, gb), []).append(i)
+        index = self.index = (cell, bboxes, grid)
+        return index
+
+    def contains(self, i: int, a: float, b: float) -> bool:
+        c = self.coords
+        start = self.ring_offsets[i]
+        end = self.ring_offsets[i + 1]
+        inside = False
+        for k in range(start, end - 1):
+            a1, b1, a2, b2 = c[2 * k], c[2 * k + 1], c[2 * k + 2], c[2 * k + 3]
+            if (a1 > a) != (a2 > a) and b < (b2 - b1) * (a - a1) / (a2 - a1) + b1:
+                inside = not inside
+        return inside
+
+    def locate(self, a: float, b: float) -> int | None:
+        cell, bboxes, grid = self.spatial_index()
+        for i in grid.get((math.floor(a / cell), math.floor(b / cell)), ()):
+            if bboxes[4 * i] <= a <= bboxes[4 * i + 2] and bboxes[4 * i + 1] <= b <= bboxes[4 * i + 3] and self.contains(i, a, b):
+                return i
+        return None
+
+    def distance(self, i: int, a: float, b: float, b_scale: float = 1.0) -> float:
+        # Distance from the point to territory i in a-units (0 inside), with
+        # b scaled by b_scale first (cos(lat) for [lat, lng] pairs).
+        if self.contains(i, a, b):
+            return 0.0
+        c = self.coords
+        best = float("inf")
+        for k in range(self.ring_offsets[i], self.ring_offsets[i + 1] - 1):
+            a1, a2 = c[2 * k], c[2 * k + 2]
+            b1, b2 = c[2 * k + 1] * b_scale, c[2 * k + 3] * b_scale
+            da, db = a2 - a1, b2 - b1
+            length2 = da * da + db * db
+            t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((a - a1) * da + (b * b_scale - b1) * db) / length2))
+            best = min(best, math.hypot(a - (a1 + t * da), b * b_scale - (b1 + t * db)))
+        return best
+
+    def polyline(self, i: int, precision: int, level: int = 0) -> str:
+        cached = self.encoded.get((precision, level))
+        if cached is None:
+            cached = [encode_polyline(self.ring(k, level), precision) for k in range(len(self.ids))]
+            self.encoded[(precision, level)] = cached
+        return cached[i]
+
+    def level_for_zoom(self, zoom: float, is_geo: bool) -> int:
+        # Coarsest level whose tolerance stays under half a screen pixel.
+        units_per_px = (360.0 / (256.0 * 2 ** zoom)) if is_geo else (1.0 / 2 ** zoom)
+        best = 0
+        for level, tolerance in enumerate(self.tolerances):
+            if tolerance <= units_per_px * 0.5:
+                best = level
+        return best
+
+
+def douglas_peucker(points: list[tuple[float, float]], tolerance: float) -> list[int]:
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[n - 1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first]
+        bx, by = points[last]
+        dx = bx - ax
+        dy = by - ay
+        len2 = dx * dx + dy * dy
+        best_d2 = -1.0
+        best_k = -1
+        for k in range(first + 1, last):
+            px, py = points[k]
+            if len2 <= 1e-30:
+                ex = px - ax
+                ey = py - ay
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / len2))
+                ex = px - (ax + t * dx)
+                ey = py - (ay + t * dy)
+            d2 = ex * ex + ey * ey
+            if d2 > best_d2:
+                best_d2 = d2
+                best_k = k
+        if best_k >= 0 and best_d2 > tol2:
+            keep[best_k] = True
+            stack.append((first, best_k))
+            stack.append((best_k, last))
+    return [k for k in range(n) if keep[k]]
+
+
+def simplify_shared_rings(
+    rings: dict[str, list[tuple[float, float]]], tolerance: float, scale: float
+) -> dict[str, list[tuple[float, float]]]:
+    # Topology-preserving simplification. Rings are cut at junction vertices
+    # (where the set of territories sharing a vertex changes along any ring);
+    # each chain is simplified once in a canonical direction so both sides of
+    # a shared border keep exactly the same vertices and no gaps open up.
+    def vkey(p: tuple[float, float]) -> tuple[int, int]:
+        return (int(round(p[0] * scale)), int(round(p[1] * scale)))
+
+    open_rings: dict[str, list[tuple[float, float]]] = {}
+    owners: dict[tuple[int, int], set[str]] = {}
+    for tid, ring in rings.items():
+        pts = ring[:-1] if len(ring) > 1 and ring[0] == ring[-1] else list(ring)
+        open_rings[tid] = pts
+        for p in pts:
+            owners.setdefault(vkey(p), set()).add(tid)
+
+    fixed: set[tuple[int, int]] = set()
+    for pts in open_rings.values():
+        n = len(pts)
+        for k in range(n):
+            here = owners[vkey(pts[k])]
+            if len(here) >= 3 or here != owners[vkey(pts[k - 1])] or here != owners[vkey(pts[(k + 1) % n])]:
+                fixed.add(vkey(pts[k]))
+
+    chain_cache: dict[tuple, list[int]] = {}
+    out: dict[str, list[tuple[float, float]]] = {}
+    for tid, pts in open_rings.items():
+        n = len(pts)
+        if n < 4:
+            out[tid] = rings[tid]
+            continue
+        cuts = [k for k in range(n) if vkey(pts[k]) in fixed]
+        if len(cuts) < 2:
+            # Island or single junction: anchor on the vertex farthest from the first cut.
+            c0 = cuts[0] if cuts else 0
+            x0, y0 = pts[c0]
+            far = max(range(n), key=lambda k: (pts[k][0] - x0) ** 2 + (pts[k][1] - y0) ** 2)
+            cuts = sorted({c0, far})
+        simplified: list[tuple[float, float]] = []
+        for c, start in enumerate(cuts):
+            stop = cuts[(c + 1) % len(cuts)]
+            idx = list(range(start, stop + 1)) if stop > start else list(range(start, n)) + list(range(0, stop + 1))
+            chain = [pts[k] for k in idx]
+            keys = tuple(vkey(p) for p in chain)
+            rkeys = keys[::-1]
+            if rkeys < keys:
+                kept = chain_cache.get(rkeys)
+                if kept is None:
+                    kept = douglas_peucker(chain[::-1], tolerance)
+                    chain_cache[rkeys] = kept
+                last = len(chain) - 1
+                kept = [last - k for k in reversed(kept)]
+            else:
+                kept = chain_cache.get(keys)
+                if kept is None:
+                    kept = douglas_peucker(chain, tolerance)
+                    chain_cache[keys] = kept
+            simplified.extend(chain[k] for k in kept[:-1])
+        simplified.append(simplified[0])
+        out[tid] = simplified if len(simplified) >= 4 else rings[tid]
+    return out
+
+
+def pole_of_inaccessibility(
+    ring: list[tuple[float, float]], x_scale: float = 1.0, precision_ratio: float = 0.005
+) -> tuple[float, float]:
+    # Polylabel: best-first search over quad cells for the interior point
+    # farthest from the boundary. Works on (a, b) pairs as stored, with b
+    # multiplied by x_scale so distances are roughly isotropic.
+    pts = [(b * x_scale, a) for a, b in ring]
+    if len(pts) < 3:
+        return ring[0] if ring else (0.0, 0.0)
+    if pts[0] != pts[-1]:
+        pts.append(pts[0])
+    xs = [p[0] for p in pts]
+    ys = [p[1] for p in pts]
+    minx, maxx, miny, maxy = min(xs), max(xs), min(ys), max(ys)
+    width = maxx - minx
+    height = maxy - miny
+    cell = min(width, height)
+    if cell <= 0:
+        return ring[0]
+    precision = max(width, height) * precision_ratio
+
+    def signed_dist(x: float, y: float) -> float:
+        inside = False
+        best = float("inf")
+        for k in range(len(pts) - 1):
+            ax, ay = pts[k]
+            bx, by = pts[k + 1]
+            if (ay > y) != (by > y) and x < (bx - ax) * (y - ay) / (by - ay + 1e-30) + ax:
+                inside = not inside
+            dx = bx - ax
+            dy = by - ay
+            len2 = dx * dx + dy * dy
+            t = 0.0 if len2 <= 1e-30 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / len2))
+            ex = x - (ax + t * dx)
+            ey = y - (ay + t * dy)
+            d2 = ex * ex + ey * ey
+            if d2 < best:
+                best = d2
+        d = best ** 0.5
+        return d if inside else -d
+
+    def make_cell(x: float, y: float, h: float) -> tuple[float, float, float, float, float]:
+        d = signed_dist(x, y)
+        return (-(d + h * 1.4142135623730951), x, y, h, d)
+
+    heap: list[tuple[float, float, float, float, float]] = []
+    h = cell / 2
+    x = minx
+    while x < maxx:
+        y = miny
+        while y < maxy:
+            heapq.heappush(heap, make_cell(x + h, y + h, h))
+            y += cell
+        x += cell
+
+    # Seed with the area centroid, falling back to the bbox center.
+    area2 = cx = cy = 0.0
+    for k in range(len(pts) - 1):
+        ax, ay = pts[k]
+        bx, by = pts[k + 1]
+        cross = ax * by - bx * ay
+        area2 += cross
+        cx += (ax + bx) * cross
+        cy += (ay + by) * cross
+    best = make_cell(cx / (3 * area2), cy / (3 * area2), 0) if abs(area2) > 1e-30 else make_cell(minx + width / 2, miny + height / 2, 0)
+    bbox_center = make_cell(minx + width / 2, miny + height / 2, 0)
+    if bbox_center[4] > best[4]:
+        best = bbox_center
+
+    while heap:
+        c = heapq.heappop(heap)
+        if c[4] > best[4]:
+            best = c
+        if -c[0] - best[4] <= precision:
+            continue
+        h = c[3] / 2
+        for dx, dy in ((-h, -h), (h, -h), (-h, h), (h, h)):
+            heapq.heappush(heap, make_cell(c[1] + dx, c[2] + dy, h))
+
+    return (best[2], best[1] / x_scale)
+
+
+def geometry_tolerances(config: dict) -> list[float]:
+    is_geo = (config or {}).get("mapMode") == "geo"
+    default = [0.00001, 0.00003, 0.0001] if is_geo else [1.0, 3.0, 10.0]
+    raw = (config or {}).get("geometryLevels", default)
+    out: list[float] = []
+    for v in raw if isinstance(raw, list) else default:
+        try:
+            t = float(v)
+        except Exception:
+            continue
+        if t > 0:
+            out.append(t)
+    return sorted(set(out))
+
+
+def encode_polyline(points, precision: int) -> str:
+    # Google polyline algorithm: zigzag varints of coordinate deltas scaled
+    # to integers, 5 bits per printable character.
+    factor = 10 ** precision
+    out: list[str] = []
+    prev_a = 0
+    prev_b = 0
+    for p in points:
+        a = int(round(float(p[0]) * factor))
+        b = int(round(float(p[1]) * factor))
+        for delta in (a - prev_a, b - prev_b):
+            v = ~(delta << 1) if delta < 0 else (delta << 1)
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1F)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev_a = a
+        prev_b = b
+    return "".join(out)
+
+
+def geometry_precision(config: dict) -> int:
+    default = 6 if (config or {}).get("mapMode") == "geo" else 1
+    try:
+        p = int((config or {}).get("geometryPrecision", default))
+    except Exception:
+        p = default
+    return max(0, min(p, 9))
+
+
+GEOMETRY_FILE_VERSION = 1
+_geometry_lock = threading.Lock()
+_geometry_cache: dict[str, TerritoryGeometry] = {}
+
+
+def geojson_source_path(config: dict) -> str | None:
+    filename = (config or {}).get("territoriesGeojson")
     if not filename:
-        return
-    path = filename if os.path.isabs(str(filename)) else os.path.join(DATA_DIR, str(filename))
-    if not os.path.exists(path):
-        return
+        return None
+    return filename if os.path.isabs(str(filename)) else os.path.join(current_game().data_dir, str(filename))
+
+
+def geometry_cache_key(config: dict, path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    simple = config.get("simpleMap", {}) or {}
+    return (
+        st.st_mtime_ns,
+        st.st_size,
+        config.get("mapMode") == "geo",
+        float(simple.get("width", 1000)),
+        float(simple.get("height", 1000)),
+        str(config.get("territoriesGeojsonIdPrefix") or "z"),
+        tuple(geometry_tolerances(config)),
+    )
+
+
+def persisted_geometry_path(config: dict, path: str) -> str | None:
+    # Named by file content and the config that shapes the build, so a copied
+    # or re-deployed map (new mtime, same bytes) still hits.
+    try:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+    simple = config.get("simpleMap", {}) or {}
+    params = [
+        GEOMETRY_FILE_VERSION,
+        digest,
+        config.get("mapMode") == "geo",
+        float(simple.get("width", 1000)),
+        float(simple.get("height", 1000)),
+        str(config.get("territoriesGeojsonIdPrefix") or "z"),
+        geometry_tolerances(config),
+    ]
+    name = hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(GEOMETRY_CACHE_DIR, f"{name}.geom")
+
+
+def load_or_build_geometry(config: dict, path: str, key: tuple) -> TerritoryGeometry | None:
+    cache_path = persisted_geometry_path(config, path)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            geometry = TerritoryGeometry.load(cache_path, key)
+            if geometry is not None:
+                metrics.inc("geometry_cache_loads_total", result="hit")
+                return geometry
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Geometry cache {cache_path} unusable: {e}")
+        metrics.inc("geometry_cache_loads_total", result="stale")
+    geometry = build_territory_geometry(config, path, key)
+    if geometry is not None and cache_path:
+        try:
+            os.makedirs(GEOMETRY_CACHE_DIR, exist_ok=True)
+            geometry.save(cache_path)
+        except OSError as e:
+            print(f"Geometry cache write failed: {e}")
+    return geometry
 
+
+def territory_geometry(state: dict) -> TerritoryGeometry | None:
+    if not isinstance(state, dict):
+        return None
+    config = state.get("config", {}) or {}
+    path = geojson_source_path(config)
+    if not path:
+        return None
+    key = geometry_cache_key(config, path)
+    if key is None:
+        return None
+    geometry = _geometry_cache.get(path)
+    if geometry is not None and geometry.key == key:
+        return geometry
+    with _geometry_lock:
+        geometry = _geometry_cache.get(path)
+        if geometry is not None and geometry.key == key:
+            return geometry
+        geometry = load_or_build_geometry(config, path, key)
+        if geometry is None:
+            _geometry_cache.pop(path, None)
+        else:
+            _geometry_cache[path] = geometry
+        return geometry
+
+
+def build_territory_geometry(config: dict, path: str, key: tuple) -> TerritoryGeometry | None:
     is_geo = config.get("mapMode") == "geo"
     simple = config.get("simpleMap", {}) or {}
     width = float(simple.get("width", 1000))
@@ -287,7 +1952,7 @@ def apply_geojson_territories(state: dict) -> None:
             label_to_ring[text] = min(containing, key=get_ring_area)
 
     if not label_to_ring:
-        return
+        return None
 
     # Normalization logic
     if is_geo:
@@ -326,46 +1991,199 @@ def apply_geojson_territories(state: dict) -> None:
             out.append(out[0])
         return out
 
-    computed: dict[str, dict] = {}
+    rings: dict[str, list[tuple[float, float]]] = {}
     for label, ring in label_to_ring.items():
         territory_id = f"{id_prefix}{label}"
-        pts: list[list[float]] = []
+        pts: list[tuple[float, float]] = []
         for x, y in clean_ring(ring):
             sx, sy = normalize_xy(x, y)
             # GeoJSON x=Lng, y=Lat.
             # Client expects [Lat, Lng].
             if is_geo:
-                pts.append([sy, sx]) # [Lat, Lng]
+                pts.append((sy, sx)) # [Lat, Lng]
             else:
-                pts.append([round(sy, 1), round(sx, 1)])
-        computed[territory_id] = {"polygon": pts, "neighbors": []}
-
-
-    vert_sets: dict[str, set[tuple[int, int]]] = {}
-    for tid, payload in computed.items():
-        poly = payload.get("polygon") or []
-        # In Geo mode, coords are floats (lat/lng). 
-        # For neighbor detection, we need to be careful with floating point comparison.
-        # We'll use scaled integers for comparison (e.g. 5 decimal places).
-        scale = 100000 if is_geo else 1
-        vert_sets[tid] = set((int(round(p[1] * scale)), int(round(p[0] * scale))) for p in poly if isinstance(p, list) and len(p) >= 2)
-
-    ids = list(computed.keys())
-    for i, a in enumerate(ids):
-        for j in range(i + 1, len(ids)):
-            b = ids[j]
-            shared = len(vert_sets[a].intersection(vert_sets[b]))
-            if shared >= 2:
-                computed[a]["neighbors"].append(b)
-                computed[b]["neighbors"].append(a)
-
+                pts.append((round(sy, 1), round(sx, 1)))
+        rings[territory_id] = pts
+
+    # In Geo mode, coords are floats (lat/lng).
+    # For neighbor detection, we need to be careful with floating point comparison.
+    # We'll use scaled integers for comparison (e.g. 5 decimal places).
+    scale = 100000 if is_geo else 1
+    owners_by_vertex: dict[tuple[int, int], list[str]] = {}
+    for tid, pts in rings.items():
+        for v in set((int(round(b * scale)), int(round(a * scale))) for a, b in pts):
+            owners_by_vertex.setdefault(v, []).append(tid)
+
+    shared: dict[tuple[str, str], int] = {}
+    for owners in owners_by_vertex.values():
+        for i in range(len(owners)):
+            for j in range(i + 1, len(owners)):
+                pair = (owners[i], owners[j])
+                shared[pair] = shared.get(pair, 0) + 1
+
+    neighbors: dict[str, list[str]] = {tid: [] for tid in rings}
+    for (a, b), count in shared.items():
+        if count >= 2:
+            neighbors[a].append(b)
+            neighbors[b].append(a)
+    order = {tid: i for i, tid in enumerate(rings)}
+    for tid in neighbors:
+        neighbors[tid].sort(key=order.__getitem__)
+
+    levels = [(t, simplify_shared_rings(rings, t, scale)) for t in geometry_tolerances(config)]
+    label_points: dict[str, tuple[float, float]] = {}
+    for tid, pts in rings.items():
+        # Longitude degrees shrink with latitude; scale them for the label search.
+        x_scale = math.cos(math.radians(sum(a for a, _ in pts) / len(pts))) if is_geo and pts else 1.0
+        label_points[tid] = pole_of_inaccessibility(pts, x_scale)
+    return TerritoryGeometry(key, rings, neighbors, levels, label_points)
+
+
+@metrics.timed("apply_geojson_territories")
+def apply_geojson_territories(state: dict) -> TerritoryGeometry | None:
+    # Geometry is not copied into the state any more; it is cached per source
+    # file and only materialized into territory dicts at the API edge.
+    geometry = territory_geometry(state)
+    if geometry is None:
+        return None
     for z in state.get("territories", []) or []:
-        if not isinstance(z, dict):
-            continue
-        tid = z.get("id")
-        if tid in computed:
-            z["polygon"] = computed[tid]["polygon"]
-            z["neighbors"] = computed[tid]["neighbors"]
+        if isinstance(z, dict) and z.get("id") in geometry.ordinal:
+            z.pop("polygon", None)
+            z.pop("neighbors", None)
+    return geometry
+
+
+def territory_polygon(state: dict, territory: dict, geometry: TerritoryGeometry | None = None) -> list:
+    geometry = geometry or territory_geometry(state)
+    i = geometry.ordinal.get(territory.get("id")) if geometry else None
+    if i is not None:
+        return geometry.polygon(i)
+    return territory.get("polygon", []) or []
+
+
+def territory_neighbors(state: dict, territory: dict, geometry: TerritoryGeometry | None = None) -> list[str]:
+    geometry = geometry or territory_geometry(state)
+    i = geometry.ordinal.get(territory.get("id")) if geometry else None
+    if i is not None:
+        return geometry.neighbors(i)
+    return territory.get("neighbors", []) or []
+
+
+class TerritoryTable:
+    # Column view of the mutable territory fields the hot paths touch, indexed
+    # by territory ordinal. Team ids are interned to small ints (-1 = nobody).
+    __slots__ = ("ids", "ordinal", "names", "team_ids", "team_ordinal", "owner", "captured_at", "lock_until")
+
+    def __init__(self) -> None:
+        self.ids: list[str] = []
+        self.ordinal: dict[str, int] = {}
+        self.names: list[str | None] = []
+        self.team_ids: list[str] = []
+        self.team_ordinal: dict[str, int] = {}
+        self.owner = array("h")
+        self.captured_at = array("q")
+        self.lock_until = array("q")
+
+    @classmethod
+    def from_state(cls, state: dict) -> "TerritoryTable":
+        table = cls()
+        for t in state.get("teams", []) or []:
+            if isinstance(t, dict) and t.get("id") is not None:
+                table.intern_team(str(t["id"]))
+        locks = state.get("territoryLocks", {}) or {}
+        if not isinstance(locks, dict):
+            locks = {}
+        for z in state.get("territories", []) or []:
+            if not isinstance(z, dict) or "id" not in z:
+                continue
+            tid = z["id"]
+            table.ordinal[tid] = len(table.ids)
+            table.ids.append(tid)
+            table.names.append(z.get("name"))
+            owner = z.get("ownerTeamId")
+            table.owner.append(table.intern_team(str(owner)) if owner else -1)
+            try:
+                table.captured_at.append(int(z.get("capturedAtMs") or 0))
+            except Exception:
+                table.captured_at.append(0)
+            try:
+                table.lock_until.append(int(locks.get(tid) or 0))
+            except Exception:
+                table.lock_until.append(0)
+        return table
+
+    def intern_team(self, team_id: str) -> int:
+        k = self.team_ordinal.get(team_id)
+        if k is None:
+            k = len(self.team_ids)
+            self.team_ids.append(team_id)
+            self.team_ordinal[team_id] = k
+        return k
+
+    def owner_of(self, i: int) -> str | None:
+        k = self.owner[i]
+        return self.team_ids[k] if k >= 0 else None
+
+    def owned_by(self, team_id: str) -> list[int]:
+        k = self.team_ordinal.get(str(team_id))
+        if k is None:
+            return []
+        return [i for i, o in enumerate(self.owner) if o == k]
+
+    def snapshot(self) -> "TerritoryTable":
+        copy_ = TerritoryTable()
+        copy_.ids = self.ids
+        copy_.ordinal = self.ordinal
+        copy_.names = self.names
+        copy_.team_ids = list(self.team_ids)
+        copy_.team_ordinal = dict(self.team_ordinal)
+        copy_.owner = array("h", self.owner)
+        copy_.captured_at = array("q", self.captured_at)
+        copy_.lock_until = array("q", self.lock_until)
+        return copy_
+
+    def materialize(
+        self,
+        state: dict,
+        geometry: TerritoryGeometry | None = None,
+        compact: bool = False,
+        encoding: str | None = None,
+        level: int = 0,
+    ) -> list[dict]:
+        if not compact and geometry is None:
+            geometry = territory_geometry(state)
+        precision = geometry_precision(state.get("config", {}) or {})
+        inline = {}
+        if not compact:
+            inline = {z["id"]: z for z in state.get("territories", []) or [] if isinstance(z, dict) and "id" in z}
+        out: list[dict] = []
+        for i, tid in enumerate(self.ids):
+            captured = self.captured_at[i]
+            row = {
+                "id": tid,
+                "name": self.names[i] if self.names[i] is not None else tid,
+                "ownerTeamId": self.owner_of(i),
+                "capturedAtMs": captured or None,
+                "neighbors": [],
+                "polygon": [],
+            }
+            if not compact:
+                z = inline.get(tid, {})
+                row["neighbors"] = territory_neighbors(state, z, geometry) if z else []
+                g = geometry.ordinal.get(tid) if geometry else None
+                if g is not None:
+                    row["labelPoint"] = geometry.label_point(g)
+                if encoding == "polyline":
+                    if g is not None:
+                        row["polylineEnc"] = geometry.polyline(g, precision, level)
+                    else:
+                        row["polylineEnc"] = encode_polyline(territory_polygon(state, z, geometry) if z else [], precision)
+                elif g is not None:
+                    row["polygon"] = geometry.polygon(g, level)
+                else:
+                    row["polygon"] = territory_polygon(state, z, geometry) if z else []
+            out.append(row)
+        return out
 
 
 def ensure_team_stats(state: dict) -> None:
@@ -397,7 +2215,15 @@ def update_territory_ownership_time(state: dict, territory: dict) -> None:
     territory["capturedAtMs"] = now_ms()
 
 
-def sanitize_state_for_client(state: dict, session: dict | None = None, compact: bool = False) -> dict:
+@metrics.timed("sanitize_state_for_client")
+def sanitize_state_for_client(
+    state: dict,
+    session: dict | None = None,
+    compact: bool = False,
+    table: TerritoryTable | None = None,
+    geometry_encoding: str | None = None,
+    geometry_level: int = 0,
+) -> dict:
     role = (session or {}).get("role")
     team_id = (session or {}).get("teamId")
 
@@ -456,6 +2282,10 @@ def sanitize_state_for_client(state: dict, session: dict | None = None, compact:
                         "expiresAtMs": r.get("expiresAtMs"),
                         "lat": r.get("lat"),
                         "lng": r.get("lng"),
+                        "gpsCheck": r.get("gpsCheck"),
+                        "gpsDistanceM": r.get("gpsDistanceM"),
+                        "gpsTerritoryId": r.get("gpsTerritoryId"),
+                        "autoApproved": bool(r.get("autoApproved")),
                         "assignedTask": r.get("assignedTask"),
                     }
                 )
@@ -470,36 +2300,6 @@ def sanitize_state_for_client(state: dict, session: dict | None = None, compact:
             if until_ms is not None or reason is not None:
                 cooldown_out = {"untilMs": until_ms, "reason": reason}
 
-    event_log_out: list[dict] = []
-    raw_events = state.get("eventLog", []) or []
-    if isinstance(raw_events, list):
-        allow = {
-            "id",
-            "tsMs",
-            "kind",
-            "territoryId",
-            "teamId",
-            "fromTeamId",
-            "toTeamId",
-            "result",
-        }
-        for ev in raw_events[-200:]:
-            if not isinstance(ev, dict):
-                continue
-            if role == "admin":
-                pass
-            elif role == "team" and team_id:
-                team_ids = ev.get("teamIds") or []
-                if isinstance(team_ids, list):
-                    team_ids = [str(t) for t in team_ids]
-                else:
-                    team_ids = []
-                if str(team_id) not in team_ids:
-                    continue
-            else:
-                continue
-            event_log_out.append({k: ev.get(k) for k in allow if k in ev})
-
     territory_locks_out: dict[str, int] = {}
     raw_territory_locks = state.get("territoryLocks", {}) or {}
     if isinstance(raw_territory_locks, dict):
@@ -513,6 +2313,10 @@ def sanitize_state_for_client(state: dict, session: dict | None = None, compact:
     ensure_team_stats(state)
     team_stats_out = state.get("teamStats", {})
 
+    geometry = None if compact else territory_geometry(state)
+    if geometry is not None:
+        geometry_level = geometry.clamp_level(geometry_level)
+
     return {
         "version": state.get("version", 1),
         "config": state.get("config", {}),
@@ -520,24 +2324,33 @@ def sanitize_state_for_client(state: dict, session: dict | None = None, compact:
             {"id": t["id"], "name": t["name"], "color": t["color"]}
             for t in state.get("teams", [])
         ],
-        "territories": [
-            {
-                "id": z["id"],
-                "name": z.get("name", z["id"]),
-                "ownerTeamId": z.get("ownerTeamId"),
-                "capturedAtMs": z.get("capturedAtMs"),
-                "neighbors": z.get("neighbors", []) if not compact else [],
-                "polygon": z.get("polygon", []) if not compact else [],
-            }
-            for z in state.get("territories", [])
-        ],
+        "territories": (table or TerritoryTable.from_state(state)).materialize(
+            state, geometry=geometry, compact=compact, encoding=geometry_encoding, level=geometry_level
+        ),
         "attackLocks": state.get("attackLocks", {}) if role == "admin" else (state.get("attackLocks", {}) or {}).get(team_id, {}) if (role == "team" and team_id) else {},
         "territoryLocks": territory_locks_out,
         "claimVerifyRequests": claim_verify_requests_out,
         "claimRequests": claim_requests_out,
         "cooldown": cooldown_out,
-        "eventLog": event_log_out,
+        # History is paged from /api/events; clients fetch past this cursor.
+        "eventCursor": {"seq": int(state.get("eventSeq") or 0), "startSeq": int(state.get("eventStartSeq") or 0)},
         "teamStats": team_stats_out,
+        **({"leaderboard": leaderboard.snapshot(state)} if not compact else {}),
+        **(
+            {"reviewQueue": review_queue.page(state, holder=ReviewQueue.holder(session))}
+            if role == "admin" and not compact
+            else {}
+        ),
+        **(
+            {"geometryEncoding": {"format": "polyline", "precision": geometry_precision(state.get("config", {}) or {})}}
+            if geometry_encoding == "polyline" and not compact
+            else {}
+        ),
+        **(
+            {"geometryLevels": geometry.tolerances, "geometryLevel": geometry_level}
+            if geometry is not None and not compact
+            else {}
+        ),
     }
 
 
@@ -549,21 +2362,23 @@ def has_any_territory(state: dict, team_id: str) -> bool:
 
 
 def is_adjacent_to_owned(state: dict, team_id: str, territory_id: str) -> bool:
-    owned = [t["id"] for t in state.get("territories", []) if t.get("ownerTeamId") == team_id]
+    table = TerritoryTable.from_state(state)
+    owned = table.owned_by(team_id)
     if len(owned) == 0:
         return True
 
-    target = next((t for t in state.get("territories", []) if t["id"] == territory_id), None)
-    if not target:
+    target = table.ordinal.get(territory_id)
+    if target is None:
         return False
 
-    owned_set = set(owned)
-    for n in target.get("neighbors", []):
+    geometry = territory_geometry(state)
+    by_id = {z["id"]: z for z in state.get("territories", []) if isinstance(z, dict) and "id" in z}
+    owned_set = {table.ids[i] for i in owned}
+    for n in territory_neighbors(state, by_id[territory_id], geometry):
         if n in owned_set:
             return True
-    for o in owned:
-        ot = next((t for t in state.get("territories", []) if t["id"] == o), None)
-        if ot and territory_id in ot.get("neighbors", []):
+    for o in owned_set:
+        if territory_id in territory_neighbors(state, by_id[o], geometry):
             return True
     return False
 
@@ -678,30 +2493,121 @@ def get_claim_start_delay_ms(state: dict) -> int:
     return max(0, ms)
 
 
-def is_game_locked(state: dict) -> bool:
+def get_gps_buffer_m(state: dict) -> float:
     cfg = state.get("config", {})
     if not isinstance(cfg, dict):
-        return False
-    return bool(cfg.get("gameLocked", False))
+        return 25.0
+    try:
+        m = float(cfg.get("gpsBufferM", 25))
+    except Exception:
+        m = 25.0
+    return max(0.0, m) if math.isfinite(m) else 25.0
 
 
-def get_team_cooldown(state: dict, team_id: str) -> dict | None:
-    cooldowns = state.get("teamCooldowns", {}) or {}
-    if not isinstance(cooldowns, dict):
-        return None
-    cd = cooldowns.get(team_id)
-    if not isinstance(cd, dict):
-        return None
-    return cd
+def is_gps_auto_approve(state: dict) -> bool:
+    cfg = state.get("config", {})
+    if not isinstance(cfg, dict):
+        return True
+    return bool(cfg.get("gpsAutoApprove", True))
 
 
-def is_team_in_cooldown(state: dict, team_id: str) -> tuple[bool, int, str]:
-    cd = get_team_cooldown(state, team_id) or {}
+def parse_gps_position(lat, lng) -> tuple[float, float] | None:
+    if isinstance(lat, bool) or isinstance(lng, bool):
+        return None
     try:
-        until_ms = int(cd.get("untilMs") or 0)
+        lat = float(lat)
+        lng = float(lng)
     except Exception:
-        until_ms = 0
-    reason = str(cd.get("reason") or "")
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+METERS_PER_DEGREE = 111_320.0
+
+
+def check_gps_position(state: dict, territory_id: str, lat, lng) -> dict | None:
+    # Geofence for claim verification: where the phone is relative to the
+    # target territory. Only geo maps have lat/lng geometry to check against.
+    geometry = territory_geometry(state)
+    if geometry is None or not geometry.key[2]:
+        return None
+    i = geometry.ordinal.get(territory_id)
+    if i is None:
+        return None
+    pos = parse_gps_position(lat, lng)
+    if pos is None:
+        return {"gpsCheck": "missing", "gpsDistanceM": None, "gpsTerritoryId": None}
+    lat, lng = pos
+    distance_m = geometry.distance(i, lat, lng, math.cos(math.radians(lat))) * METERS_PER_DEGREE
+    located = geometry.locate(lat, lng)
+    if distance_m == 0:
+        result = "inside"
+    elif distance_m <= get_gps_buffer_m(state):
+        result = "buffer"
+    else:
+        result = "outside"
+    return {
+        "gpsCheck": result,
+        "gpsDistanceM": round(distance_m, 1),
+        "gpsTerritoryId": geometry.ids[located] if located is not None else None,
+    }
+
+
+def parse_position_samples(raw) -> list[list] | None:
+    # [{tsMs, lat, lng, accuracyM}] from the phone -> [tsMs, lat, lng, accuracyM]
+    # sorted by time. Bad samples are skipped; timestamps from the future
+    # (phone clock ahead) are clamped to now.
+    if not isinstance(raw, list) or len(raw) > 200:
+        return None
+    now = now_ms()
+    out: list[list] = []
+    for item in raw:
+        if not isinstance(item, dict):
+            continue
+        pos = parse_gps_position(item.get("lat"), item.get("lng"))
+        if pos is None:
+            continue
+        try:
+            ts = min(now, int(item.get("tsMs") or now))
+        except Exception:
+            ts = now
+        try:
+            accuracy = round(float(item.get("accuracyM")), 1)
+            if not math.isfinite(accuracy):
+                accuracy = None
+        except Exception:
+            accuracy = None
+        out.append([ts, round(pos[0], 6), round(pos[1], 6), accuracy])
+    out.sort(key=lambda p: p[0])
+    return out
+
+
+def is_game_locked(state: dict) -> bool:
+    cfg = state.get("config", {})
+    if not isinstance(cfg, dict):
+        return False
+    return bool(cfg.get("gameLocked", False))
+
+
+def get_team_cooldown(state: dict, team_id: str) -> dict | None:
+    cooldowns = state.get("teamCooldowns", {}) or {}
+    if not isinstance(cooldowns, dict):
+        return None
+    cd = cooldowns.get(team_id)
+    if not isinstance(cd, dict):
+        return None
+    return cd
+
+
+def is_team_in_cooldown(state: dict, team_id: str) -> tuple[bool, int, str]:
+    cd = get_team_cooldown(state, team_id) or {}
+    try:
+        until_ms = int(cd.get("untilMs") or 0)
+    except Exception:
+        until_ms = 0
+    reason = str(cd.get("reason") or "")
     active = now_ms() < until_ms
     return active, until_ms, reason
 
@@ -713,6 +2619,8 @@ def set_team_cooldown(state: dict, team_id: str, until_ms: int, reason: str) ->
 
 
 class Broadcaster:
+    # Stream clients (SSE and WebSocket) with a small queue each. Queued items
+    # are (event, json data) pairs; every transport frames them its own way.
     def __init__(self) -> None:
         self._lock = threading.Lock()
         self._clients: dict[str, dict] = {}
@@ -728,7 +2636,23 @@ class Broadcaster:
         with self._lock:
             self._clients.pop(cid, None)
 
+    def stats(self) -> dict:
+        streams: dict[str, int] = {}
+        depth_total = 0
+        depth_max = 0
+        with self._lock:
+            for payload in self._clients.values():
+                role = str((payload.get("session") or {}).get("role") or "anon")
+                streams[role] = streams.get(role, 0) + 1
+                q = payload.get("queue")
+                depth = q.qsize() if isinstance(q, Queue) else 0
+                depth_total += depth
+                depth_max = max(depth_max, depth)
+        return {"streams": streams, "queueDepthTotal": depth_total, "queueDepthMax": depth_max}
+
+    @metrics.timed("broadcast_state")
     def broadcast_state(self, state: dict) -> None:
+        table = TerritoryTable.from_state(state)
         with self._lock:
             for payload in self._clients.values():
                 q = payload.get("queue")
@@ -736,108 +2660,2183 @@ class Broadcaster:
                 if not isinstance(q, Queue):
                     continue
                 # Use compact=True to reduce bandwidth (omit polygons)
-                data = json.dumps(sanitize_state_for_client(state, session, compact=True), ensure_ascii=False)
-                message = f"event: state\ndata: {data}\n\n"
+                data = json.dumps(sanitize_state_for_client(state, session, compact=True, table=table), ensure_ascii=False)
+                self._offer(q, session, ("state", data))
+
+    def broadcast_event(self, event: str, payload: dict, role: str | None = None) -> None:
+        message = (event, json.dumps(payload, ensure_ascii=False))
+        with self._lock:
+            for client in self._clients.values():
+                q = client.get("queue")
+                session = client.get("session") or {}
+                if not isinstance(q, Queue) or (role is not None and session.get("role") != role):
+                    continue
+                self._offer(q, session, message)
+
+    @staticmethod
+    def _offer(q: Queue, session: dict, message: tuple[str, str]) -> None:
+        # A slow client loses its oldest queued message, never the newest.
+        try:
+            q.put_nowait(message)
+        except Full:
+            metrics.inc("sse_queue_drops_total", role=str(session.get("role") or "anon"))
+            try:
+                q.get_nowait()
+            except Exception:
+                pass
+            try:
+                q.put_nowait(message)
+            except Exception:
+                pass
+
+
+
+
+class StateLock:
+    # Serializes read-modify-write of the state: a thread lock within the
+    # process plus, with several workers, an flock on data/state.lock. The
+    # lock file is opened lazily so every forked worker gets its own open
+    # file description (flock is per description, not per process).
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    def __enter__(self) -> "StateLock":
+        t0 = time.perf_counter()
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and WORKERS > 1 and fcntl is not None:
+            try:
+                if self._fd is None:
+                    ensure_data_dir()
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._depth -= 1
+                self._lock.release()
+                raise
+        if self._depth == 1:
+            metrics.observe("state_lock_wait", (time.perf_counter() - t0) * 1000.0)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._depth == 1 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._depth -= 1
+        self._lock.release()
+
+
+
+
+class Bus:
+    # Worker side of the pub/sub between worker processes: newline-delimited
+    # JSON over a socketpair to the supervisor, which relays every message to
+    # all other workers. Without workers there is no peer and publish() is a
+    # no-op.
+    def __init__(self) -> None:
+        self._sock: socket.socket | None = None
+        self._send_lock = threading.Lock()
+        self._handlers: dict[str, list] = {}
+        self._state_changed = threading.Event()
+        self._changed_games: set[str] = set()
+
+    def attach(self, sock: socket.socket) -> None:
+        self._sock = sock
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.state_loop, daemon=True).start()
+
+    def subscribe(self, kind: str, fn) -> None:
+        self._handlers.setdefault(kind, []).append(fn)
+
+    def publish(self, kind: str, **payload) -> None:
+        if self._sock is None:
+            return
+        line = json.dumps({"type": kind, **payload}, ensure_ascii=False).encode("utf-8") + b"\n"
+        try:
+            with self._send_lock:
+                self._sock.sendall(line)
+        except OSError as e:
+            print(f"Bus publish failed: {e}")
+
+    def read_loop(self) -> None:
+        buf = b""
+        while True:
+            try:
+                chunk = self._sock.recv(65536)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                # Supervisor gone: nothing left to coordinate with.
+                os._exit(1)
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for raw in lines:
                 try:
-                    q.put_nowait(message)
-                except Full:
-                    try:
-                        q.get_nowait()
-                    except Exception:
-                        pass
+                    msg = json.loads(raw)
+                except ValueError:
+                    continue
+                metrics.inc("bus_messages_total", type=str(msg.get("type")))
+                if msg.get("type") == "state":
+                    with self._send_lock:
+                        self._changed_games.add(str(msg.get("game") or ""))
+                    self._state_changed.set()
+                for fn in self._handlers.get(str(msg.get("type")), ()):
                     try:
-                        q.put_nowait(message)
-                    except Exception:
-                        pass
+                        fn(msg)
+                    except Exception as e:
+                        print(f"Bus handler failed: {e}")
+
+    def state_loop(self) -> None:
+        # Another worker wrote the state: push it to this worker's streams.
+        # Bursts of writes collapse into one read + broadcast.
+        while True:
+            self._state_changed.wait()
+            self._state_changed.clear()
+            with self._send_lock:
+                changed, self._changed_games = self._changed_games, set()
+            for game_id in changed:
+                # Games this worker has not loaded have no streams here.
+                game = games.peek(game_id)
+                if game is None:
+                    continue
+                try:
+                    with game.bound():
+                        state = read_state()
+                        notify_state_observers(state)
+                        broadcaster.broadcast_state(state)
+                except Exception as e:
+                    print(f"Bus broadcast failed: {e}")
 
 
-broadcaster = Broadcaster()
+bus = Bus()
 
 
 class Sessions:
-    def __init__(self) -> None:
+    # Tokens carry their own HMAC-signed session, so every worker process
+    # (or every node sharing SESSION_SECRET) accepts a login made on another
+    # one. Verified tokens are cached locally.
+    def __init__(self, secret: bytes) -> None:
         self._lock = threading.Lock()
+        self._secret = secret
         self._sessions: dict[str, dict] = {}
 
-    def create_team_session(self, team_id: str) -> str:
-        token = secrets.token_urlsafe(24)
+    def sign(self, body: str) -> str:
+        digest = hmac.new(self._secret, body.encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:18]).decode("ascii")
+
+    def create(self, session: dict) -> str:
+        payload = {**session, "n": secrets.token_urlsafe(6)}
+        body = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+        token = f"{body}.{self.sign(body)}"
         with self._lock:
-            self._sessions[token] = {
-                "token": token,
-                "teamId": team_id,
-                "role": "team",
-                "expiresAtMs": now_ms() + 12 * 60 * 60 * 1000,
-            }
+            self._sessions[token] = {"token": token, **session}
         return token
 
+    def create_team_session(self, team_id: str) -> str:
+        return self.create({"teamId": team_id, "role": "team", "expiresAtMs": now_ms() + 12 * 60 * 60 * 1000})
+
     def create_admin_session(self) -> str:
-        token = secrets.token_urlsafe(24)
+        return self.create({"role": "admin", "expiresAtMs": now_ms() + 12 * 60 * 60 * 1000})
+
+    def count(self) -> int:
         with self._lock:
-            self._sessions[token] = {
-                "token": token,
-                "role": "admin",
-                "expiresAtMs": now_ms() + 12 * 60 * 60 * 1000,
-            }
-        return token
+            return len(self._sessions)
+
+    def verify(self, token: str) -> dict | None:
+        body, _, sig = token.rpartition(".")
+        if not body or not hmac.compare_digest(sig, self.sign(body)):
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+        except ValueError:
+            return None
+        if not isinstance(payload, dict):
+            return None
+        payload.pop("n", None)
+        return {"token": token, **payload}
 
     def get(self, token: str) -> dict | None:
         if not token:
             return None
         with self._lock:
             s = self._sessions.get(token)
+        if not s:
+            s = self.verify(token)
             if not s:
                 return None
-            if int(s.get("expiresAtMs", 0)) < now_ms():
+            with self._lock:
+                self._sessions[token] = s
+        if int(s.get("expiresAtMs", 0)) < now_ms():
+            with self._lock:
                 self._sessions.pop(token, None)
+            return None
+        return dict(s)
+
+
+
+
+GAME_ID_RE = re.compile(r"^/g/([A-Za-z0-9_-]{1,64})(/.*)?$")
+
+
+def keep_position_sample(last: list, sample: list) -> bool:
+    # Trail downsampling: a new point once the team has moved and enough time
+    # has passed, and a heartbeat point every few intervals while standing.
+    dt_s = (sample[0] - last[0]) / 1000.0
+    if dt_s >= POSITIONS_MIN_INTERVAL_S * 6:
+        return True
+    if dt_s < POSITIONS_MIN_INTERVAL_S:
+        return False
+    dy = sample[1] - last[1]
+    dx = (sample[2] - last[2]) * math.cos(math.radians(sample[1]))
+    return math.hypot(dx, dy) * METERS_PER_DEGREE >= POSITIONS_MIN_DISTANCE_M
+
+
+class PositionTracker:
+    # Live team positions for the admin map, kept apart from the game state:
+    # per team the latest fix plus a downsampled trail in a ring buffer,
+    # flushed to positions.json every POSITIONS_FLUSH_S. Samples are
+    # [tsMs, lat, lng, accuracyM]. Loaded from disk on first use.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._trails: dict[str, deque] | None = None
+        self._latest: dict[str, list] = {}
+        self._changed: set[str] = set()
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def _load(self) -> dict[str, deque]:
+        if self._trails is None:
+            self._trails = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                for team_id, trail in (raw.get("trails") or {}).items():
+                    self._trails[team_id] = deque((list(p) for p in trail), maxlen=POSITIONS_TRAIL_LEN)
+                for team_id, p in (raw.get("latest") or {}).items():
+                    self._latest[team_id] = list(p)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Positions load failed: {e}")
+        return self._trails
+
+    def ingest(self, team_id: str, samples: list[list]) -> int:
+        # samples sorted by time; anything not newer than the latest fix is
+        # a duplicate or arrived out of order and is dropped.
+        kept = 0
+        with self._lock:
+            trails = self._load()
+            trail = trails.get(team_id)
+            if trail is None:
+                trail = trails[team_id] = deque(maxlen=POSITIONS_TRAIL_LEN)
+            latest = self._latest.get(team_id)
+            for sample in samples:
+                if latest is not None and sample[0] <= latest[0]:
+                    continue
+                latest = sample
+                if not trail or keep_position_sample(trail[-1], sample):
+                    trail.append(sample)
+                    kept += 1
+            if latest is not None and latest is not self._latest.get(team_id):
+                self._latest[team_id] = latest
+                self._changed.add(team_id)
+                self._dirty = True
+        return kept
+
+    def take_changed(self) -> dict[str, list]:
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return {team_id: self._latest[team_id] for team_id in changed}
+
+    def snapshot(self, since_ms: int = 0, trail: bool = True) -> dict:
+        with self._lock:
+            trails = self._load()
+            out: dict[str, dict] = {}
+            for team_id, latest in self._latest.items():
+                item: dict = {"latest": latest}
+                if trail:
+                    item["trail"] = [p for p in trails.get(team_id, ()) if p[0] > since_ms]
+                out[team_id] = item
+            return out
+
+    def flush(self, force: bool = False) -> None:
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._flushed_at < POSITIONS_FLUSH_S):
+                return
+            data = {"latest": self._latest, "trails": {t: list(d) for t, d in (self._trails or {}).items()}}
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, self.path)
+        metrics.inc("positions_flushes_total")
+
+
+class Leaderboard:
+    # Team standings kept up to date from state writes instead of being
+    # recomputed by every client on every clock tick. Holding time grows
+    # linearly between writes: time(t) = base + owned * t, where base is
+    # totalTimeMs minus the capture times of the territories held now. The
+    # time ranking can therefore only change where two of those lines cross,
+    # which is known in advance (next_change_ms); tick() re-ranks then.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._order: list[str] = []
+        self._rows: dict[str, tuple[int, int, int]] = {}
+        self._ready = False
+        self._signature: tuple = ()
+        self._snapshot: dict = {"asOfMs": 0, "teams": []}
+        self.next_change_ms: int | None = None
+
+    def update(self, state: dict) -> None:
+        rows: dict[str, list[int]] = {}
+        stats = state.get("teamStats", {}) or {}
+        for t in state.get("teams", []) or []:
+            if not isinstance(t, dict) or t.get("id") is None:
+                continue
+            s = stats.get(t["id"]) if isinstance(stats, dict) else None
+            s = s if isinstance(s, dict) else {}
+            try:
+                rows[str(t["id"])] = [int(s.get("captures", 0) or 0), 0, int(s.get("totalTimeMs", 0) or 0)]
+            except Exception:
+                rows[str(t["id"])] = [0, 0, 0]
+        for z in state.get("territories", []) or []:
+            row = rows.get(str(z.get("ownerTeamId"))) if isinstance(z, dict) and z.get("ownerTeamId") else None
+            if row is None:
+                continue
+            try:
+                captured_at = int(z.get("capturedAtMs") or 0)
+            except Exception:
+                captured_at = 0
+            if captured_at > 0:
+                row[1] += 1
+                row[2] -= captured_at
+        with self._lock:
+            self._order = list(rows)
+            self._rows = {tid: (r[0], r[1], r[2]) for tid, r in rows.items()}
+            self._ready = True
+        self.tick(force=True)
+
+    def tick(self, force: bool = False) -> None:
+        # Re-rank at now and publish when anything shown besides the running
+        # time changed. Cheap: O(teams log teams), no state read.
+        now = now_ms()
+        with self._lock:
+            if not self._ready or (not force and (self.next_change_ms is None or now < self.next_change_ms)):
+                return
+            rows = self._rows
+            pos = {tid: i for i, tid in enumerate(self._order)}
+            by_captures = sorted(self._order, key=lambda tid: (-rows[tid][0], pos[tid]))
+            by_time = sorted(self._order, key=lambda tid: (-(rows[tid][2] + rows[tid][1] * now), pos[tid]))
+            rank_captures = {tid: i + 1 for i, tid in enumerate(by_captures)}
+            rank_time = {tid: i + 1 for i, tid in enumerate(by_time)}
+            final = sorted(
+                by_captures,
+                key=lambda tid: ((rank_captures[tid] + rank_time[tid]) / 2, -rows[tid][0]),
+            )
+            self.next_change_ms = None
+            for a, b in zip(by_time, by_time[1:]):
+                _, owned_a, base_a = rows[a]
+                _, owned_b, base_b = rows[b]
+                if owned_b > owned_a:
+                    at = (base_a - base_b) // (owned_b - owned_a) + 1
+                    if self.next_change_ms is None or at < self.next_change_ms:
+                        self.next_change_ms = max(at, now + 1)
+            teams = [
+                {
+                    "id": tid,
+                    "captures": rows[tid][0],
+                    "owned": rows[tid][1],
+                    "timeMs": rows[tid][2] + rows[tid][1] * now,
+                    "rankCaptures": rank_captures[tid],
+                    "rankTime": rank_time[tid],
+                    "avgRank": (rank_captures[tid] + rank_time[tid]) / 2,
+                }
+                for tid in final
+            ]
+            signature = tuple((t["id"], t["captures"], t["owned"], t["rankTime"]) for t in teams)
+            changed = signature != self._signature
+            self._signature = signature
+            self._snapshot = {"asOfMs": now, "teams": teams}
+            snapshot = self._snapshot
+        if changed:
+            metrics.inc("leaderboard_updates_total")
+            broadcaster.broadcast_event("leaderboard", snapshot)
+
+    def snapshot(self, state: dict) -> dict:
+        if not self._ready:
+            self.update(state)
+        with self._lock:
+            return self._snapshot
+
+
+class ReviewQueue:
+    # Pending admin work (claim answers, location checks, task assignments)
+    # ordered on the server. Every item ages at the same rate, so "oldest
+    # first, boosted by type and by contention" is the fixed key
+    # createdAtMs - bonus, kept in a heap: O(log n) to add an item, lazy
+    # deletion when it is resolved or its key changes (stale entries carry an
+    # old version and are skipped). Leased items leave the heap, so its top
+    # is always the next free item. Leases are in memory and relayed to the
+    # other workers over the bus.
+    BONUS_MS = {"assign": 3 * 60 * 1000, "verify": 60 * 1000, "claim": 0}
+    CONTESTED_BONUS_MS = 2 * 60 * 1000
+    LEASE_MS = 2 * 60 * 1000
+    PAGE_SIZE = 50
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._items: dict[str, dict] = {}
+        self._heap: list[tuple[int, str, int]] = []
+        self._version: dict[str, int] = {}
+        self._leases: dict[str, tuple[str, int]] = {}
+        self._held: dict[str, str] = {}
+        self._kinds: dict[str, str] = {}
+        self._by_territory: dict[str, set[str]] = {}
+        # The first page, as of self.seq: every admin state carries it.
+        self._first: tuple[int, list[dict]] | None = None
+        self.ready = False
+        self.seq = 0
+
+    @staticmethod
+    def holder(session: dict) -> str:
+        return hashlib.sha256(str(session.get("token") or "").encode("utf-8")).hexdigest()[:12]
+
+    @staticmethod
+    def _item(key: str, kind: str, r: dict) -> dict:
+        try:
+            created = int(r.get("createdAtMs") or 0)
+        except Exception:
+            created = 0
+        item = {
+            "key": key,
+            "kind": kind,
+            "id": str(r["id"]),
+            "territoryId": str(r.get("territoryId") or ""),
+            "teamId": str(r.get("teamId") or ""),
+            "createdAtMs": created,
+        }
+        if kind == "claim":
+            item["answer"] = str(r.get("answer") or "")
+        else:
+            for k in ("gpsCheck", "gpsDistanceM", "gpsTerritoryId"):
+                if r.get(k) is not None:
+                    item[k] = r[k]
+        return item
+
+    def _prioritize(self, item: dict, contested: int) -> dict:
+        return {
+            **item,
+            "contested": contested,
+            "priority": item["createdAtMs"]
+            - self.BONUS_MS[item["kind"]]
+            - (self.CONTESTED_BONUS_MS if contested > 1 else 0),
+        }
+
+    def update(self, state: dict) -> None:
+        # A request's fields are fixed when it is filed; only its status moves
+        # it in or out of the queue or from verify to assign. So a write only
+        # costs a scan of the two lists, and items are rebuilt just for the
+        # keys that came, went or changed kind and for their territories.
+        active: dict[str, tuple[str, dict]] = {}
+        for r in state.get("claimRequests", []) or []:
+            if isinstance(r, dict) and r.get("id") and r.get("status", "pending") == "pending":
+                active[f"cr:{r['id']}"] = ("claim", r)
+        for r in state.get("claimVerifyRequests", []) or []:
+            status = r.get("status", "pending") if isinstance(r, dict) else None
+            if status in ("pending", "approved") and r.get("id"):
+                active[f"cv:{r['id']}"] = ("verify" if status == "pending" else "assign", r)
+        with self._lock:
+            removed = [key for key in self._items if key not in active]
+            added = {key: self._item(key, kind, r) for key, (kind, r) in active.items() if self._kinds.get(key) != kind}
+            touched = set()
+            for key in removed:
+                item = self._items.pop(key)
+                del self._version[key]
+                del self._kinds[key]
+                self._set_lease(key, None, None)
+                touched.add(item["territoryId"])
+                self._by_territory[item["territoryId"]].discard(key)
+            for key, item in added.items():
+                old = self._items.get(key)
+                if old is not None:
+                    self._by_territory[old["territoryId"]].discard(key)
+                    touched.add(old["territoryId"])
+                self._items[key] = item
+                self._kinds[key] = item["kind"]
+                self._by_territory.setdefault(item["territoryId"], set()).add(key)
+                touched.add(item["territoryId"])
+            upserts = []
+            for territory_id in touched:
+                keys = self._by_territory.get(territory_id)
+                if not keys:
+                    self._by_territory.pop(territory_id, None)
+                    continue
+                contested = len({self._items[key]["teamId"] for key in keys})
+                for key in keys:
+                    item = self._prioritize(self._items[key], contested)
+                    if key in added or self._items[key] != item:
+                        self._items[key] = item
+                        self._push(key)
+                        upserts.append(key)
+            if len(self._heap) > 2 * len(self._items) + 64:
+                self._heap = [e for e in self._heap if self._version.get(e[1]) == e[2]]
+                heapq.heapify(self._heap)
+            self.ready = True
+            delta = self._delta(upserts, removed)
+        self._publish(delta)
+
+    def _push(self, key: str) -> None:
+        # A new version makes any older heap entry for the key stale; leased
+        # items stay out of the heap until the lease ends.
+        self._version[key] = self._version.get(key, 0) + 1
+        if key not in self._leases:
+            heapq.heappush(self._heap, (self._items[key]["priority"], key, self._version[key]))
+
+    def _set_lease(self, key: str, holder: str | None, until_ms: int | None) -> list[str]:
+        # One lease per holder: taking a new item gives the previous one back.
+        changed = []
+        current = self._leases.pop(key, None)
+        if current and self._held.get(current[0]) == key:
+            del self._held[current[0]]
+        if holder is not None and key in self._items:
+            previous = self._held.get(holder)
+            if previous and previous != key:
+                changed += self._set_lease(previous, None, None)
+            self._leases[key] = (holder, int(until_ms or 0))
+            self._held[holder] = key
+        if key in self._items and (current is not None or holder is not None):
+            self._push(key)
+            changed.append(key)
+        return changed
+
+    def _view(self, key: str) -> dict:
+        lease = self._leases.get(key)
+        return {**self._items[key], "leasedBy": lease[0] if lease else None, "leaseUntilMs": lease[1] if lease else None}
+
+    def _delta(self, upserts: list[str], removed: list[str]) -> dict | None:
+        if not upserts and not removed:
+            return None
+        self.seq += 1
+        return {
+            "seq": self.seq,
+            "total": len(self._items),
+            "upserts": [self._view(key) for key in dict.fromkeys(upserts) if key in self._items],
+            "removed": removed,
+        }
+
+    @staticmethod
+    def _publish(delta: dict | None) -> None:
+        if delta is not None:
+            broadcaster.broadcast_event("queue", delta, role="admin")
+
+    def page(self, state: dict, offset: int = 0, limit: int = PAGE_SIZE, holder: str | None = None) -> dict:
+        if not self.ready:
+            self.update(state)
+        with self._lock:
+            first = offset == 0 and limit == self.PAGE_SIZE
+            if first and self._first is not None and self._first[0] == self.seq:
+                items = self._first[1]
+            else:
+                live = heapq.nsmallest(offset + limit, (e for e in self._heap if self._version.get(e[1]) == e[2]))
+                live += [(self._items[key]["priority"], key, 0) for key in self._leases]
+                live.sort()
+                items = [self._view(key) for _, key, _ in live[offset:offset + limit]]
+                if first:
+                    self._first = (self.seq, items)
+            return {
+                "seq": self.seq,
+                "total": len(self._items),
+                "offset": offset,
+                "holder": holder,
+                "items": items,
+            }
+
+    def lease(self, key: str | None, holder: str) -> tuple[str, dict | None]:
+        # Lease the given item, or the best free one when key is None.
+        now = now_ms()
+        with self._lock:
+            if key is None:
+                while self._heap and self._version.get(self._heap[0][1]) != self._heap[0][2]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    return "empty", None
+                key = self._heap[0][1]
+            if key not in self._items:
+                return "missing", None
+            current = self._leases.get(key)
+            if current and current[0] != holder and current[1] > now:
+                return "leased", self._view(key)
+            until_ms = now + self.LEASE_MS
+            delta = self._delta(self._set_lease(key, holder, until_ms), [])
+            item = self._view(key)
+        self._publish(delta)
+        bus.publish("queue_lease", game=current_game().id, key=key, holder=holder, untilMs=until_ms)
+        return "ok", item
+
+    def release(self, key: str, holder: str) -> bool:
+        with self._lock:
+            current = self._leases.get(key)
+            if not current or current[0] != holder:
+                return False
+            delta = self._delta(self._set_lease(key, None, None), [])
+        self._publish(delta)
+        bus.publish("queue_lease", game=current_game().id, key=key, holder=holder, untilMs=None)
+        return True
+
+    def apply_lease(self, key: str, holder: str, until_ms: int | None) -> None:
+        # A lease taken or given back on another worker.
+        with self._lock:
+            current = self._leases.get(key)
+            if not until_ms and (not current or current[0] != holder):
+                return
+            delta = self._delta(self._set_lease(key, holder if until_ms else None, until_ms), [])
+        self._publish(delta)
+
+    def may_resolve(self, key: str, holder: str) -> bool:
+        with self._lock:
+            current = self._leases.get(key)
+        return not current or current[0] == holder or current[1] <= now_ms()
+
+    def expire(self) -> None:
+        now = now_ms()
+        with self._lock:
+            changed = []
+            for key, (_, until_ms) in list(self._leases.items()):
+                if until_ms <= now:
+                    changed += self._set_lease(key, None, None)
+            delta = self._delta(changed, [])
+        self._publish(delta)
+
+
+class Game:
+    # Everything that belongs to one game: its data directory (state, map,
+    # uploads), store, SSE clients, sessions and state lock. The main game
+    # lives in data/, others in data/games/<id>/ and are served under /g/<id>/.
+    def __init__(self, game_id: str, data_dir: str) -> None:
+        self.id = game_id
+        self.data_dir = data_dir
+        self.url_prefix = f"/g/{game_id}" if game_id else ""
+        self.uploads_dir = os.path.join(data_dir, "uploads")
+        self.state_path = os.path.join(data_dir, os.path.basename(STATE_PATH))
+        self.store = make_store(data_dir=data_dir)
+        self.broadcaster = Broadcaster()
+        # A token signed for one game is not valid in another.
+        self.sessions = Sessions(hmac.new(SESSION_SECRET, f"game:{game_id}".encode("utf-8"), hashlib.sha256).digest())
+        self.state_lock = StateLock(os.path.join(data_dir, os.path.basename(STATE_LOCK_PATH)))
+        self.positions = PositionTracker(os.path.join(data_dir, "positions.json"))
+        self.leaderboard = Leaderboard()
+        self.review_queue = ReviewQueue()
+        self.event_log = EventLog(os.path.join(data_dir, "events"))
+        self.ownership = OwnershipHistory(os.path.join(data_dir, "ownership"))
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    @contextlib.contextmanager
+    def bound(self):
+        token = _current_game.set(self)
+        try:
+            yield self
+        finally:
+            _current_game.reset(token)
+
+    def memory_bytes(self) -> int:
+        total = self.store.cached_bytes() + self.event_log.nbytes() + self.ownership.log.nbytes()
+        for path, geometry in list(_geometry_cache.items()):
+            if os.path.dirname(path) == self.data_dir:
+                total += geometry.nbytes()
+        return total
+
+    def unload(self) -> None:
+        if worker_slot == 0:
+            self.positions.flush(force=True)
+        self.store.close()
+        with _geometry_lock:
+            for path in [p for p in _geometry_cache if os.path.dirname(p) == self.data_dir]:
+                _geometry_cache.pop(path, None)
+
+
+class Games:
+    # Loaded games in LRU order. A game loads on its first request and is
+    # unloaded again once idle for GAMES_IDLE_S, or earlier (least recently
+    # used first) while more than GAMES_MAX_LOADED games or GAMES_MEMORY_MB of
+    # cached geometry/rows are held. Games with requests or streams in flight
+    # are never unloaded; the main game always stays.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loaded: OrderedDict[str, Game] = OrderedDict()
+        self.main = Game("", DATA_DIR)
+
+    def peek(self, game_id: str) -> Game | None:
+        if not game_id:
+            return self.main
+        with self._lock:
+            return self._loaded.get(game_id)
+
+    def acquire(self, game_id: str) -> Game | None:
+        if not game_id:
+            game = self.main
+            with self._lock:
+                game.active += 1
+            return game
+        data_dir = os.path.join(GAMES_DIR, game_id)
+        with self._lock:
+            game = self._loaded.get(game_id)
+            if game is None:
+                if not os.path.isdir(data_dir):
+                    return None
+                game = Game(game_id, data_dir)
+                self._loaded[game_id] = game
+                metrics.inc("games_loaded_total")
+            self._loaded.move_to_end(game_id)
+            game.active += 1
+        return game
+
+    def release(self, game: Game) -> None:
+        with self._lock:
+            game.active -= 1
+            game.last_used = time.monotonic()
+
+    def all(self) -> list[Game]:
+        with self._lock:
+            return [self.main, *self._loaded.values()]
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [g for g in self._loaded.values() if g.active == 0]
+        total = sum(g.memory_bytes() for g in self.all())
+        count = len(self._loaded)
+        for game in candidates:
+            idle = now - game.last_used >= GAMES_IDLE_S
+            if not idle and count <= GAMES_MAX_LOADED and total <= GAMES_MEMORY_MB * 1024 * 1024:
+                continue
+            size = game.memory_bytes()
+            with self._lock:
+                if game.active or self._loaded.get(game.id) is not game:
+                    continue
+                del self._loaded[game.id]
+            game.unload()
+            metrics.inc("games_unloaded_total", reason="idle" if idle else "cap")
+            count -= 1
+            total -= size
+
+    def stats(self) -> dict:
+        loaded = self.all()
+        return {"loaded": len(loaded), "memoryBytes": sum(g.memory_bytes() for g in loaded)}
+
+
+_current_game: contextvars.ContextVar[Game] = contextvars.ContextVar("game")
+
+
+def current_game() -> Game:
+    # Outside a request (background threads, scripts) it is the main game.
+    return _current_game.get(None) or games.main
+
+
+class GameLocal:
+    # Module-level stand-in for a per-game object (store, broadcaster,
+    # sessions, state_lock), so handlers keep using the familiar globals.
+    __slots__ = ("_attr",)
+
+    def __init__(self, attr: str) -> None:
+        self._attr = attr
+
+    def __getattr__(self, name: str):
+        return getattr(getattr(current_game(), self._attr), name)
+
+    def __enter__(self):
+        return getattr(current_game(), self._attr).__enter__()
+
+    def __exit__(self, *exc):
+        return getattr(current_game(), self._attr).__exit__(*exc)
+
+
+store = GameLocal("store")
+broadcaster = GameLocal("broadcaster")
+sessions = GameLocal("sessions")
+state_lock = GameLocal("state_lock")
+positions = GameLocal("positions")
+leaderboard = GameLocal("leaderboard")
+review_queue = GameLocal("review_queue")
+event_log = GameLocal("event_log")
+ownership = GameLocal("ownership")
+games = Games()
+
+
+@observe_state
+def update_leaderboard(state: dict) -> None:
+    leaderboard.update(state)
+
+
+@observe_state
+def update_review_queue(state: dict) -> None:
+    review_queue.update(state)
+
+
+# Admin decisions on an already loaded state. Each returns the HTTP status,
+# the response body and whether the state changed; the caller writes and
+# broadcasts once, for one decision or a whole batch.
+def resolve_claim_request(state: dict, body: dict, holder: str) -> tuple[int, dict, bool]:
+    request_id = str(body.get("claimRequestId") or "")
+    correct_raw = body.get("correct")
+    approve_raw = body.get("approve")
+    if correct_raw is None:
+        correct_raw = approve_raw
+
+    correct = False
+    if isinstance(correct_raw, bool):
+        correct = correct_raw
+    elif isinstance(correct_raw, (int, float)):
+        correct = bool(correct_raw)
+    else:
+        correct = str(correct_raw or "").strip().lower() in ("1", "true", "yes", "y", "ok")
+    if not request_id:
+        return HTTPStatus.BAD_REQUEST, {"error": "Chybí claimRequestId."}, False
+    if not review_queue.may_resolve(f"cr:{request_id}", holder):
+        return HTTPStatus.CONFLICT, {"error": "Žádost právě vyřizuje jiný admin."}, False
+
+    if is_game_locked(state):
+        return HTTPStatus.LOCKED, {"error": "Hra je ukončená."}, False
+    req = next(
+        (r for r in (state.get("claimRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
+        None,
+    )
+    if not req:
+        return HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."}, False
+    if req.get("status", "pending") != "pending":
+        return HTTPStatus.BAD_REQUEST, {"error": "Žádost už je vyřízená."}, False
+
+    territory_id = str(req.get("territoryId") or "")
+    team_id = str(req.get("teamId") or "")
+    territory = next((t for t in state.get("territories", []) if t.get("id") == territory_id), None)
+    if not territory:
+        req["status"] = "rejected"
+        req["rejectReason"] = "territoryMissing"
+        req["resolvedAtMs"] = now_ms()
+        return HTTPStatus.BAD_REQUEST, {"error": "Území už neexistuje."}, True
+
+    if correct:
+        if territory.get("ownerTeamId") is not None:
+            req["status"] = "rejected"
+            req["rejectReason"] = "territoryAlreadyOwned"
+            req["resolvedAtMs"] = now_ms()
+            return HTTPStatus.BAD_REQUEST, {"error": "Území už má vlastníka."}, True
+
+        # Stats Update
+        ensure_team_stats(state)
+        # Previous owner (should be None here, but for safety)
+        update_territory_ownership_time(state, territory)
+
+        territory["ownerTeamId"] = team_id
+
+        # Increment capture count
+        stats = state["teamStats"].get(team_id)
+        if stats:
+            stats["captures"] = int(stats.get("captures", 0)) + 1
+
+        req["status"] = "approved"
+        req["rejectReason"] = None
+        req["cooldownUntilMs"] = None
+
+        # Lock for 30 mins after capture
+        lock_until = now_ms() + 30 * 60 * 1000
+        set_territory_lock(state, territory_id, lock_until)
+
+        # RACE CONDITION: Cancel all other pending claims/verifications for this territory
+        # 1. Cancel pending claimRequests
+        for other_req in state.get("claimRequests", []) or []:
+            if (
+                isinstance(other_req, dict)
+                and other_req.get("territoryId") == territory_id
+                and other_req.get("status") == "pending"
+                and other_req.get("id") != req["id"]
+            ):
+                other_req["status"] = "rejected"
+                other_req["rejectReason"] = "territoryCapturedByOther"
+                other_req["resolvedAtMs"] = now_ms()
+
+        # 2. Cancel pending/active verifications
+        for other_ver in state.get("claimVerifyRequests", []) or []:
+            if (
+                isinstance(other_ver, dict)
+                and other_ver.get("territoryId") == territory_id
+                and other_ver.get("status") in ("pending", "approved", "task_assigned")
+                # We don't necessarily need to cancel the winner's verification, but it's done anyway
+            ):
+                other_ver["status"] = "rejected"
+                other_ver["expiresAtMs"] = None
+                other_ver["resolvedAtMs"] = now_ms()
+
+    else:
+        req["status"] = "rejected"
+        req["rejectReason"] = "wrongAnswer"
+        cd_until = now_ms() + 30 * 60 * 1000
+        set_lock(state, team_id, territory_id, cd_until)
+        req["cooldownUntilMs"] = cd_until
+    req["resolvedAtMs"] = now_ms()
+    add_event(
+        state,
+        "claim",
+        territory_id=territory_id,
+        team_ids=[team_id],
+        teamId=team_id,
+        result=req.get("status"),
+    )
+
+    return HTTPStatus.OK, {"ok": True, "status": req["status"]}, True
+
+
+def resolve_claim_verify_request(state: dict, body: dict, holder: str) -> tuple[int, dict, bool]:
+    request_id = str(body.get("claimVerifyRequestId") or "")
+    ok_raw = body.get("ok")
+    ok = True
+    if ok_raw is not None:
+        if isinstance(ok_raw, bool):
+            ok = ok_raw
+        elif isinstance(ok_raw, (int, float)):
+            ok = bool(ok_raw)
+        else:
+            ok = str(ok_raw or "").strip().lower() in ("1", "true", "yes", "y", "ok")
+    if not request_id:
+        return HTTPStatus.BAD_REQUEST, {"error": "Chybí claimVerifyRequestId."}, False
+    if not review_queue.may_resolve(f"cv:{request_id}", holder):
+        return HTTPStatus.CONFLICT, {"error": "Žádost právě vyřizuje jiný admin."}, False
+
+    if is_game_locked(state):
+        return HTTPStatus.LOCKED, {"error": "Hra je ukončená."}, False
+    req = next(
+        (r for r in (state.get("claimVerifyRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
+        None,
+    )
+    if not req:
+        return HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."}, False
+    if req.get("status", "pending") != "pending":
+        return HTTPStatus.BAD_REQUEST, {"error": "Žádost už je vyřízená."}, False
+
+    req["resolvedAtMs"] = now_ms()
+    if ok:
+        req["status"] = "approved"
+        req["expiresAtMs"] = now_ms() + 10 * 60 * 1000
+    else:
+        req["status"] = "rejected"
+        req["expiresAtMs"] = None
+
+    return HTTPStatus.OK, {"ok": True, "status": req["status"]}, True
+
+
+def assign_claim_task(state: dict, body: dict, holder: str) -> tuple[int, dict, bool]:
+    request_id = str(body.get("claimVerifyRequestId") or "")
+    task_text = str(body.get("task") or "").strip()
+
+    if not request_id:
+        return HTTPStatus.BAD_REQUEST, {"error": "Chybí claimVerifyRequestId."}, False
+    if not review_queue.may_resolve(f"cv:{request_id}", holder):
+        return HTTPStatus.CONFLICT, {"error": "Žádost právě vyřizuje jiný admin."}, False
+    if not task_text:
+        return HTTPStatus.BAD_REQUEST, {"error": "Chybí text úkolu."}, False
+
+    if is_game_locked(state):
+        return HTTPStatus.LOCKED, {"error": "Hra je ukončená."}, False
+    req = next(
+        (r for r in (state.get("claimVerifyRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
+        None,
+    )
+    if not req:
+        return HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."}, False
+
+    # Allow assigning task if it's approved OR pending (skip approval step if desired, but UI flows approved->task)
+    # Actually, standard flow is Pending -> Approved -> TaskAssigned
+    if req.get("status") not in ("approved", "pending"): 
+         # We allow pending too, in case admin wants to skip explicit "OK" and just assign task immediately
+         pass
+
+    if req.get("status") == "rejected":
+         return HTTPStatus.BAD_REQUEST, {"error": "Žádost byla zamítnuta."}, False
+
+    req["status"] = "task_assigned"
+    req["assignedTask"] = task_text
+    req["resolvedAtMs"] = now_ms()
+    req["expiresAtMs"] = now_ms() + 60 * 60 * 1000 # 1 hour to complete task
+
+    return HTTPStatus.OK, {"ok": True}, True
+
+
+
+ADMIN_DECISIONS = {
+    "/api/admin/claimRequest/resolve": resolve_claim_request,
+    "/api/admin/claimVerifyRequest/resolve": resolve_claim_verify_request,
+    "/api/admin/claimVerifyRequest/assignTask": assign_claim_task,
+}
+MAX_BATCH_DECISIONS = 200
+
+
+# Game export: NDJSON records, generated one at a time. A header, the state
+# with its long lists split into one "item" record per entry, the event and
+# ownership logs, the map file in base64 chunks, the upload manifest (with
+# ?uploads=1 also their contents) and an "end" record with the counts, so an
+# import can tell a cut-off stream from a complete one.
+EXPORT_FORMAT = "tbor-export"
+EXPORT_LIST_KEYS = frozenset({"territories", "claimRequests", "claimVerifyRequests", "eventLog"})
+EXPORT_CHUNK_BYTES = 48 * 1024
+IMPORT_MAX_LINE = 1024 * 1024
+# Map files and uploads only: nothing else in the game directory is writable.
+IMPORT_FILE_RE = re.compile(r"^(uploads/[A-Za-z0-9_][A-Za-z0-9_.-]*|[A-Za-z0-9_][A-Za-z0-9_.-]*\.geojson)$")
+
+
+def export_file(path: str, name: str):
+    # An empty file still gets one (empty) chunk.
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            chunk = f.read(EXPORT_CHUNK_BYTES)
+            if chunk or not offset:
+                yield {"type": "file", "name": name, "offset": offset, "data": base64.b64encode(chunk).decode("ascii")}
+            offset += len(chunk)
+            if len(chunk) < EXPORT_CHUNK_BYTES:
+                return
+
+
+def export_records(state: dict, uploads: bool = False):
+    # ValueError before the first record if the event log is behind the
+    # state; an export without those events would wipe them on import.
+    game = current_game()
+    event_seq = int(state.get("eventSeq") or 0)
+    if event_log.size() < event_seq:
+        raise ValueError("Historie událostí je neúplná.")
+    yield {"type": "header", "format": EXPORT_FORMAT, "version": 1, "game": game.id, "exportedAtMs": now_ms()}
+    counts: dict[str, int] = {}
+
+    def counted(rec: dict) -> dict:
+        counts[rec["type"]] = counts.get(rec["type"], 0) + 1
+        return rec
+
+    for key, value in persisted_state(state).items():
+        if key in EXPORT_LIST_KEYS and isinstance(value, list):
+            for item in value:
+                yield counted({"type": "item", "key": key, "value": item})
+        else:
+            yield counted({"type": "state", "key": key, "value": value})
+    # Only what this state has committed: later appends belong to later states.
+    for rec in event_log.scan(1, event_seq):
+        yield counted({"type": "event", "value": rec})
+    if counts.get("event", 0) != event_seq:
+        # Cut short before "end", so the file cannot be imported.
+        raise ValueError("Historie událostí je neúplná.")
+    for rec in ownership.log.scan(1, ownership.log.size()):
+        yield counted({"type": "ownership", "value": rec})
+    path = geojson_source_path(state.get("config", {}) or {})
+    if path and os.path.dirname(path) == game.data_dir and IMPORT_FILE_RE.match(os.path.basename(path)) and os.path.isfile(path):
+        for rec in export_file(path, os.path.basename(path)):
+            yield counted(rec)
+    names = sorted(os.listdir(game.uploads_dir)) if os.path.isdir(game.uploads_dir) else []
+    for name in names:
+        path = os.path.join(game.uploads_dir, name)
+        if not os.path.isfile(path) or not IMPORT_FILE_RE.match(f"uploads/{name}"):
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        yield counted({"type": "upload", "name": name, "size": os.path.getsize(path), "sha256": digest.hexdigest()})
+        if uploads:
+            for rec in export_file(path, f"uploads/{name}"):
+                yield counted(rec)
+    yield {"type": "end", "counts": counts}
+
+
+class GameImport:
+    # Takes an export record by record: the state is rebuilt in memory, the
+    # logs and files go to a scratch directory next to the game as they
+    # arrive. commit() swaps them in under the state lock; the game is left
+    # untouched by anything that fails before that.
+    BATCH = 1000
+
+    def __init__(self, game: Game) -> None:
+        self.game = game
+        self.tmp = os.path.join(game.data_dir, f".import-{secrets.token_hex(6)}")
+        os.makedirs(os.path.join(self.tmp, "files", "uploads"))
+        self.logs = {"event": EventLog(os.path.join(self.tmp, "events")), "ownership": EventLog(os.path.join(self.tmp, "ownership"))}
+        self.pending: dict[str, list] = {"event": [], "ownership": []}
+        self.state: dict = {}
+        self.files: dict[str, int] = {}
+        self.uploads: list[str] = []
+        self.counts: dict[str, int] = {}
+        self.header = False
+        self.end = False
+
+    def add(self, rec) -> None:
+        # ValueError (Czech, shown to the admin) for anything malformed.
+        kind = rec.get("type") if isinstance(rec, dict) else None
+        if not self.header:
+            if kind != "header" or rec.get("format") != EXPORT_FORMAT or rec.get("version") != 1:
+                raise ValueError("Soubor není export hry.")
+            self.header = True
+            return
+        if self.end:
+            raise ValueError("Data za koncem exportu.")
+        if kind == "end":
+            self.end = True
+            if rec.get("counts") != self.counts:
+                raise ValueError("Export je neúplný.")
+            return
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if kind == "state" and isinstance(rec.get("key"), str):
+            self.state[rec["key"]] = rec.get("value")
+        elif kind == "item" and rec.get("key") in EXPORT_LIST_KEYS:
+            self.state.setdefault(rec["key"], []).append(rec.get("value"))
+        elif kind in self.pending and isinstance(rec.get("value"), dict):
+            batch = self.pending[kind]
+            batch.append(rec["value"])
+            if len(batch) >= self.BATCH:
+                self.logs[kind].append(batch)
+                batch.clear()
+        elif kind == "file" and IMPORT_FILE_RE.match(str(rec.get("name") or "")):
+            name = rec["name"]
+            if rec.get("offset") != self.files.get(name, 0):
+                raise ValueError(f"Soubor {name} je poškozený.")
+            try:
+                data = base64.b64decode(str(rec.get("data") or ""), validate=True)
+            except ValueError:
+                raise ValueError(f"Soubor {name} je poškozený.")
+            with open(os.path.join(self.tmp, "files", name), "ab") as f:
+                f.write(data)
+            self.files[name] = self.files.get(name, 0) + len(data)
+        elif kind == "upload" and IMPORT_FILE_RE.match(f"uploads/{rec.get('name') or ''}"):
+            self.uploads.append(rec["name"])
+        else:
+            raise ValueError("Neznámý záznam v exportu.")
+
+    def commit(self) -> dict:
+        if not self.end:
+            raise ValueError("Export je neúplný.")
+        state = self.state
+        if not isinstance(state.get("config"), dict) or not isinstance(state.get("teams"), list) or not isinstance(state.get("territories"), list):
+            raise ValueError("V exportu chybí stav hry.")
+        for kind, batch in self.pending.items():
+            self.logs[kind].append(batch)
+            batch.clear()
+        if self.logs["event"].size() < int(state.get("eventSeq") or 0):
+            raise ValueError("V exportu chybí historie událostí.")
+        game = self.game
+        for name in self.files:
+            os.replace(os.path.join(self.tmp, "files", name), os.path.join(game.data_dir, name))
+        for name in ("events", "ownership"):
+            live, new = os.path.join(game.data_dir, name), os.path.join(self.tmp, name)
+            os.makedirs(new, exist_ok=True)
+            if os.path.isdir(live):
+                os.replace(live, os.path.join(self.tmp, f"{name}.old"))
+            os.replace(new, live)
+        write_state(state)
+        missing = [n for n in self.uploads if not os.path.isfile(os.path.join(game.uploads_dir, n))]
+        return {"counts": self.counts, "missingUploads": missing}
+
+    def discard(self) -> None:
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class RateLimiter:
+    # Token buckets per (route class, session token or client IP): a bucket
+    # holds up to `burst` tokens and refills at `rate` per second, so a check
+    # is O(1). Full buckets are dropped by sweep() from the broadcast loop.
+    # Each worker process limits on its own.
+    CLASSES = {
+        # class: (tokens per second, burst). Logins are keyed by IP, and a
+        # whole venue may sit behind one NAT at game start.
+        "login": (0.5, 100),
+        "state": (1.0, 20),
+        "info": (5.0, 30),
+        "action": (2.0, 20),
+        "positions": (1.0, 10),
+        "admin": (10.0, 100),
+    }
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, str], list[float]] = {}
+
+    @staticmethod
+    def route_class(method: str, path: str) -> str | None:
+        if not path.startswith("/api/"):
+            return None
+        if path in ("/api/login", "/api/admin/login"):
+            return "login"
+        if path.startswith("/api/admin/"):
+            return "admin"
+        if path == "/api/territory/info":
+            return "info"
+        if path == "/api/positions":
+            return "positions"
+        return "state" if method == "GET" else "action"
+
+    def take(self, route_class: str, key: str) -> float:
+        # 0 when the request may go ahead, else seconds until it could.
+        rate, burst = self.CLASSES[route_class]
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((route_class, key))
+            if bucket is None:
+                self._buckets[(route_class, key)] = [burst - 1.0, now]
+                return 0.0
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1.0:
+                bucket[0] = tokens - 1.0
+                return 0.0
+            bucket[0] = tokens
+        metrics.inc("rate_limited_total", route_class=route_class)
+        return (1.0 - tokens) / rate
+
+    def sweep(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key, (tokens, ts) in list(self._buckets.items()):
+                rate, burst = self.CLASSES[key[0]]
+                if tokens + (now - ts) * rate >= burst:
+                    del self._buckets[key]
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+rate_limiter = RateLimiter()
+
+
+class WebSocket:
+    # Minimal RFC 6455 server end on the handler's socket: text messages
+    # (fragments reassembled), ping/pong and close. The peer counts as gone
+    # after four ping intervals without any frame from it.
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.sock.settimeout(WS_PING_S * 2)
+        self._buf = bytearray()
+        self._send_lock = threading.Lock()
+        self.last_seen = time.monotonic()
+
+    def _read(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            try:
+                chunk = self.sock.recv(65536)
+            except TimeoutError:
+                if time.monotonic() - self.last_seen > WS_PING_S * 4:
+                    raise ConnectionError("WebSocket idle")
+                continue
+            if not chunk:
+                raise ConnectionError("WebSocket closed")
+            self._buf += chunk
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def receive(self) -> str | None:
+        # Next text message, or None once the peer closed the connection.
+        parts: list[bytes] = []
+        size = 0
+        while True:
+            b0, b1 = self._read(2)
+            opcode = b0 & 0x0F
+            length = b1 & 0x7F
+            if length == 126:
+                length = int.from_bytes(self._read(2), "big")
+            elif length == 127:
+                length = int.from_bytes(self._read(8), "big")
+            if not b1 & 0x80 or size + length > WS_MAX_MESSAGE:
+                # Client frames must be masked; oversized messages end the session.
+                self.close(1002 if not b1 & 0x80 else 1009)
                 return None
-            return dict(s)
+            mask = self._read(4)
+            payload = self._unmask(self._read(length), mask)
+            self.last_seen = time.monotonic()
+            if opcode == 0x8:
+                self.close()
+                return None
+            if opcode == 0x9:
+                self.send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            if opcode not in (0x0, 0x1):
+                self.close(1003)
+                return None
+            parts.append(payload)
+            size += length
+            if b0 & 0x80:
+                return b"".join(parts).decode("utf-8")
+
+    @staticmethod
+    def _unmask(data: bytes, mask: bytes) -> bytes:
+        # XOR with the repeated 4-byte key as one big integer operation.
+        key = (mask * (len(data) // 4 + 1))[:len(data)]
+        return (int.from_bytes(data, "little") ^ int.from_bytes(key, "little")).to_bytes(len(data), "little")
+
+    def send_frame(self, opcode: int, payload: bytes) -> None:
+        n = len(payload)
+        if n < 126:
+            header = bytes((0x80 | opcode, n))
+        elif n < 1 << 16:
+            header = bytes((0x80 | opcode, 126)) + n.to_bytes(2, "big")
+        else:
+            header = bytes((0x80 | opcode, 127)) + n.to_bytes(8, "big")
+        with self._send_lock:
+            self.sock.sendall(header + payload)
+
+    def send(self, text: str) -> None:
+        self.send_frame(0x1, text.encode("utf-8"))
+
+    def close(self, code: int = 1000) -> None:
+        try:
+            self.send_frame(0x8, code.to_bytes(2, "big"))
+        except OSError:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class WsCall:
+    # Stand-in for the HTTP handler when a WebSocket message runs a POST
+    # route: handle_post only needs the path, and json_response hands the
+    # reply back here instead of writing it.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.reply: tuple[int, dict] | None = None
+        self._unmatched = False
+
+
+def json_response(handler: SimpleHTTPRequestHandler, status: int, payload: dict, headers: dict | None = None) -> None:
+    if isinstance(handler, WsCall):
+        handler.reply = (int(status), payload)
+        return
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json; charset=utf-8")
+    handler.send_header("Content-Length", str(len(body)))
+    for k, v in (headers or {}).items():
+        handler.send_header(k, v)
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def requested_geometry_encoding(qs: dict) -> str | None:
+    v = str((qs.get("geometry") or [""])[0]).strip().lower()
+    return v if v == "polyline" else None
+
+
+def requested_geometry_level(state: dict, qs: dict) -> int:
+    geometry = territory_geometry(state)
+    if geometry is None:
+        return 0
+    try:
+        if qs.get("level"):
+            return geometry.clamp_level(int((qs.get("level") or ["0"])[0]))
+        if qs.get("zoom"):
+            is_geo = (state.get("config", {}) or {}).get("mapMode") == "geo"
+            zoom = max(0.0, min(float((qs.get("zoom") or ["0"])[0]), 30.0))
+            return geometry.level_for_zoom(zoom, is_geo)
+    except (ValueError, OverflowError):
+        pass
+    return 0
+
+
+@metrics.timed("read_json_body")
+def read_json_body(handler: SimpleHTTPRequestHandler) -> dict:
+    handler._body_read = True
+    try:
+        if handler.headers.get("Transfer-Encoding"):
+            raise ValueError("chunked")
+        length = int(handler.headers.get("Content-Length", "0"))
+    except ValueError:
+        # Without a usable length the body cannot be skipped either.
+        handler.close_connection = True
+        return {}
+    raw = handler.rfile.read(length) if length > 0 else b"{}"
+    try:
+        return json.loads(raw.decode("utf-8"))
+    except Exception:
+        return {}
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    # Connections are served by a fixed pool of HTTP_THREADS threads from a
+    # queue of at most HTTP_BACKLOG waiting connections; past that a new
+    # connection gets a bare 503 instead of yet another thread. A connection
+    # that becomes a stream (SSE, WebSocket) leaves the pool for the separate
+    # stream budget and a fresh pool thread takes its place, so streams never
+    # starve short requests. Limits are per worker process.
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.pending: Queue = Queue(maxsize=HTTP_BACKLOG)
+        self.busy = 0
+        self.streams = 0
+        self.session_streams: dict[str, int] = {}
+        self._pool_lock = threading.Lock()
+        self._pool_local = threading.local()
+        self._pool_started = False
+
+    def start_pool(self) -> None:
+        # Called in each worker process after the fork; threads do not survive it.
+        if self._pool_started:
+            return
+        self._pool_started = True
+        for _ in range(HTTP_THREADS):
+            threading.Thread(target=self._pool_thread, daemon=True).start()
+
+    def _pool_thread(self) -> None:
+        local = self._pool_local
+        local.detached = False
+        while not local.detached:
+            request, client_address, queued_at = self.pending.get()
+            metrics.observe("http_queue_wait", (time.perf_counter() - queued_at) * 1000.0)
+            with self._pool_lock:
+                self.busy += 1
+            try:
+                self.process_request_thread(request, client_address)
+            finally:
+                if not local.detached:
+                    with self._pool_lock:
+                        self.busy -= 1
+
+    def process_request(self, request, client_address) -> None:
+        self.start_pool()
+        try:
+            self.pending.put_nowait((request, client_address, time.perf_counter()))
+        except Full:
+            metrics.inc("http_shed_total", reason="backlog")
+            body = json.dumps({"error": "Server je přetížený, zkus to za chvíli.", "retryAfterS": 1}, ensure_ascii=False).encode("utf-8")
+            try:
+                request.settimeout(1.0)
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                    b"Content-Type: application/json; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                    + body
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def stats(self) -> dict:
+        return {"busy": self.busy, "pending": self.pending.qsize(), "streams": self.streams}
+
+    def saturated(self) -> bool:
+        return self.busy >= HTTP_THREADS or not self.pending.empty()
+
+    def open_stream(self, token: str) -> str | None:
+        # Returns the reason the stream was refused, or None once the calling
+        # thread has left the pool.
+        with self._pool_lock:
+            if self.streams >= STREAMS_MAX:
+                return "streams"
+            if self.session_streams.get(token, 0) >= STREAMS_PER_SESSION:
+                return "session_streams"
+            self.streams += 1
+            self.session_streams[token] = self.session_streams.get(token, 0) + 1
+            if getattr(self._pool_local, "detached", True) is False:
+                self._pool_local.detached = True
+                self.busy -= 1
+                threading.Thread(target=self._pool_thread, daemon=True).start()
+        return None
+
+    def close_stream(self, token: str) -> None:
+        with self._pool_lock:
+            self.streams -= 1
+            left = self.session_streams.get(token, 0) - 1
+            if left > 0:
+                self.session_streams[token] = left
+            else:
+                self.session_streams.pop(token, None)
+
+
+def peer_closed(sock: socket.socket) -> bool:
+    # An SSE client sends nothing after its request, so anything readable is
+    # the hang-up. Noticing it early frees the stream slot for the reconnect.
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.settimeout(timeout)
+
+
+def metrics_gauges(httpd: PooledHTTPServer) -> dict:
+    pool = httpd.stats()
+    b = broadcaster.stats()
+    g = games.stats()
+    state_bytes = store.size_bytes()
+    return {
+        "sse_streams": b["streams"],
+        "sse_queue_depth_total": b["queueDepthTotal"],
+        "sse_queue_depth_max": b["queueDepthMax"],
+        "sessions": sessions.count(),
+        "state_bytes": state_bytes,
+        "geometry_cache_entries": len(_geometry_cache),
+        "games_loaded": g["loaded"],
+        "games_memory_bytes": g["memoryBytes"],
+        "threads": threading.active_count(),
+        "http_connections": Handler.open_connections,
+        "http_pool_busy": pool["busy"],
+        "http_pool_pending": pool["pending"],
+        "streams_open": pool["streams"],
+        "rate_limit_buckets": rate_limiter.size(),
+        # Each worker process keeps its own metrics; this says which one answered.
+        "worker_pid": os.getpid(),
+    }
+
+
+# POST routes that never write the state and so skip the state lock.
+READ_ONLY_POSTS = frozenset({"/api/territory/info", "/api/positions", "/api/admin/queue/lease", "/api/admin/queue/release"})
+# Long-lived connections: no request duration or profile for these.
+STREAM_PATHS = frozenset({"/api/stream", "/api/ws", "/api/admin/export", "/api/admin/import", "/api/admin/replay"})
+
+
+class Handler(SimpleHTTPRequestHandler):
+    # HTTP/1.1 keep-alive: every response carries Content-Length (or closes
+    # the connection, like the SSE stream). The socket timeout is
+    # REQUEST_TIMEOUT_S while a request is read or answered and
+    # KEEPALIVE_IDLE_S while waiting for the next one. Beyond KEEPALIVE_MAX
+    # open non-stream connections, or while every pool thread is taken,
+    # responses say "Connection: close" so idle sockets give their thread
+    # back to connections waiting in the backlog.
+    protocol_version = "HTTP/1.1"
+    timeout = REQUEST_TIMEOUT_S
+    disable_nagle_algorithm = True
+    open_connections = 0
+    _open_lock = threading.Lock()
+    _status = 0
+    _unmatched = False
+    _body_read = False
+    _connection_header = False
+    _requests = 0
+
+    def setup(self) -> None:
+        super().setup()
+        with Handler._open_lock:
+            Handler.open_connections += 1
+        metrics.inc("http_connections_total")
+
+    def finish(self) -> None:
+        try:
+            super().finish()
+        finally:
+            with Handler._open_lock:
+                Handler.open_connections -= 1
+
+    def handle_one_request(self) -> None:
+        # Waiting for a request line, first or next, costs a pool thread.
+        self.connection.settimeout(KEEPALIVE_IDLE_S)
+        self._requests += 1
+        self._body_read = False
+        self._connection_header = False
+        super().handle_one_request()
+
+    def parse_request(self) -> bool:
+        self.connection.settimeout(self.timeout)
+        return super().parse_request()
+
+    def send_response(self, code, message=None) -> None:
+        self._status = int(code)
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value) -> None:
+        if keyword.lower() == "connection":
+            self._connection_header = True
+        super().send_header(keyword, value)
+
+    def end_headers(self) -> None:
+        if not self._connection_header and self.request_version == "HTTP/1.1":
+            if self.close_connection:
+                self.send_header("Connection", "close")
+            elif Handler.open_connections - self.server.streams > KEEPALIVE_MAX or self.server.saturated():
+                metrics.inc("http_keepalive_refused_total")
+                self.send_header("Connection", "close")
+            else:
+                self.send_header("Keep-Alive", f"timeout={int(KEEPALIVE_IDLE_S)}")
+        super().end_headers()
+
+    def drain_body(self) -> None:
+        # An unread request body would be parsed as the next request on a
+        # kept-alive connection: skip it, or give up on the connection.
+        if self._body_read:
+            return
+        self._body_read = True
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.close_connection = True
+            return
+        if length > MAX_DRAIN_BYTES:
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(length, 65536))
+            if not chunk:
+                self.close_connection = True
+                return
+            length -= len(chunk)
+
+    def do_GET(self) -> None:
+        self.instrumented(self.handle_get)
+
+    def do_POST(self) -> None:
+        self.instrumented(self.locked_post)
+
+    def locked_post(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/api/admin/import":
+            self.handle_import()
+            return
+        body = read_json_body(self)
+        if self.rate_limited(path, str(body.get("token") or "")):
+            return
+        if path in READ_ONLY_POSTS:
+            self.handle_post(body)
+            return
+        with state_lock:
+            self.handle_post(body)
+
+    def handle_import(self) -> None:
+        # The body is an export stream, read and applied a line at a time off
+        # the request pool; the state lock is only taken to swap the game in.
+        token = (parse_qs(urlparse(self.path).query).get("token") or [""])[0]
+        if self.rate_limited("/api/admin/import", token):
+            self.drain_body()
+            return
+        session = sessions.get(token)
+        if not session or session.get("role") != "admin":
+            self.drain_body()
+            json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+            return
+        try:
+            length = -1 if self.headers.get("Transfer-Encoding") else int(self.headers.get("Content-Length") or "")
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            json_response(self, HTTPStatus.LENGTH_REQUIRED, {"error": "Chybí délka těla požadavku."})
+            return
+        if not self.open_stream(token):
+            self.drain_body()
+            return
+        self._body_read = True
+        job = GameImport(current_game())
+        line_no = 0
+        try:
+            try:
+                while length > 0:
+                    line = self.rfile.readline(min(length, IMPORT_MAX_LINE + 1))
+                    if not line:
+                        raise ValueError("Export je neúplný.")
+                    length -= len(line)
+                    line_no += 1
+                    if len(line) > IMPORT_MAX_LINE:
+                        raise ValueError("Příliš dlouhý řádek.")
+                    if line.strip():
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            raise ValueError("Neplatný JSON.")
+                        job.add(rec)
+            except ValueError as e:
+                self.close_connection = length > 0
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": f"{e} (řádek {line_no})"})
+                return
+            with state_lock:
+                try:
+                    result = job.commit()
+                except ValueError as e:
+                    json_response(self, HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                    return
+                broadcaster.broadcast_state(job.state)
+            metrics.inc("game_imports_total")
+            json_response(self, HTTPStatus.OK, {"ok": True, **result})
+        finally:
+            job.discard()
+            self.server.close_stream(token)
+
+    def client_ip(self) -> str:
+        if TRUST_PROXY:
+            forwarded = self.headers.get("X-Forwarded-For", "")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return self.client_address[0]
+
+    def rate_limited(self, path: str, token: str) -> bool:
+        # Sessions are limited by token (teams behind one NAT do not share a
+        # budget), everything else and logins by client IP. Only a live
+        # session gets its own bucket, or a fresh made-up token would too.
+        route_class = RateLimiter.route_class(self.command, path) if RATE_LIMIT else None
+        if route_class is None:
+            return False
+        key = token if token and route_class != "login" and sessions.get(token) else self.client_ip()
+        wait_s = rate_limiter.take(route_class, key)
+        if not wait_s:
+            return False
+        json_response(
+            self,
+            HTTPStatus.TOO_MANY_REQUESTS,
+            {"error": "Příliš mnoho požadavků, zkus to za chvíli.", "retryAfterS": math.ceil(wait_s)},
+            headers={"Retry-After": str(math.ceil(wait_s))},
+        )
+        return True
+
+    def open_stream(self, token: str) -> bool:
+        reason = self.server.open_stream(token)
+        if reason is None:
+            return True
+        metrics.inc("http_shed_total", reason=reason)
+        error = "Příliš mnoho otevřených spojení s tímto přihlášením." if reason == "session_streams" else "Server je přetížený, zkus to za chvíli."
+        json_response(self, HTTPStatus.SERVICE_UNAVAILABLE, {"error": error, "retryAfterS": 5}, headers={"Retry-After": "5"})
+        return False
+
+    def instrumented(self, fn) -> None:
+        if self.command != "POST":
+            self.drain_body()
+        m = GAME_ID_RE.match(urlparse(self.path).path)
+        game = games.acquire(m.group(1) if m else "")
+        if game is None:
+            self.drain_body()
+            json_response(self, HTTPStatus.NOT_FOUND, {"error": "Hra neexistuje."})
+            return
+        try:
+            if m and not m.group(2):
+                self.drain_body()
+                # /g/<id> -> /g/<id>/ so relative links in the pages resolve inside the game.
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header("Location", f"{game.url_prefix}/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if m:
+                self.path = self.path[len(f"/g/{game.id}"):]
+            with game.bound():
+                self.timed_request(fn)
+        finally:
+            games.release(game)
+            if not self._body_read:
+                # The response is already out; the connection cannot be
+                # trusted for another request.
+                self.close_connection = True
+
+    def timed_request(self, fn) -> None:
+        t0 = time.perf_counter()
+        self._status = 0
+        self._unmatched = False
+        path = urlparse(self.path).path
+        trace = profiler.begin() if path.startswith("/api/") and path not in STREAM_PATHS and not path.startswith("/api/admin/profil") else None
+        try:
+            if trace is None:
+                fn()
+            else:
+                profiler.run(trace, fn)
+        finally:
+            if not path.startswith("/api/"):
+                route = "static"
+            elif self._unmatched or (self._status >= 400 and path not in metrics.routes):
+                # Errors on paths that never answered successfully (unknown
+                # endpoints, junk behind the auth check) share one label to
+                # keep cardinality bounded.
+                route = "unmatched"
+            else:
+                metrics.routes.add(path)
+                route = path
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+            metrics.inc("http_requests_total", method=self.command, route=route, status=self._status)
+            if route not in STREAM_PATHS:
+                metrics.observe("http_request_duration", elapsed_ms, route=route)
+            if trace is not None:
+                profiler.finish(trace, self.command, route, self._status, elapsed_ms)
+
+    def translate_path(self, path: str) -> str:
+        base = PUBLIC_DIR
+        p = urlparse(path).path
+        if p.startswith("/uploads/"):
+            return os.path.join(current_game().uploads_dir, p.replace("/uploads/", "", 1))
+        if p == "/":
+            p = "/index.html"
+        local = os.path.normpath(os.path.join(base, p.lstrip("/")))
+        if not local.startswith(os.path.normpath(base)):
+            return base
+        return local
+
+    def handle_get(self) -> None:
+        parsed = urlparse(self.path)
+        if parsed.path.startswith("/api/") and self.rate_limited(parsed.path, (parse_qs(parsed.query).get("token") or [""])[0]):
+            return
+        if parsed.path == "/healthz":
+            ready = server_ready.is_set()
+            json_response(
+                self,
+                HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE,
+                {"ready": ready, "warmupMs": warmup_ms, "uptimeS": metrics.uptime_s(), "worker": os.getpid()},
+            )
+            return
+
+        if parsed.path == "/api/state":
+            try:
+                state = read_state()
+                qs = parse_qs(parsed.query)
+                token = (qs.get("token") or [""])[0]
+                session = sessions.get(token)
+                encoding = requested_geometry_encoding(qs)
+                level = requested_geometry_level(state, qs)
+                json_response(
+                    self,
+                    HTTPStatus.OK,
+                    sanitize_state_for_client(state, session, geometry_encoding=encoding, geometry_level=level),
+                )
+            except Exception as e:
+                json_response(self, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if parsed.path == "/api/geometry":
+            try:
+                state = read_state()
+                qs = parse_qs(parsed.query)
+                geometry = territory_geometry(state)
+                if geometry is None:
+                    json_response(self, HTTPStatus.NOT_FOUND, {"error": "Mapa nemá geometrii."})
+                    return
+                encoding = requested_geometry_encoding(qs)
+                level = requested_geometry_level(state, qs)
+                precision = geometry_precision(state.get("config", {}) or {})
+                territories_out = []
+                for i, tid in enumerate(geometry.ids):
+                    row = {"id": tid, "labelPoint": geometry.label_point(i)}
+                    if encoding == "polyline":
+                        row["polylineEnc"] = geometry.polyline(i, precision, level)
+                    else:
+                        row["polygon"] = geometry.polygon(i, level)
+                    territories_out.append(row)
+                payload = {
+                    "geometryLevels": geometry.tolerances,
+                    "geometryLevel": level,
+                    "territories": territories_out,
+                }
+                if encoding == "polyline":
+                    payload["geometryEncoding"] = {"format": "polyline", "precision": precision}
+                json_response(self, HTTPStatus.OK, payload)
+            except Exception as e:
+                json_response(self, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+            return
+
+        if parsed.path == "/api/admin/metrics":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            gauges = metrics_gauges(self.server)
+            if (qs.get("format") or [""])[0] == "prometheus":
+                body = metrics.prometheus(gauges).encode("utf-8")
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            json_response(self, HTTPStatus.OK, {**metrics.snapshot(), "gauges": gauges})
+            return
+
+        if parsed.path == "/api/admin/positions":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            try:
+                since_ms = int((qs.get("sinceMs") or ["0"])[0] or 0)
+            except ValueError:
+                since_ms = 0
+            trail = (qs.get("trail") or ["1"])[0] != "0"
+            json_response(self, HTTPStatus.OK, {"teams": positions.snapshot(since_ms, trail)})
+            return
+
+        if parsed.path == "/api/admin/queue":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            try:
+                offset = max(0, int((qs.get("offset") or ["0"])[0] or 0))
+                limit = max(1, min(500, int((qs.get("limit") or [str(ReviewQueue.PAGE_SIZE)])[0] or ReviewQueue.PAGE_SIZE)))
+            except ValueError:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatné stránkování."})
+                return
+            json_response(self, HTTPStatus.OK, review_queue.page(read_state(), offset, limit, holder=ReviewQueue.holder(session)))
+            return
+
+        if parsed.path == "/api/admin/history":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+
+            def qs_int(name: str) -> int | None:
+                v = (qs.get(name) or [""])[0]
+                return int(v) if v else None
+
+            try:
+                limit = max(1, min(1000, qs_int("limit") or 100))
+                filters = {
+                    "team_id": (qs.get("teamId") or [""])[0] or None,
+                    "territory_id": (qs.get("territoryId") or [""])[0] or None,
+                    "kind": (qs.get("kind") or [""])[0] or None,
+                    "since_ms": qs_int("sinceMs"),
+                    "until_ms": qs_int("untilMs"),
+                    "before": qs_int("before"),
+                }
+            except ValueError:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatný filtr."})
+                return
+            json_response(self, HTTPStatus.OK, {"storage": store.kind, **store.history(limit=limit, **filters)})
+            return
+
+        if parsed.path == "/api/events":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            role = (session or {}).get("role")
+            if role not in ("admin", "team"):
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Neplatná session."})
+                return
+
+            def qs_int(name: str) -> int | None:
+                v = (qs.get(name) or [""])[0]
+                return int(v) if v else None
+
+            try:
+                limit = max(1, min(500, qs_int("limit") or 100))
+                filters = {
+                    "after": qs_int("after"),
+                    "before": qs_int("before"),
+                    # Teams only ever see their own events.
+                    "team_id": ((qs.get("team") or [""])[0] or None) if role == "admin" else str(session.get("teamId") or ""),
+                    "territory_id": (qs.get("territory") or [""])[0] or None,
+                    "kind": (qs.get("kind") or [""])[0] or None,
+                    "since_ms": qs_int("sinceMs"),
+                    "until_ms": qs_int("untilMs"),
+                }
+            except ValueError:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatný filtr."})
+                return
+            start_seq = int(read_state().get("eventStartSeq") or 0)
+            page = event_log.query(limit=limit, floor=start_seq, **filters)
+            allow = ("seq", "id", "tsMs", "kind", "territoryId", "teamId", "fromTeamId", "toTeamId", "result")
+            page["events"] = [{k: ev[k] for k in allow if k in ev} for ev in page["events"]]
+            json_response(self, HTTPStatus.OK, {**page, "startSeq": start_seq})
+            return
+
+        if parsed.path == "/api/admin/export":
+            qs = parse_qs(parsed.query)
+            token = (qs.get("token") or [""])[0]
+            session = sessions.get(token)
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            if not self.open_stream(token):
+                return
+            try:
+                state = read_state()
+                records = export_records(state, uploads=(qs.get("uploads") or [""])[0] == "1")
+                try:
+                    header = next(records)
+                except ValueError as e:
+                    json_response(self, HTTPStatus.CONFLICT, {"error": str(e)})
+                    return
+                filename = f"{current_game().id or 'hra'}-{time.strftime('%Y%m%d-%H%M%S')}.ndjson"
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                out = bytearray((json.dumps(header, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+                for rec in records:
+                    out.extend((json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+                    if len(out) > 65536:
+                        self.wfile.write(out)
+                        out.clear()
+                self.wfile.write(out)
+                metrics.inc("game_exports_total")
+            except ValueError as e:
+                # Headers are out: drop the connection so the file has no end record.
+                print(f"Export aborted: {e}")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.server.close_stream(token)
+            return
 
+        if parsed.path in ("/api/admin/replay", "/api/admin/replay/snapshot"):
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
 
-sessions = Sessions()
+            def qs_int(name: str) -> int | None:
+                v = (qs.get(name) or [""])[0]
+                return int(v) if v else None
 
+            state = read_state()
+            teams = [{"id": str(t["id"]), "name": t["name"], "color": t["color"]} for t in state.get("teams", [])]
+            territories = [z for z in state.get("territories", []) or [] if isinstance(z, dict) and z.get("id")]
+            try:
+                to_ms = qs_int("toMs") or qs_int("atMs") or now_ms()
+                from_ms = qs_int("fromMs") or int((state.get("config", {}) or {}).get("gameStartMs") or 0)
+                step_ms = max(100, qs_int("stepMs") or 1000)
+            except ValueError:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatný filtr."})
+                return
 
-def json_response(handler: SimpleHTTPRequestHandler, status: int, payload: dict) -> None:
-    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    handler.send_response(status)
-    handler.send_header("Content-Type", "application/json; charset=utf-8")
-    handler.send_header("Content-Length", str(len(body)))
-    handler.end_headers()
-    handler.wfile.write(body)
+            if parsed.path == "/api/admin/replay/snapshot":
+                # GeoJSON for the debrief: the map as it was at atMs.
+                _, owners = ownership.at(to_ms)
+                team_by_id = {t["id"]: t for t in teams}
+                geometry = territory_geometry(state)
+                features = []
+                for z in territories:
+                    ring = [[p[1], p[0]] for p in territory_polygon(state, z, geometry)]
+                    if ring and ring[0] != ring[-1]:
+                        ring.append(ring[0])
+                    owner = owners.get(str(z["id"]))
+                    team = team_by_id.get(owner) or {}
+                    features.append(
+                        {
+                            "type": "Feature",
+                            "properties": {
+                                "id": z["id"],
+                                "name": z.get("name"),
+                                "ownerTeamId": owner,
+                                "ownerName": team.get("name"),
+                                "color": team.get("color"),
+                            },
+                            "geometry": {"type": "Polygon", "coordinates": [ring]} if ring else None,
+                        }
+                    )
+                json_response(self, HTTPStatus.OK, {"type": "FeatureCollection", "atMs": to_ms, "features": features})
+                return
 
+            # NDJSON: a header, the full owner array at fromMs, then one frame
+            # per stepMs bucket in which something changed, as [index, team]
+            # pairs. Team -1 is nobody. Read from the ownership log as it is
+            # written out, so the whole game is never held in memory.
+            territory_ids = [str(z["id"]) for z in territories]
+            index = {tid: i for i, tid in enumerate(territory_ids)}
+            team_index = {t["id"]: i for i, t in enumerate(teams)}
+            seq, owners = ownership.at(from_ms)
+            last = ownership.log.seq_at(to_ms)
+            shown = [team_index.get(owners.get(tid), -1) for tid in territory_ids]
+            token = (qs.get("token") or [""])[0]
+            if not self.open_stream(token):
+                return
+            out = bytearray()
+            frames = 0
+
+            def emit(obj: dict, flush: bool = False) -> None:
+                out.extend((json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+                if flush or len(out) > 65536:
+                    self.wfile.write(out)
+                    out.clear()
+
+            def emit_frame(t: int, changed: set) -> None:
+                nonlocal frames
+                frame = []
+                for tid in changed:
+                    i = index.get(tid)
+                    team = team_index.get(owners.get(tid), -1)
+                    if i is not None and shown[i] != team:
+                        shown[i] = team
+                        frame.append([i, team])
+                if frame:
+                    emit({"type": "frame", "t": t, "set": sorted(frame)})
+                    frames += 1
 
-def read_json_body(handler: SimpleHTTPRequestHandler) -> dict:
-    length = int(handler.headers.get("Content-Length", "0"))
-    raw = handler.rfile.read(length) if length > 0 else b"{}"
-    try:
-        return json.loads(raw.decode("utf-8"))
-    except Exception:
-        return {}
+            try:
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                emit({"type": "header", "fromMs": from_ms, "toMs": to_ms, "stepMs": step_ms, "territories": territory_ids, "teams": teams})
+                emit({"type": "frame", "t": from_ms, "owners": shown}, flush=True)
+                frames = 1
+                bucket = None
+                changed: set[str] = set()
+                for rec in ownership.log.scan(seq + 1, last):
+                    t = from_ms - (from_ms - int(rec.get("tsMs") or 0)) // step_ms * step_ms
+                    if bucket is not None and t != bucket:
+                        emit_frame(bucket, changed)
+                        changed.clear()
+                    bucket = t
+                    changed.update(owners if rec.get("kind") == "checkpoint" else ())
+                    changed.update(rec.get("owners") or {})
+                    OwnershipHistory.apply(owners, rec)
+                if bucket is not None:
+                    emit_frame(bucket, changed)
+                emit({"type": "end", "frames": frames}, flush=True)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self.server.close_stream(token)
+            return
 
+        if parsed.path == "/api/admin/profiles":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            try:
+                limit = max(1, min(1000, int((qs.get("limit") or ["100"])[0])))
+            except ValueError:
+                limit = 100
+            json_response(
+                self,
+                HTTPStatus.OK,
+                {"settings": profiler.settings(), "slow": profiler.slow_log_tail(limit), "profiles": profiler.profile_files()},
+            )
+            return
 
-class Handler(SimpleHTTPRequestHandler):
-    def translate_path(self, path: str) -> str:
-        base = PUBLIC_DIR
-        p = urlparse(path).path
-        if p.startswith("/uploads/"):
-            return os.path.join(UPLOADS_DIR, p.replace("/uploads/", "", 1))
-        if p == "/":
-            p = "/index.html"
-        local = os.path.normpath(os.path.join(base, p.lstrip("/")))
-        if not local.startswith(os.path.normpath(base)):
-            return base
-        return local
+        if parsed.path == "/api/admin/profiles/download":
+            qs = parse_qs(parsed.query)
+            session = sessions.get((qs.get("token") or [""])[0])
+            if not session or session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            name = str((qs.get("name") or [""])[0])
+            allowed = {p["name"] for p in profiler.profile_files()} | {os.path.basename(SLOW_LOG_PATH)}
+            if name not in allowed or not os.path.isfile(os.path.join(PROFILE_DIR, name)):
+                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Profil neexistuje."})
+                return
+            with open(os.path.join(PROFILE_DIR, name), "rb") as f:
+                body = f.read()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/x-ndjson" if name.endswith(".jsonl") else "application/octet-stream")
+            self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
 
-    def do_GET(self) -> None:
-        parsed = urlparse(self.path)
-        if parsed.path == "/api/state":
-            try:
-                state = read_state()
-                qs = parse_qs(parsed.query)
-                token = (qs.get("token") or [""])[0]
-                session = sessions.get(token)
-                json_response(self, HTTPStatus.OK, sanitize_state_for_client(state, session))
-            except Exception as e:
-                json_response(self, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+        if parsed.path == "/api/ws":
+            self.handle_websocket(parse_qs(parsed.query))
             return
 
         if parsed.path == "/api/stream":
@@ -847,27 +4846,36 @@ class Handler(SimpleHTTPRequestHandler):
             if not session:
                 json_response(self, HTTPStatus.UNAUTHORIZED, {"error": "Přihlášení vypršelo."})
                 return
+            if not self.open_stream(token):
+                return
 
             cid, q = broadcaster.add_client(session)
-            self.send_response(HTTPStatus.OK)
-            self.send_header("Content-Type", "text/event-stream")
-            self.send_header("Cache-Control", "no-cache")
-            self.send_header("Connection", "keep-alive")
-            self.end_headers()
-
             try:
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                # No Content-Length: the stream ends when the connection does.
+                self.send_header("Connection", "close")
+                self.end_headers()
                 state = read_state()
-                initial = json.dumps(sanitize_state_for_client(state, session), ensure_ascii=False)
+                encoding = requested_geometry_encoding(qs)
+                level = requested_geometry_level(state, qs)
+                initial = json.dumps(
+                    sanitize_state_for_client(state, session, geometry_encoding=encoding, geometry_level=level),
+                    ensure_ascii=False,
+                )
                 self.wfile.write(f"event: state\ndata: {initial}\n\n".encode("utf-8"))
                 self.wfile.flush()
 
                 last_ping = time.time()
                 while True:
                     try:
-                        msg = q.get(timeout=1.0)
-                        self.wfile.write(msg.encode("utf-8"))
+                        event, data = q.get(timeout=1.0)
+                        self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
                         self.wfile.flush()
                     except Empty:
+                        if peer_closed(self.connection):
+                            break
                         if time.time() - last_ping > 15:
                             self.wfile.write(b": ping\n\n")
                             self.wfile.flush()
@@ -882,13 +4890,126 @@ class Handler(SimpleHTTPRequestHandler):
                 pass
             finally:
                 broadcaster.remove_client(cid)
+                self.server.close_stream(token)
             return
 
+        self._unmatched = parsed.path.startswith("/api/")
         return super().do_GET()
 
-    def do_POST(self) -> None:
+    def handle_websocket(self, qs: dict) -> None:
+        # One connection for state pushes and actions. Client messages are
+        # {"id", "path", "body"} for any POST route and are answered with
+        # {"id", "status", "body"}; pushes are {"event", "data"}, the same
+        # events /api/stream sends.
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        if "websocket" not in self.headers.get("Upgrade", "").lower() or not key:
+            json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Očekáván WebSocket."})
+            return
+        token = (qs.get("token") or [""])[0]
+        session = sessions.get(token)
+        if not session:
+            json_response(self, HTTPStatus.UNAUTHORIZED, {"error": "Přihlášení vypršelo."})
+            return
+        if not self.open_stream(token):
+            return
+        try:
+            self.serve_websocket(qs, key, token, session)
+        finally:
+            self.server.close_stream(token)
+
+    def serve_websocket(self, qs: dict, key: str, token: str, session: dict) -> None:
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(HTTPStatus.SWITCHING_PROTOCOLS)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+
+        ws = WebSocket(self.connection)
+        cid, q = broadcaster.add_client(session)
+        done = threading.Event()
+
+        def push() -> None:
+            last_sent = time.monotonic()
+            try:
+                while not done.is_set():
+                    try:
+                        event, data = q.get(timeout=1.0)
+                    except Empty:
+                        if time.monotonic() - last_sent >= WS_PING_S:
+                            ws.send_frame(0x9, b"")
+                            last_sent = time.monotonic()
+                        continue
+                    ws.send(f'{{"event":"{event}","data":{data}}}')
+                    last_sent = time.monotonic()
+            except OSError:
+                pass
+            finally:
+                done.set()
+                ws.close()
+
+        try:
+            state = read_state()
+            initial = json.dumps(
+                sanitize_state_for_client(
+                    state, session, geometry_encoding=requested_geometry_encoding(qs), geometry_level=requested_geometry_level(state, qs)
+                ),
+                ensure_ascii=False,
+            )
+            ws.send(f'{{"event":"state","data":{initial}}}')
+            threading.Thread(target=push, daemon=True).start()
+            while not done.is_set():
+                text = ws.receive()
+                if text is None:
+                    break
+                self.handle_ws_message(ws, token, text)
+        except (OSError, ValueError):
+            pass
+        finally:
+            done.set()
+            broadcaster.remove_client(cid)
+            ws.close()
+
+    def handle_ws_message(self, ws: WebSocket, token: str, text: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            msg = json.loads(text)
+        except ValueError:
+            msg = None
+        if not isinstance(msg, dict) or not str(msg.get("path") or "").startswith("/api/"):
+            ws.send(json.dumps({"id": None, "status": 400, "body": {"error": "Neplatná zpráva."}}, ensure_ascii=False))
+            return
+        path = urlparse(str(msg["path"])).path
+        body = msg.get("body") if isinstance(msg.get("body"), dict) else {}
+        route_class = RateLimiter.route_class("POST", path) if RATE_LIMIT else None
+        wait_s = rate_limiter.take(route_class, token) if route_class else 0.0
+        if wait_s:
+            ws.send(json.dumps({"id": msg.get("id"), "status": 429, "body": {"error": "Příliš mnoho požadavků, zkus to za chvíli.", "retryAfterS": math.ceil(wait_s)}}, ensure_ascii=False))
+            return
+        # The connection is authenticated once; actions run as that session.
+        call = WsCall(path)
+        body = {**body, "token": token}
+        try:
+            if path in READ_ONLY_POSTS:
+                Handler.handle_post(call, body)
+            else:
+                with state_lock:
+                    Handler.handle_post(call, body)
+        except Exception as e:
+            call.reply = (HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+        status, payload = call.reply or (HTTPStatus.NOT_FOUND, {"error": "Neznámá akce."})
+        if call._unmatched or call.reply is None or (status >= 400 and path not in metrics.routes):
+            route = "unmatched"
+        else:
+            metrics.routes.add(path)
+            route = path
+        metrics.inc("ws_messages_total", route=route, status=status)
+        metrics.observe("ws_message_duration", (time.perf_counter() - t0) * 1000.0, route=route)
+        ws.send(json.dumps({"id": msg.get("id"), "status": status, "body": payload}, ensure_ascii=False))
+
+    def handle_post(self, body: dict) -> None:
         parsed = urlparse(self.path)
-        body = read_json_body(self)
 
         if parsed.path == "/api/login":
             team_id = str(body.get("teamId") or "")
@@ -969,7 +5090,7 @@ class Handler(SimpleHTTPRequestHandler):
                 del fc["token"]
 
             # Save to data/CTH_geo.geojson
-            path = os.path.join(DATA_DIR, "CTH_geo.geojson")
+            path = os.path.join(current_game().data_dir, "CTH_geo.geojson")
             with open(path, "w", encoding="utf-8") as f:
                 json.dump(fc, f, ensure_ascii=False, indent=2)
             
@@ -992,6 +5113,50 @@ class Handler(SimpleHTTPRequestHandler):
             json_response(self, HTTPStatus.UNAUTHORIZED, {"error": "Přihlášení vypršelo."})
             return
 
+        if parsed.path in ("/api/admin/queue/lease", "/api/admin/queue/release"):
+            # Leases are memory only: no state write, no state lock.
+            if session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            key = str(body.get("key") or "") or None
+            holder = ReviewQueue.holder(session)
+            if parsed.path.endswith("/release"):
+                if key is None:
+                    json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí key."})
+                    return
+                json_response(self, HTTPStatus.OK, {"ok": True, "released": review_queue.release(key, holder)})
+                return
+            if not review_queue.ready:
+                review_queue.update(read_state())
+            result, item = review_queue.lease(key, holder)
+            metrics.inc("review_leases_total", result=result)
+            if result == "empty":
+                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Žádné volné požadavky."})
+            elif result == "missing":
+                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Žádost už nejspíš byla vyřízena."})
+            elif result == "leased":
+                json_response(self, HTTPStatus.CONFLICT, {"error": "Žádost právě vyřizuje jiný admin.", "item": item})
+            else:
+                json_response(self, HTTPStatus.OK, {"ok": True, "item": item, "holder": holder})
+            return
+
+        if parsed.path == "/api/positions":
+            # Hot path for phones: memory only, never the state or its lock.
+            team_id = str(session.get("teamId") or "")
+            if session.get("role") != "team" or not team_id:
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Polohu posílá jen tým."})
+                return
+            samples = parse_position_samples(body.get("samples"))
+            if samples is None:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatné polohy."})
+                return
+            kept = positions.ingest(team_id, samples)
+            if samples:
+                bus.publish("positions", game=current_game().id, teamId=team_id, samples=samples)
+            metrics.inc("positions_samples_total", len(samples))
+            json_response(self, HTTPStatus.OK, {"ok": True, "accepted": len(samples), "kept": kept})
+            return
+
         if parsed.path == "/api/territory/info":
             territory_id = str(body.get("territoryId") or "")
             state = read_state()
@@ -1281,10 +5446,19 @@ class Handler(SimpleHTTPRequestHandler):
                 "lat": lat,
                 "lng": lng,
             }
+            gps = check_gps_position(state, territory_id, lat, lng)
+            if gps is not None:
+                req.update(gps)
+                metrics.inc("gps_checks_total", result=gps["gpsCheck"])
+                if gps["gpsCheck"] in ("inside", "buffer") and is_gps_auto_approve(state):
+                    req["status"] = "approved"
+                    req["resolvedAtMs"] = req["createdAtMs"]
+                    req["expiresAtMs"] = req["createdAtMs"] + 10 * 60 * 1000
+                    req["autoApproved"] = True
             state.setdefault("claimVerifyRequests", []).append(req)
             write_state(state)
             broadcaster.broadcast_state(state)
-            json_response(self, HTTPStatus.OK, {"ok": True, "claimVerifyRequestId": req["id"]})
+            json_response(self, HTTPStatus.OK, {"ok": True, "claimVerifyRequestId": req["id"], "status": req["status"]})
             return
 
         if parsed.path == "/api/territory/claimRequest":
@@ -1494,6 +5668,8 @@ class Handler(SimpleHTTPRequestHandler):
             state["claimRequests"] = []
             state["claimVerifyRequests"] = []
             state["eventLog"] = []
+            # The on-disk log keeps earlier rounds; /api/events starts here.
+            state["eventStartSeq"] = int(state.get("eventSeq") or 0)
             state["teamEverOwned"] = {}
             state["teamStats"] = {}
             # state["gpsOkByTerritoryId"] is client side, no need to clear here
@@ -1511,6 +5687,18 @@ class Handler(SimpleHTTPRequestHandler):
             json_response(self, HTTPStatus.OK, {"ok": True})
             return
 
+        if parsed.path == "/api/admin/profiling":
+            if session.get("role") != "admin":
+                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
+                return
+            try:
+                profiler.configure(body)
+            except (TypeError, ValueError):
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Neplatné nastavení profilování."})
+                return
+            json_response(self, HTTPStatus.OK, {"ok": True, "settings": profiler.settings()})
+            return
+
         if parsed.path == "/api/admin/game/setLocked":
             if session.get("role") != "admin":
                 json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
@@ -1544,220 +5732,57 @@ class Handler(SimpleHTTPRequestHandler):
             json_response(self, HTTPStatus.OK, {"ok": True, "gameLocked": bool(cfg["gameLocked"])})
             return
 
-        if parsed.path == "/api/admin/claimRequest/resolve":
+        if parsed.path in ADMIN_DECISIONS:
             if session.get("role") != "admin":
                 json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
                 return
-            request_id = str(body.get("claimRequestId") or "")
-            correct_raw = body.get("correct")
-            approve_raw = body.get("approve")
-            if correct_raw is None:
-                correct_raw = approve_raw
-
-            correct = False
-            if isinstance(correct_raw, bool):
-                correct = correct_raw
-            elif isinstance(correct_raw, (int, float)):
-                correct = bool(correct_raw)
-            else:
-                correct = str(correct_raw or "").strip().lower() in ("1", "true", "yes", "y", "ok")
-            if not request_id:
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí claimRequestId."})
-                return
-
             state = read_state()
-            if is_game_locked(state):
-                json_response(self, HTTPStatus.LOCKED, {"error": "Hra je ukončená."})
-                return
-            req = next(
-                (r for r in (state.get("claimRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
-                None,
-            )
-            if not req:
-                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."})
-                return
-            if req.get("status", "pending") != "pending":
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Žádost už je vyřízená."})
-                return
-
-            territory_id = str(req.get("territoryId") or "")
-            team_id = str(req.get("teamId") or "")
-            territory = next((t for t in state.get("territories", []) if t.get("id") == territory_id), None)
-            if not territory:
-                req["status"] = "rejected"
-                req["rejectReason"] = "territoryMissing"
-                req["resolvedAtMs"] = now_ms()
+            status, payload, changed = ADMIN_DECISIONS[parsed.path](state, body, ReviewQueue.holder(session))
+            if changed:
                 write_state(state)
                 broadcaster.broadcast_state(state)
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Území už neexistuje."})
-                return
-
-            if correct:
-                if territory.get("ownerTeamId") is not None:
-                    req["status"] = "rejected"
-                    req["rejectReason"] = "territoryAlreadyOwned"
-                    req["resolvedAtMs"] = now_ms()
-                    write_state(state)
-                    broadcaster.broadcast_state(state)
-                    json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Území už má vlastníka."})
-                    return
-                
-                # Stats Update
-                ensure_team_stats(state)
-                # Previous owner (should be None here, but for safety)
-                update_territory_ownership_time(state, territory)
-                
-                territory["ownerTeamId"] = team_id
-                
-                # Increment capture count
-                stats = state["teamStats"].get(team_id)
-                if stats:
-                    stats["captures"] = int(stats.get("captures", 0)) + 1
-                
-                req["status"] = "approved"
-                req["rejectReason"] = None
-                req["cooldownUntilMs"] = None
-                
-                # Lock for 30 mins after capture
-                lock_until = now_ms() + 30 * 60 * 1000
-                set_territory_lock(state, territory_id, lock_until)
-
-                # RACE CONDITION: Cancel all other pending claims/verifications for this territory
-                # 1. Cancel pending claimRequests
-                for other_req in state.get("claimRequests", []) or []:
-                    if (
-                        isinstance(other_req, dict)
-                        and other_req.get("territoryId") == territory_id
-                        and other_req.get("status") == "pending"
-                        and other_req.get("id") != req["id"]
-                    ):
-                        other_req["status"] = "rejected"
-                        other_req["rejectReason"] = "territoryCapturedByOther"
-                        other_req["resolvedAtMs"] = now_ms()
-                
-                # 2. Cancel pending/active verifications
-                for other_ver in state.get("claimVerifyRequests", []) or []:
-                    if (
-                        isinstance(other_ver, dict)
-                        and other_ver.get("territoryId") == territory_id
-                        and other_ver.get("status") in ("pending", "approved", "task_assigned")
-                        # We don't necessarily need to cancel the winner's verification, but it's done anyway
-                    ):
-                        other_ver["status"] = "rejected"
-                        other_ver["expiresAtMs"] = None
-                        other_ver["resolvedAtMs"] = now_ms()
-
-            else:
-                req["status"] = "rejected"
-                req["rejectReason"] = "wrongAnswer"
-                cd_until = now_ms() + 30 * 60 * 1000
-                set_lock(state, team_id, territory_id, cd_until)
-                req["cooldownUntilMs"] = cd_until
-            req["resolvedAtMs"] = now_ms()
-            add_event(
-                state,
-                "claim",
-                territory_id=territory_id,
-                team_ids=[team_id],
-                teamId=team_id,
-                result=req.get("status"),
-            )
-
-            write_state(state)
-            broadcaster.broadcast_state(state)
-            json_response(self, HTTPStatus.OK, {"ok": True, "status": req["status"]})
-            return
-
-        if parsed.path == "/api/admin/claimVerifyRequest/resolve":
-            if session.get("role") != "admin":
-                json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
-                return
-            request_id = str(body.get("claimVerifyRequestId") or "")
-            ok_raw = body.get("ok")
-            ok = True
-            if ok_raw is not None:
-                if isinstance(ok_raw, bool):
-                    ok = ok_raw
-                elif isinstance(ok_raw, (int, float)):
-                    ok = bool(ok_raw)
-                else:
-                    ok = str(ok_raw or "").strip().lower() in ("1", "true", "yes", "y", "ok")
-            if not request_id:
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí claimVerifyRequestId."})
-                return
-
-            state = read_state()
-            if is_game_locked(state):
-                json_response(self, HTTPStatus.LOCKED, {"error": "Hra je ukončená."})
-                return
-            req = next(
-                (r for r in (state.get("claimVerifyRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
-                None,
-            )
-            if not req:
-                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."})
-                return
-            if req.get("status", "pending") != "pending":
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Žádost už je vyřízená."})
-                return
-
-            req["resolvedAtMs"] = now_ms()
-            if ok:
-                req["status"] = "approved"
-                req["expiresAtMs"] = now_ms() + 10 * 60 * 1000
-            else:
-                req["status"] = "rejected"
-                req["expiresAtMs"] = None
-
-            write_state(state)
-            broadcaster.broadcast_state(state)
-            json_response(self, HTTPStatus.OK, {"ok": True, "status": req["status"]})
+            json_response(self, status, payload)
             return
 
-        if parsed.path == "/api/admin/claimVerifyRequest/assignTask":
+        if parsed.path == "/api/admin/decisions":
+            # Many decisions, one state write and one broadcast. Each item is
+            # {"action": "claimRequest/resolve" | "claimVerifyRequest/resolve"
+            # | "claimVerifyRequest/assignTask", ...fields of that endpoint}
+            # and gets {"status", "body"}: what the single endpoint would return.
             if session.get("role") != "admin":
                 json_response(self, HTTPStatus.FORBIDDEN, {"error": "Jen admin."})
                 return
-            request_id = str(body.get("claimVerifyRequestId") or "")
-            task_text = str(body.get("task") or "").strip()
-            
-            if not request_id:
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí claimVerifyRequestId."})
+            decisions = body.get("decisions")
+            if not isinstance(decisions, list) or not decisions:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí decisions."})
                 return
-            if not task_text:
-                json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Chybí text úkolu."})
+            if len(decisions) > MAX_BATCH_DECISIONS:
+                json_response(self, HTTPStatus.BAD_REQUEST, {"error": f"Nejvýše {MAX_BATCH_DECISIONS} rozhodnutí najednou."})
                 return
-
             state = read_state()
             if is_game_locked(state):
                 json_response(self, HTTPStatus.LOCKED, {"error": "Hra je ukončená."})
                 return
-            req = next(
-                (r for r in (state.get("claimVerifyRequests", []) or []) if isinstance(r, dict) and r.get("id") == request_id),
-                None,
+            holder = ReviewQueue.holder(session)
+            results = []
+            changed_any = False
+            for decision in decisions:
+                fn = ADMIN_DECISIONS.get(f"/api/admin/{decision.get('action')}") if isinstance(decision, dict) else None
+                if fn is None:
+                    results.append({"status": int(HTTPStatus.BAD_REQUEST), "body": {"error": "Neznámá akce."}})
+                    continue
+                status, payload, changed = fn(state, decision, holder)
+                changed_any = changed_any or changed
+                results.append({"status": int(status), "body": payload})
+            if changed_any:
+                write_state(state)
+                broadcaster.broadcast_state(state)
+            metrics.inc("admin_batch_decisions_total", len(decisions))
+            json_response(
+                self,
+                HTTPStatus.OK,
+                {"ok": True, "applied": sum(1 for r in results if r["status"] < 300), "results": results},
             )
-            if not req:
-                json_response(self, HTTPStatus.NOT_FOUND, {"error": "Žádost neexistuje."})
-                return
-            
-            # Allow assigning task if it's approved OR pending (skip approval step if desired, but UI flows approved->task)
-            # Actually, standard flow is Pending -> Approved -> TaskAssigned
-            if req.get("status") not in ("approved", "pending"): 
-                 # We allow pending too, in case admin wants to skip explicit "OK" and just assign task immediately
-                 pass
-            
-            if req.get("status") == "rejected":
-                 json_response(self, HTTPStatus.BAD_REQUEST, {"error": "Žádost byla zamítnuta."})
-                 return
-
-            req["status"] = "task_assigned"
-            req["assignedTask"] = task_text
-            req["resolvedAtMs"] = now_ms()
-            req["expiresAtMs"] = now_ms() + 60 * 60 * 1000 # 1 hour to complete task
-
-            write_state(state)
-            broadcaster.broadcast_state(state)
-            json_response(self, HTTPStatus.OK, {"ok": True})
             return
 
         if parsed.path == "/api/admin/reset_teams":
@@ -1794,23 +5819,206 @@ class Handler(SimpleHTTPRequestHandler):
             json_response(self, HTTPStatus.OK, {"ok": True})
             return
 
+        self._unmatched = True
         json_response(self, HTTPStatus.NOT_FOUND, {"error": "Neznámý endpoint."})
 
 
 def state_broadcast_worker() -> None:
     while True:
+        for game in games.all():
+            # Idle games have no streams; do not touch their state at all.
+            if game is not games.main and not game.broadcaster.stats()["streams"]:
+                continue
+            try:
+                with game.bound():
+                    state = read_state()
+                    broadcaster.broadcast_state(state)
+            except Exception:
+                pass
         try:
-            state = read_state()
-            broadcaster.broadcast_state(state)
-        except Exception:
-            pass
+            games.evict()
+        except Exception as e:
+            print(f"Game eviction failed: {e}")
+        rate_limiter.sweep()
         time.sleep(5.0)
 
 
-if __name__ == "__main__":
-    os.chdir(os.getcwd())
+def positions_worker() -> None:
+    # Coalesced live positions for admin streams: one event per tick with
+    # the latest fix of every team that moved. Only worker 0 writes the file.
+    while True:
+        time.sleep(POSITIONS_BROADCAST_S)
+        for game in games.all():
+            try:
+                changed = game.positions.take_changed()
+                if changed:
+                    game.broadcaster.broadcast_event("positions", {"teams": changed}, role="admin")
+                if worker_slot == 0:
+                    game.positions.flush()
+            except Exception as e:
+                print(f"Positions update failed: {e}")
+
+
+def leaderboard_worker() -> None:
+    # Holding-time rankings change with the clock alone; re-rank the games
+    # whose next crossing is due. Review leases run out the same way.
+    while True:
+        time.sleep(1.0)
+        for game in games.all():
+            try:
+                with game.bound():
+                    game.leaderboard.tick()
+                    game.review_queue.expire()
+            except Exception as e:
+                print(f"Leaderboard update failed: {e}")
+
+
+def on_bus_positions(msg: dict) -> None:
+    game = games.acquire(str(msg.get("game") or ""))
+    if game is None:
+        return
+    try:
+        game.positions.ingest(str(msg.get("teamId") or ""), [list(p) for p in msg.get("samples") or []])
+    finally:
+        games.release(game)
+
+
+def on_bus_queue_lease(msg: dict) -> None:
+    game = games.peek(str(msg.get("game") or ""))
+    if game is None:
+        return
+    with game.bound():
+        game.review_queue.apply_lease(str(msg.get("key") or ""), str(msg.get("holder") or ""), msg.get("untilMs"))
+
+
+bus.subscribe("positions", on_bus_positions)
+bus.subscribe("queue_lease", on_bus_queue_lease)
+
+server_ready = threading.Event()
+warmup_ms: float | None = None
+worker_slot = 0
+
+
+def warm_up() -> None:
+    # Run the auto-fix chain and load the main map's geometry (from the
+    # persisted cache when it is current) before /healthz reports ready.
+    global warmup_ms
+    t0 = time.perf_counter()
+    try:
+        territory_geometry(read_state())
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+    warmup_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+    server_ready.set()
+    print(f"Připraveno za {warmup_ms} ms (pid {os.getpid()}).")
+
+
+def run_worker(httpd: PooledHTTPServer, slot: int = 0) -> None:
+    global worker_slot
+    worker_slot = slot
+    threading.Thread(target=warm_up, daemon=True).start()
     t2 = threading.Thread(target=state_broadcast_worker, daemon=True)
     t2.start()
-    httpd = ThreadingHTTPServer(("0.0.0.0", PORT), Handler)
-    print(f"Server běží na http://localhost:{PORT}/")
+    threading.Thread(target=positions_worker, daemon=True).start()
+    threading.Thread(target=leaderboard_worker, daemon=True).start()
+    httpd.start_pool()
     httpd.serve_forever()
+
+
+def run_workers(httpd: PooledHTTPServer, count: int) -> None:
+    # Supervisor: fork workers that all accept on the inherited listening
+    # socket, relay bus lines between them and replace workers that die. It
+    # stays single-threaded so forking a replacement is safe.
+    sel = selectors.DefaultSelector()
+    workers: dict[int, tuple[int, socket.socket]] = {}
+    buffers: dict[socket.socket, bytes] = {}
+
+    def spawn(slot: int) -> None:
+        ours, theirs = socket.socketpair()
+        # Flush first or the child inherits and re-prints buffered output.
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            ours.close()
+            for _, s in workers.values():
+                s.close()
+            sel.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            bus.attach(theirs)
+            try:
+                run_worker(httpd, slot)
+            finally:
+                os._exit(0)
+        theirs.close()
+        workers[pid] = (slot, ours)
+        buffers[ours] = b""
+        sel.register(ours, selectors.EVENT_READ)
+        print(f"Worker {slot} běží (pid {pid}).")
+
+    def drop(sock: socket.socket) -> None:
+        try:
+            sel.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        buffers.pop(sock, None)
+        sock.close()
+
+    def stop(signum, frame) -> None:
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(count):
+        spawn(slot)
+    while True:
+        for key, _ in sel.select(timeout=1.0):
+            sock = key.fileobj
+            try:
+                chunk = sock.recv(65536)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                drop(sock)
+                continue
+            data = buffers[sock] + chunk
+            cut = data.rfind(b"\n") + 1
+            buffers[sock] = data[cut:]
+            if not cut:
+                continue
+            for _, other in list(workers.values()):
+                if other is not sock and other in buffers:
+                    try:
+                        other.sendall(data[:cut])
+                    except OSError:
+                        drop(other)
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                break
+            slot, sock = workers.pop(pid, (None, None))
+            if sock is not None:
+                drop(sock)
+            if slot is not None:
+                print(f"Worker {slot} (pid {pid}) skončil ({status}), startuji znovu.")
+                spawn(slot)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["migrate"]:
+        raise SystemExit(migrate_main(sys.argv[2:]))
+    os.chdir(os.getcwd())
+    httpd = PooledHTTPServer(("0.0.0.0", PORT), Handler)
+    print(f"Server běží na http://localhost:{PORT}/")
+    if WORKERS > 1 and hasattr(os, "fork") and fcntl is not None:
+        run_workers(httpd, WORKERS)
+    else:
+        run_worker(httpd)